@@ -0,0 +1 @@
+"""Micro-benchmarks. Run from the repository root, e.g. `python -m benchmarks.bench_mail_list`."""
@@ -0,0 +1,95 @@
+"""
+Wall time to create 200 calendar events, one POST per event versus
+CalendarService.create_events. Graph is replaced by an in-process transport
+that sleeps to simulate network latency: every HTTP round trip costs
+ROUND_TRIP_MS and Graph spends ITEM_MS on each event, including the items of
+a $batch, which it runs one after another.
+
+"sequential": create_event awaited for one event at a time, the way callers
+had to create events before.
+"batched": create_events, which builds every payload in one pass and sends
+them as $batch groups of 20, all groups concurrently.
+"""
+from benchmarks.common import quiet_logging
+
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+from src.core.graph_client import GraphClient
+from src.models.calendar import CreateEventRequest
+from src.services.calendar_service import CalendarService
+
+EVENTS = 200
+ROUND_TRIP_MS = 40
+ITEM_MS = 3
+
+
+def created(body: dict, event_id: str) -> dict:
+    return {"id": event_id, "subject": body["subject"], "start": body["start"],
+            "end": body["end"], "location": body["location"]}
+
+
+async def handler(request: httpx.Request) -> httpx.Response:
+    body = json.loads(request.content)
+    if request.url.path.endswith("/$batch"):
+        items = body["requests"]
+        await asyncio.sleep((ROUND_TRIP_MS + ITEM_MS * len(items)) / 1000)
+        responses = [{"id": item["id"], "status": 201, "body": created(item["body"], item["id"])}
+                     for item in items]
+        return httpx.Response(200, json={"responses": responses})
+    await asyncio.sleep((ROUND_TRIP_MS + ITEM_MS) / 1000)
+    return httpx.Response(201, json=created(body, "1"))
+
+
+def make_service(stats: dict) -> CalendarService:
+    async def counting(request: httpx.Request) -> httpx.Response:
+        stats["requests"] += 1
+        return await handler(request)
+
+    http = httpx.AsyncClient(transport=httpx.MockTransport(counting))
+    return CalendarService(GraphClient("benchmark", http_client=http, cache=False, single_flight=False))
+
+
+def make_requests() -> list:
+    start = datetime(2024, 3, 4, 9)
+    return [CreateEventRequest(subject=f"Visita {i}", start_time=start + timedelta(hours=i),
+                               end_time=start + timedelta(hours=i, minutes=30),
+                               location="Oficina", attendees=[f"cliente{i}@example.com"])
+            for i in range(EVENTS)]
+
+
+async def sequential(service: CalendarService, requests: list) -> int:
+    for request in requests:
+        await service.create_event(request)
+    return len(requests)
+
+
+async def batched(service: CalendarService, requests: list) -> int:
+    return (await service.create_events(requests)).created
+
+
+def run(strategy) -> tuple:
+    stats = {"requests": 0}
+    service = make_service(stats)
+    requests = make_requests()
+    start = time.perf_counter()
+    count = asyncio.run(strategy(service, requests))
+    assert count == EVENTS
+    return time.perf_counter() - start, stats["requests"]
+
+
+def main():
+    quiet_logging()
+    print(f"Create {EVENTS} events, {ROUND_TRIP_MS} ms round trip + {ITEM_MS} ms per event")
+    before, before_calls = run(sequential)
+    after, after_calls = run(batched)
+    print(f"  sequential {before * 1000:8.1f} ms  {before_calls:4d} HTTP requests")
+    print(f"  batched    {after * 1000:8.1f} ms  {after_calls:4d} HTTP requests   {before / after:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
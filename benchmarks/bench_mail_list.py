@@ -0,0 +1,111 @@
+"""
+Per-item cost of GET /api/v1/mail/?top=1000, before and after the fast JSON
+path. Graph is replaced by an in-process transport returning a 1000-message
+page, so only decoding, model building and response serialization are timed.
+
+"before": the original endpoint rebuilt as it was: stdlib json decoding,
+`[Message(**msg) for msg in ...]`, and the model list returned for FastAPI
+to check against response_model and serialize with the default
+JSONResponse.
+"after": the current endpoint: orjson decoding, batch validation with the
+default settings, and the already validated models serialized once.
+
+Stages are reported separately because model construction (EmailStr
+validation in particular) dominates the end-to-end number.
+"""
+from benchmarks.common import graph_messages, measure, quiet_logging
+
+import json
+from contextlib import contextmanager
+from typing import List
+
+import httpx
+from fastapi import Depends, FastAPI
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+from src.api.deps import get_graph_client
+from src.api.responses import models_response
+from src.core import fastjson
+from src.core.config import settings
+from src.core.graph_client import GraphClient
+from src.main import app
+from src.models.mail import Message
+from src.models.projection import select_query
+
+TOP = 1000
+REPEAT = 20
+
+
+def make_client(body: bytes) -> GraphClient:
+    def handler(request):
+        return httpx.Response(200, content=body, headers={"Content-Type": "application/json"})
+
+    http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return GraphClient("benchmark", http_client=http, single_flight=False, cache=False)
+
+
+legacy_app = FastAPI(default_response_class=JSONResponse)
+
+
+@legacy_app.get("/mail/", response_model=List[Message])
+async def legacy_get_emails(top: int = 10, client: GraphClient = Depends(get_graph_client)):
+    data = await client.get(
+        f"/me/messages?$top={top}&$orderby=receivedDateTime desc&{select_query(Message)}")
+    return [Message(**msg) for msg in data.get("value", [])]
+
+
+@contextmanager
+def stdlib_json():
+    """Graph responses decoded with the stdlib, as before the fast JSON path."""
+    previous = settings.GRAPH_FAST_JSON
+    settings.GRAPH_FAST_JSON = False
+    try:
+        yield
+    finally:
+        settings.GRAPH_FAST_JSON = previous
+
+
+def report(name: str, before: float, after: float) -> None:
+    print(f"  {name:<22} before {before * 1e6 / TOP:8.2f} us/item"
+          f"   after {after * 1e6 / TOP:8.2f} us/item   {before / after:5.2f}x")
+
+
+def main():
+    quiet_logging()
+    body = json.dumps({"value": graph_messages(TOP)}).encode()
+    models = [Message(**msg) for msg in json.loads(body)["value"]]
+
+    # Serialization only: the service result is fixed.
+    serialize_app = FastAPI()
+
+    @serialize_app.get("/before", response_model=List[Message], response_class=JSONResponse)
+    async def serialize_before():
+        return models
+
+    @serialize_app.get("/after", response_model=List[Message])
+    async def serialize_after():
+        return models_response(models)
+
+    for target in (app, legacy_app):
+        target.dependency_overrides[get_graph_client] = lambda: make_client(body)
+
+    print(f"GET /mail/?top={TOP}, best of {REPEAT} runs")
+    report("decode",
+           measure(lambda: json.loads(body), REPEAT),
+           measure(lambda: fastjson.loads(body), REPEAT))
+    with TestClient(serialize_app) as client:
+        report("validate + serialize",
+               measure(lambda: client.get("/before"), REPEAT),
+               measure(lambda: client.get("/after"), REPEAT))
+    with TestClient(legacy_app) as legacy, TestClient(app) as current:
+        with stdlib_json():
+            before = measure(lambda: legacy.get(f"/mail/?top={TOP}"), REPEAT)
+            expected = legacy.get(f"/mail/?top={TOP}").json()
+        after = measure(lambda: current.get(f"/api/v1/mail/?top={TOP}"), REPEAT)
+        report("end to end", before, after)
+        assert expected == current.get(f"/api/v1/mail/?top={TOP}").json()
+
+
+if __name__ == "__main__":
+    main()
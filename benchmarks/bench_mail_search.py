@@ -0,0 +1,97 @@
+"""
+Search latency over a 200k-message mailbox.
+
+"scan": what callers did before, filtering every fetched message on
+subject and bodyPreview (and sender or date, when given) in Python. The messages are already in memory here,
+so the Graph paging it also needed is not even counted.
+"index": MailSearchIndex.search on the SQLite FTS5 index that delta rounds
+keep up to date, with bm25 ranking and the same result limit.
+
+Building the index is reported per message as well; in production it
+happens incrementally as delta rounds arrive.
+"""
+from benchmarks.common import measure, quiet_logging
+
+import itertools
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+from typing import Optional
+
+from src.services.search_service import MailSearchIndex
+
+MESSAGES = 200_000
+ROUND = 5000
+REPEAT = 20
+TOP = 25
+
+# Word frequencies follow Zipf's law, as in real mail: a few words appear in
+# nearly every message and most words in very few.
+WORDS = ("factura pedido reunión presupuesto informe contrato pago recibo entrega proyecto "
+         "cliente proveedor revisión trimestre ventas soporte incidencia acceso nómina viaje "
+         "oferta auditoría inventario calendario propuesta marketing legal seguridad").split()
+VOCABULARY = WORDS + [f"{WORDS[n % len(WORDS)][:4]}{n}" for n in range(20_000)]
+CUMULATIVE = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(VOCABULARY))))
+SENDERS = [f"user{i}@contoso.com" for i in range(500)]
+
+
+def messages(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    for i in range(count):
+        words = rng.choices(VOCABULARY, cum_weights=CUMULATIVE, k=60)
+        yield {
+            "id": f"AAMk{i:08d}",
+            "subject": " ".join(words[:6]).capitalize(),
+            "bodyPreview": " ".join(words[6:30]),
+            "body": {"contentType": "html",
+                     "content": "<html><body><p>" + " ".join(words[6:]) + "</p></body></html>"},
+            "from": {"emailAddress": {"name": f"User {i % 500}", "address": SENDERS[i % 500]}},
+            "receivedDateTime": f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}T{i % 24:02d}:00:00Z",
+            "isRead": bool(i % 3),
+        }
+
+
+def scan(items, text: str, sender: Optional[str] = None, since: Optional[datetime] = None):
+    needle = text.rstrip("*").lower()
+    found = [m for m in items
+             if (needle in (m["subject"] or "").lower() or needle in (m["bodyPreview"] or "").lower())
+             and (sender is None or m["from"]["emailAddress"]["address"] == sender)
+             and (since is None or m["receivedDateTime"] >= since.strftime("%Y-%m-%dT%H:%M:%SZ"))]
+    return found[:TOP]
+
+
+def main():
+    quiet_logging()
+    with tempfile.TemporaryDirectory() as directory:
+        index = MailSearchIndex(os.path.join(directory, "search.db"))
+        items = list(messages(MESSAGES))
+
+        started = time.perf_counter()
+        for start in range(0, MESSAGES, ROUND):
+            index.apply_round("owner", "inbox", items[start:start + ROUND])
+        build = time.perf_counter() - started
+        print(f"Indexed {MESSAGES} messages in {build:.1f}s ({build * 1e6 / MESSAGES:.0f} us/message)")
+
+        queries = [
+            ("rare word", "pres1234", {}),
+            ("mid word", "auditoría", {}),
+            ("common word", "factura", {}),
+            ("two words", "contrato pago", {}),
+            ("prefix", "presupu*", {}),
+            ("short prefix", "pres*", {}),
+            ("word + sender", "factura", {"sender": "user42@contoso.com"}),
+            ("word + since", "factura", {"since": datetime(2024, 12, 1)}),
+        ]
+        print(f"Top {TOP} results, best of {REPEAT} runs")
+        for name, text, filters in queries:
+            indexed = measure(lambda: index.search("owner", text, top=TOP, **filters), REPEAT)
+            scanned = measure(lambda: scan(items, text, **filters), 3)
+            print(f"  {name:<16} scan {scanned * 1000:8.2f} ms   index {indexed * 1000:7.2f} ms"
+                  f"   {scanned / indexed:6.1f}x")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Cost of the metrics that are always on, per request.
+
+"graph call": what GraphClient records around each HTTP attempt (endpoint
+template, in-flight gauge, latency histogram), next to a whole GraphClient.get
+over an in-process transport for scale. A real Graph round trip is
+10-1000x longer than that.
+"route": a minimal ASGI app called directly, bare and behind
+RouteMetricsMiddleware.
+"scrape": rendering /metrics with the series recorded above.
+"""
+from benchmarks.common import measure, quiet_logging
+
+import asyncio
+
+import httpx
+
+from src.core import metrics
+from src.core.graph_client import GraphClient
+
+CALLS = 2000
+ENDPOINTS = 300
+
+
+async def graph_calls(client: GraphClient) -> None:
+    for i in range(CALLS):
+        await client.get(f"/me/messages/AAMkAGI2{i % ENDPOINTS:06d}")
+
+
+def make_client() -> GraphClient:
+    http = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, json={})))
+    return GraphClient("benchmark", http_client=http, cache=False, single_flight=False)
+
+
+def record_graph_attempts() -> None:
+    for i in range(CALLS):
+        template = metrics.endpoint_template(f"/me/messages/AAMkAGI2{i % ENDPOINTS:06d}")
+        metrics.graph_requests_in_flight.inc()
+        metrics.graph_requests_in_flight.dec()
+        metrics.graph_request_seconds.observe(("GET", template, "200"), 0.02)
+
+
+async def app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+async def route_calls(handler) -> None:
+    class Route:
+        path = "/{message_id}"
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    for i in range(CALLS):
+        scope = {"type": "http", "method": "GET", "path": f"/api/v1/mail/m{i}", "route": Route}
+        await handler(scope, receive, send)
+
+
+def main():
+    quiet_logging()
+    client = make_client()
+    call = measure(lambda: asyncio.run(graph_calls(client)), 3) / CALLS
+    recorded = measure(record_graph_attempts, 5) / CALLS
+    print(f"graph call  in-process get {call * 1e6:7.1f} us   metrics recorded {recorded * 1e6:5.2f} us"
+          f"   ({recorded / call:.1%})")
+
+    bare = measure(lambda: asyncio.run(route_calls(app)), 3) / CALLS
+    wrapped = measure(lambda: asyncio.run(route_calls(metrics.RouteMetricsMiddleware(app))), 3) / CALLS
+    print(f"route       bare {bare * 1e6:7.1f} us   with metrics {wrapped * 1e6:7.1f} us"
+          f"   +{(wrapped - bare) * 1e6:.1f} us")
+
+    scrape = measure(metrics.render_metrics, 5)
+    lines = metrics.render_metrics().count("\n")
+    print(f"scrape      {scrape * 1000:.2f} ms for {lines} lines")
+
+
+if __name__ == "__main__":
+    main()
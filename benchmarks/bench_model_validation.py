@@ -0,0 +1,37 @@
+"""
+Cost of turning a 1000-message Graph page into Message models:
+
+- per-item: `[Message(**msg) for msg in page]`, the original service code
+- batch:    one cached TypeAdapter(List[Message]) call per page, with
+            EmailStr checks (GRAPH_TRUSTED_MODELS=false)
+- trusted:  batch validation against the trusted variant, which skips
+            EmailStr checks for data that came from Graph; what the
+            services do by default
+"""
+from benchmarks.common import graph_messages, measure, quiet_logging
+
+from src.models.mail import Message
+from src.models.validation import validate_page
+
+PAGE = 1000
+REPEAT = 10
+
+
+def main():
+    quiet_logging()
+    page = graph_messages(PAGE)
+    strategies = {
+        "per-item": lambda: [Message(**msg) for msg in page],
+        "batch": lambda: validate_page(Message, page, trusted=False),
+        "trusted": lambda: validate_page(Message, page, trusted=True),
+    }
+    baseline = None
+    print(f"Message validation, {PAGE} items, best of {REPEAT} runs")
+    for name, fn in strategies.items():
+        seconds = measure(fn, REPEAT)
+        baseline = baseline or seconds
+        print(f"  {name:<9} {seconds * 1e6 / PAGE:8.2f} us/item   {baseline / seconds:6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Per-message cost of rendering billing notifications for 1000 customers:
+
+- f-strings:  the original `enviar_notificacion_cliente` body, which builds
+              every template and the subject table on each call
+- registry:   TemplateRegistry.render with the render cache disabled
+- batch:      TemplateRegistry.render_batch, which also builds the
+              SendMessageRequests for the bulk send queue
+- batch-v:    render_batch with validate_recipients=True (EmailStr checks)
+- cached:     render with the cache on, all customers sharing one set of
+              values; real billing runs never repeat values like this
+"""
+from benchmarks.common import measure
+
+from src.services.template_service import TemplateRegistry
+
+CUSTOMERS = 1000
+REPEAT = 10
+
+BODY = """
+    <h2>¡Pago Recibido!</h2>
+    <p>Hola {nombre_cliente},</p>
+    <p>Confirmamos la recepción de tu pago por <strong>${monto:.2f}</strong></p>
+    <p>Factura: {factura}</p>
+    <p>Gracias por tu preferencia.</p>
+"""
+
+
+def fstring_render(nombre_cliente: str, tipo_notificacion: str, detalles: dict):
+    plantillas = {
+        "pago_recibido": f"""
+            <h2>¡Pago Recibido!</h2>
+            <p>Hola {nombre_cliente},</p>
+            <p>Confirmamos la recepción de tu pago por <strong>${detalles.get('monto', 0):.2f}</strong></p>
+            <p>Factura: {detalles.get('factura', 'N/A')}</p>
+            <p>Gracias por tu preferencia.</p>
+        """,
+        "recordatorio_pago": f"""
+            <h2>Recordatorio de Pago</h2>
+            <p>Hola {nombre_cliente},</p>
+            <p>Tu factura <strong>{detalles.get('factura', 'N/A')}</strong> vence en {detalles.get('dias', 0)} días.</p>
+            <p>Monto pendiente: <strong>${detalles.get('monto', 0):.2f}</strong></p>
+        """,
+        "pedido_confirmado": f"""
+            <h2>Pedido Confirmado</h2>
+            <p>Hola {nombre_cliente},</p>
+            <p>Tu pedido <strong>#{detalles.get('pedido_id', 'N/A')}</strong> ha sido confirmado.</p>
+            <p>Fecha estimada de entrega: {detalles.get('fecha_entrega', 'Por confirmar')}</p>
+        """
+    }
+    cuerpo = plantillas.get(tipo_notificacion, "<p>Notificación del sistema</p>")
+    asunto = {
+        "pago_recibido": "✅ Confirmación de Pago",
+        "recordatorio_pago": "⏰ Recordatorio de Pago Pendiente",
+        "pedido_confirmado": "📦 Tu Pedido ha sido Confirmado"
+    }.get(tipo_notificacion, "Notificación")
+    return asunto, cuerpo
+
+
+def registry(cache_size: int) -> TemplateRegistry:
+    templates = TemplateRegistry(cache_size=cache_size)
+    templates.register("pago_recibido", subject="✅ Confirmación de Pago", body=BODY,
+                       params={"nombre_cliente": str, "monto": float, "factura": str},
+                       defaults={"monto": 0.0, "factura": "N/A"})
+    return templates
+
+
+def main():
+    customers = [
+        (f"customer{i}@example.com",
+         {"nombre_cliente": f"Cliente {i}", "monto": 100 + i, "factura": f"F-2024-{i:04d}"})
+        for i in range(CUSTOMERS)
+    ]
+    shared = {"nombre_cliente": "Cliente", "monto": 100.0, "factura": "F-2024-0001"}
+    uncached = registry(cache_size=0)
+    cached = registry(cache_size=1024)
+
+    def fstrings():
+        for _, values in customers:
+            details = {"monto": values["monto"], "factura": values["factura"]}
+            fstring_render(values["nombre_cliente"], "pago_recibido", details)
+
+    strategies = {
+        "f-strings": fstrings,
+        "registry": lambda: [uncached.render("pago_recibido", values) for _, values in customers],
+        "batch": lambda: uncached.render_batch("pago_recibido", customers),
+        "batch-v": lambda: uncached.render_batch("pago_recibido", customers,
+                                                 validate_recipients=True),
+        "cached": lambda: [cached.render("pago_recibido", shared) for _ in customers],
+    }
+    baseline = None
+    print(f"Notification rendering, {CUSTOMERS} customers, best of {REPEAT} runs")
+    for name, fn in strategies.items():
+        seconds = measure(fn, REPEAT)
+        baseline = baseline or seconds
+        print(f"  {name:<10} {seconds * 1e6 / CUSTOMERS:8.2f} us/message   {baseline / seconds:6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
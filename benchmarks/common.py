@@ -0,0 +1,64 @@
+import os
+import time
+from typing import Callable, Dict, List
+
+# Settings() requires credentials at import time; benchmarks never call Azure AD.
+os.environ.setdefault("CLIENT_ID", "benchmark")
+os.environ.setdefault("CLIENT_SECRET", "benchmark")
+os.environ.setdefault("TENANT_ID", "benchmark")
+
+
+def graph_messages(count: int) -> List[Dict]:
+    """Graph-shaped message resources, including the properties our models drop."""
+    return [
+        {
+            "@odata.etag": f'W/"CQAAABYAAA{i}"',
+            "id": f"AAMkAGI2TG93AAA{i:06d}",
+            "createdDateTime": "2024-03-01T10:00:00Z",
+            "lastModifiedDateTime": "2024-03-01T10:00:05Z",
+            "changeKey": "CQAAABYAAAD",
+            "categories": [],
+            "receivedDateTime": "2024-03-01T10:00:00Z",
+            "sentDateTime": "2024-03-01T09:59:58Z",
+            "hasAttachments": False,
+            "internetMessageId": f"<msg{i}@contoso.com>",
+            "subject": f"Invoice F-2024-{i:04d} is ready",
+            "bodyPreview": "Hello, please find attached the invoice for this month.",
+            "importance": "normal",
+            "parentFolderId": "AQMkAGI2AAAAA",
+            "conversationId": f"AAQkAGI2{i:06d}",
+            "isRead": bool(i % 2),
+            "body": {"contentType": "html", "content": "<html><body>" + "<p>Invoice line</p>" * 40 + "</body></html>"},
+            "sender": {"emailAddress": {"name": "Billing", "address": "billing@contoso.com"}},
+            "from": {"emailAddress": {"name": "Billing", "address": "billing@contoso.com"}},
+            "toRecipients": [
+                {"emailAddress": {"name": f"Customer {i}", "address": f"customer{i}@example.com"}},
+                {"emailAddress": {"name": "Accounts", "address": "accounts@example.com"}},
+            ],
+            "ccRecipients": [],
+            "bccRecipients": [],
+            "replyTo": [],
+            "flag": {"flagStatus": "notFlagged"},
+        }
+        for i in range(count)
+    ]
+
+
+def measure(fn: Callable[[], object], repeat: int) -> float:
+    """Best-of wall time in seconds for one call of fn."""
+    fn()  # warm up
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def quiet_logging() -> None:
+    """Drop application log output so it does not dominate the timings."""
+    import logging
+    from loguru import logger
+
+    logger.remove()
+    logging.disable(logging.CRITICAL)
@@ -12,9 +12,62 @@ Cliente: [Tu Empresa]
 import asyncio
 from datetime import datetime, timedelta
 
-# Importar el cliente de Graph API
-from src.graph_client import GraphClient
-from src.auth import MSGraphAuth
+# Importar el cliente de Graph API y los servicios de la aplicación
+from src.core.graph_client import GraphClient
+from src.models.calendar import CreateEventRequest, SlotSearchRequest
+from src.models.mail import SendMessageRequest
+from src.services.calendar_service import CalendarService
+from src.services.drive_service import DriveService
+from src.services.mail_service import MailService
+from src.services.mirror_service import DriveMirror
+from src.services.template_service import TemplateRegistry
+
+
+# Plantillas compiladas una sola vez al importar el módulo; cada envío solo
+# rellena los parámetros en los fragmentos ya preparados.
+PLANTILLAS = TemplateRegistry()
+PLANTILLAS.register(
+    "pago_recibido",
+    subject="✅ Confirmación de Pago",
+    body="""
+        <h2>¡Pago Recibido!</h2>
+        <p>Hola {nombre_cliente},</p>
+        <p>Confirmamos la recepción de tu pago por <strong>${monto:.2f}</strong></p>
+        <p>Factura: {factura}</p>
+        <p>Gracias por tu preferencia.</p>
+    """,
+    params={"nombre_cliente": str, "monto": float, "factura": str},
+    defaults={"monto": 0.0, "factura": "N/A"},
+)
+PLANTILLAS.register(
+    "recordatorio_pago",
+    subject="⏰ Recordatorio de Pago Pendiente",
+    body="""
+        <h2>Recordatorio de Pago</h2>
+        <p>Hola {nombre_cliente},</p>
+        <p>Tu factura <strong>{factura}</strong> vence en {dias} días.</p>
+        <p>Monto pendiente: <strong>${monto:.2f}</strong></p>
+    """,
+    params={"nombre_cliente": str, "factura": str, "dias": int, "monto": float},
+    defaults={"factura": "N/A", "dias": 0, "monto": 0.0},
+)
+PLANTILLAS.register(
+    "pedido_confirmado",
+    subject="📦 Tu Pedido ha sido Confirmado",
+    body="""
+        <h2>Pedido Confirmado</h2>
+        <p>Hola {nombre_cliente},</p>
+        <p>Tu pedido <strong>#{pedido_id}</strong> ha sido confirmado.</p>
+        <p>Fecha estimada de entrega: {fecha_entrega}</p>
+    """,
+    params={"nombre_cliente": str, "pedido_id": str, "fecha_entrega": str},
+    defaults={"pedido_id": "N/A", "fecha_entrega": "Por confirmar"},
+)
+PLANTILLAS.register(
+    "generica",
+    subject="Notificación",
+    body="<p>Notificación del sistema</p>",
+)
 
 
 class EmpresaSoftwareIntegration:
@@ -28,7 +81,11 @@ class EmpresaSoftwareIntegration:
     """
     
     def __init__(self, access_token: str):
+        # El mismo GraphClient que usa la API; los servicios lo comparten.
         self.graph = GraphClient(access_token)
+        self.correo = MailService(self.graph)
+        self.calendario = CalendarService(self.graph)
+        self.drive = DriveService(self.graph)
     
     # ═══════════════════════════════════════════════════════════════════════
     # CASO DE USO 1: Sistema de Notificaciones por Email
@@ -49,44 +106,35 @@ class EmpresaSoftwareIntegration:
         - Recordatorio de vencimiento
         - Confirmación de pedido
         """
-        plantillas = {
-            "pago_recibido": f"""
-                <h2>¡Pago Recibido!</h2>
-                <p>Hola {nombre_cliente},</p>
-                <p>Confirmamos la recepción de tu pago por <strong>${detalles.get('monto', 0):.2f}</strong></p>
-                <p>Factura: {detalles.get('factura', 'N/A')}</p>
-                <p>Gracias por tu preferencia.</p>
-            """,
-            "recordatorio_pago": f"""
-                <h2>Recordatorio de Pago</h2>
-                <p>Hola {nombre_cliente},</p>
-                <p>Tu factura <strong>{detalles.get('factura', 'N/A')}</strong> vence en {detalles.get('dias', 0)} días.</p>
-                <p>Monto pendiente: <strong>${detalles.get('monto', 0):.2f}</strong></p>
-            """,
-            "pedido_confirmado": f"""
-                <h2>Pedido Confirmado</h2>
-                <p>Hola {nombre_cliente},</p>
-                <p>Tu pedido <strong>#{detalles.get('pedido_id', 'N/A')}</strong> ha sido confirmado.</p>
-                <p>Fecha estimada de entrega: {detalles.get('fecha_entrega', 'Por confirmar')}</p>
-            """
-        }
+        nombre = tipo_notificacion if tipo_notificacion in PLANTILLAS else "generica"
+        mensaje = PLANTILLAS.render(nombre, {"nombre_cliente": nombre_cliente, **detalles})
         
-        cuerpo = plantillas.get(tipo_notificacion, "<p>Notificación del sistema</p>")
-        asunto = {
-            "pago_recibido": "✅ Confirmación de Pago",
-            "recordatorio_pago": "⏰ Recordatorio de Pago Pendiente",
-            "pedido_confirmado": "📦 Tu Pedido ha sido Confirmado"
-        }.get(tipo_notificacion, "Notificación")
-        
-        await self.graph.send_email(
+        await self.correo.send_message(SendMessageRequest(
             to=[email_cliente],
-            subject=asunto,
-            body=cuerpo
-        )
+            subject=mensaje.subject,
+            body=mensaje.body
+        ))
         
         print(f"✅ Notificación enviada a {email_cliente}")
         return {"status": "sent", "to": email_cliente, "type": tipo_notificacion}
     
+    def preparar_notificaciones_masivas(
+        self,
+        tipo_notificacion: str,
+        clientes: list[dict]
+    ) -> dict:
+        """
+        Renderiza en una sola llamada las notificaciones de muchos clientes y
+        devuelve el cuerpo para POST /api/v1/mail/send/bulk.
+        
+        Cada cliente es un dict con "email", "nombre" y sus detalles.
+        """
+        mensajes = PLANTILLAS.render_batch(tipo_notificacion, (
+            (cliente["email"], {"nombre_cliente": cliente["nombre"], **cliente.get("detalles", {})})
+            for cliente in clientes
+        ))
+        return {"messages": [mensaje.model_dump() for mensaje in mensajes]}
+    
     # ═══════════════════════════════════════════════════════════════════════
     # CASO DE USO 2: Sincronización de Calendario
     # ═══════════════════════════════════════════════════════════════════════
@@ -106,21 +154,29 @@ class EmpresaSoftwareIntegration:
         - Sistema de RRHH agenda entrevistas
         - Helpdesk agenda visitas técnicas
         """
-        # Calcular próximo slot disponible (ejemplo: mañana a las 10am)
-        inicio = datetime.now().replace(hour=10, minute=0, second=0) + timedelta(days=1)
+        # Primer hueco libre para todos los participantes en los próximos 7 días
+        manana = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        huecos = await self.calendario.find_meeting_slots(SlotSearchRequest(
+            attendees=participantes,
+            start=manana,
+            end=manana + timedelta(days=7),
+            duration_minutes=duracion_minutos,
+            max_results=1
+        ))
+        inicio = huecos[0].start if huecos else manana.replace(hour=10)
         fin = inicio + timedelta(minutes=duracion_minutos)
         
-        evento = await self.graph.create_event(
+        evento = await self.calendario.create_event(CreateEventRequest(
             subject=titulo,
-            start=inicio.isoformat(),
-            end=fin.isoformat(),
+            start_time=inicio,
+            end_time=fin,
             attendees=participantes,
             body=f"""
                 <h3>{titulo}</h3>
                 <p>{descripcion}</p>
                 <p><em>Esta reunión fue agendada automáticamente por el sistema.</em></p>
             """
-        )
+        ))
         
         print(f"📅 Reunión agendada: {titulo}")
         return evento
@@ -145,27 +201,44 @@ class EmpresaSoftwareIntegration:
         """
         nombre_archivo = f"reportes/{año}/reporte_{mes}_{año}.csv"
         
-        resultado = await self.graph.upload_file(
-            file_name=nombre_archivo,
-            content=contenido_csv.encode('utf-8')
+        # Si OneDrive ya tiene exactamente este contenido no se vuelve a subir
+        resultado, subido = await self.drive.upload_file_if_changed(
+            nombre_archivo,
+            contenido_csv.encode('utf-8')
         )
         
-        print(f"☁️ Reporte subido: {nombre_archivo}")
+        print(f"☁️ Reporte {'subido' if subido else 'sin cambios'}: {nombre_archivo}")
+        return resultado
+    
+    async def respaldar_carpeta(self, carpeta_local: str, carpeta_onedrive: str = "respaldos"):
+        """
+        Respaldo nocturno de una carpeta local en OneDrive.
+        
+        Solo se suben los archivos nuevos o modificados (comparando hashes de
+        contenido); los hashes locales se guardan en un manifiesto para no
+        releer los archivos que no cambiaron.
+        """
+        espejo = DriveMirror(self.drive, carpeta_local, carpeta_onedrive)
+        resultado = await espejo.push()
+        
+        print(f"🗄️ Respaldo: {len(resultado.uploaded)} subidos, "
+              f"{resultado.unchanged} sin cambios, {len(resultado.failed)} con error")
         return resultado
     
     async def obtener_inbox_resumen(self, limite: int = 5):
         """
         Obtiene resumen de emails recientes para dashboard.
         """
-        emails = await self.graph.get_emails(top=limite)
+        emails = await self.correo.get_messages(top=limite, summary=True)
         
         resumen = []
-        for email in emails.get('value', []):
+        for email in emails:
+            remitente = email.from_.emailAddress if email.from_ else None
             resumen.append({
-                "de": email.get('from', {}).get('emailAddress', {}).get('name', 'Desconocido'),
-                "asunto": email.get('subject', 'Sin asunto'),
-                "fecha": email.get('receivedDateTime', '')[:10],
-                "leido": email.get('isRead', False)
+                "de": (remitente.name if remitente else None) or 'Desconocido',
+                "asunto": email.subject or 'Sin asunto',
+                "fecha": email.receivedDateTime.date().isoformat() if email.receivedDateTime else '',
+                "leido": bool(email.isRead)
             })
         
         return resumen
@@ -180,7 +253,7 @@ async def demo():
     Demostración de la integración.
     
     Para usar en producción:
-    1. Obtener access_token via OAuth flow (ver src/auth.py)
+    1. Obtener access_token via OAuth flow (ver /api/v1/login)
     2. Instanciar EmpresaSoftwareIntegration con el token
     3. Llamar los métodos según necesidad del sistema
     """
@@ -1,18 +1,153 @@
+import asyncio
+import time
+from functools import lru_cache, partial
+from typing import Awaitable, Callable, Dict, Optional
 from fastapi import Request, HTTPException, Depends
+from src.core.config import settings
 from src.core.graph_client import GraphClient
-from src.services.auth_service import AuthService
+from src.core.http_pool import get_http_client
+from src.core.session_store import SessionStore, get_session_store
+from src.core.singleflight import token_refresh_flights
+from src.services.auth_service import AuthService, get_auth_executor, session_from_token
+from src.services.search_service import MailSearchIndex
+from src.services.subscription_service import (DeltaSyncConsumer, NotificationHub, SubscriptionManager,
+                                               SubscriptionStore)
+from src.services.sync_service import SyncService, SyncStore
 
-# In-memory session storage (should be Redis in production)
-sessions = {}
+_auth_service: Optional[AuthService] = None
+_auth_service_lock = asyncio.Lock()
 
-def get_auth_service() -> AuthService:
-    return AuthService()
+async def get_auth_service() -> AuthService:
+    # One MSAL app per process: discovery runs once and the token cache survives.
+    global _auth_service
+    if _auth_service is None:
+        async with _auth_service_lock:
+            if _auth_service is None:
+                # Building the app runs authority discovery over blocking HTTP.
+                _auth_service = await asyncio.get_running_loop().run_in_executor(
+                    get_auth_executor(),
+                    partial(AuthService, token_cache_path=settings.AUTH_TOKEN_CACHE_PATH,
+                            account_store=get_session_store()))
+    return _auth_service
 
-def get_access_token(request: Request) -> str:
-    session_id = request.cookies.get("session_id")
-    if not session_id or session_id not in sessions:
+def close_auth_service() -> None:
+    global _auth_service
+    if _auth_service is not None:
+        _auth_service.close()
+        _auth_service = None
+
+async def get_access_token(
+    request: Request,
+    store: SessionStore = Depends(get_session_store),
+    auth_service: AuthService = Depends(get_auth_service),
+) -> str:
+    return await session_access_token(request.cookies.get("session_id"), store, auth_service)
+
+async def session_access_token(session_id: Optional[str], store: SessionStore,
+                               auth_service: AuthService) -> str:
+    session = await store.get(session_id) if session_id else None
+    if not session:
         raise HTTPException(status_code=401, detail="Not authenticated")
-    return sessions[session_id]["access_token"]
+    if session.get("expires_at", 0) - settings.AUTH_REFRESH_SKEW_SECONDS > time.time():
+        return session["access_token"]
+    session = await token_refresh_flights.do(
+        session_id, lambda: _refresh_session(session_id, session, store, auth_service))
+    return session["access_token"]
+
+async def _refresh_session(session_id: str, session: Dict, store: SessionStore,
+                           auth_service: AuthService) -> Dict:
+    account_id = session.get("home_account_id")
+    result = await auth_service.acquire_token_silent_async(account_id) if account_id else None
+    if result is None:
+        if session.get("expires_at", 0) > time.time():
+            # Renewal failed but the current token is still valid; retry next time.
+            return session
+        await store.delete(session_id)
+        raise HTTPException(status_code=401, detail="Session expired")
+    session = {**session, **session_from_token(result, account_id)}
+    await store.set(session_id, session)
+    return session
 
 def get_graph_client(access_token: str = Depends(get_access_token)) -> GraphClient:
-    return GraphClient(access_token)
+    # The connection pool is shared; only the bearer token is per user.
+    return GraphClient(access_token, http_client=get_http_client())
+
+async def get_graph_client_factory(
+    request: Request,
+    access_token: str = Depends(get_access_token),
+    store: SessionStore = Depends(get_session_store),
+    auth_service: AuthService = Depends(get_auth_service),
+) -> Callable[[], Awaitable[GraphClient]]:
+    """
+    For background work that may outlive the request's access token: each
+    call returns a client with the session's current, renewed token.
+    """
+    session_id = request.cookies.get("session_id")
+
+    async def factory() -> GraphClient:
+        token = access_token
+        if session_id:
+            token = await session_access_token(session_id, store, auth_service)
+        return GraphClient(token, http_client=get_http_client())
+
+    return factory
+
+async def get_session_account_id(
+    request: Request,
+    store: SessionStore = Depends(get_session_store),
+) -> Optional[str]:
+    session_id = request.cookies.get("session_id")
+    session = await store.get(session_id) if session_id else None
+    return session.get("home_account_id") if session else None
+
+async def account_graph_client(home_account_id: str) -> Optional[GraphClient]:
+    """
+    A client for a signed-in account without its login session, for work
+    that outlives sessions: the token is renewed from the account's token
+    cache. None when the account has to sign in again.
+    """
+    auth_service = await get_auth_service()
+    result = await auth_service.acquire_token_silent_async(home_account_id)
+    if result is None:
+        return None
+    return GraphClient(result["access_token"], http_client=get_http_client())
+
+@lru_cache
+def get_sync_store() -> SyncStore:
+    return SyncStore(settings.SYNC_DB_PATH)
+
+@lru_cache
+def get_mail_search_index() -> MailSearchIndex:
+    return MailSearchIndex(settings.MAIL_SEARCH_DB_PATH, rank_window=settings.MAIL_SEARCH_RANK_WINDOW)
+
+def get_sync_service(
+    client: GraphClient = Depends(get_graph_client),
+    store: SyncStore = Depends(get_sync_store),
+    search_index: MailSearchIndex = Depends(get_mail_search_index),
+) -> SyncService:
+    return SyncService(client, store, search_index)
+
+_subscription_manager: Optional[SubscriptionManager] = None
+
+def get_subscription_manager() -> SubscriptionManager:
+    global _subscription_manager
+    if _subscription_manager is None:
+        manager = SubscriptionManager(
+            NotificationHub(queue_size=settings.SUBSCRIPTION_QUEUE_SIZE),
+            SubscriptionStore(settings.SUBSCRIPTION_DB_PATH),
+            notification_url=settings.SUBSCRIPTION_NOTIFICATION_URL,
+            lifetime_minutes=settings.SUBSCRIPTION_LIFETIME_MINUTES,
+            renew_before_minutes=settings.SUBSCRIPTION_RENEW_BEFORE_MINUTES,
+            check_interval=settings.SUBSCRIPTION_RENEW_CHECK_SECONDS,
+            account_client=account_graph_client,
+        )
+        manager.hub.add_consumer(DeltaSyncConsumer(manager, get_sync_store(), get_mail_search_index(),
+                                                   delay=settings.SUBSCRIPTION_SYNC_DELAY_SECONDS))
+        _subscription_manager = manager
+    return _subscription_manager
+
+async def close_subscription_manager() -> None:
+    global _subscription_manager
+    if _subscription_manager is not None:
+        await _subscription_manager.close()
+        _subscription_manager = None
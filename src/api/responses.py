@@ -0,0 +1,60 @@
+from typing import Any, AsyncIterator, Optional, Sequence
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+from src.core import fastjson
+from src.models.validation import list_adapter
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when available."""
+
+    def render(self, content: Any) -> bytes:
+        return fastjson.dumps(content)
+
+
+def models_response(items: Sequence[Any]) -> Any:
+    """
+    Serializes models the service has already validated straight to JSON
+    bytes, so FastAPI does not validate them a second time against the
+    route's response_model. Anything else is returned unchanged for
+    FastAPI's normal handling.
+    """
+    if not items:
+        return Response(content=b"[]", media_type="application/json")
+    model = type(items[0])
+    if not issubclass(model, BaseModel) or not all(type(item) is model for item in items):
+        return items
+    content = list_adapter(model).dump_json(list(items), by_alias=True)
+    return Response(content=content, media_type="application/json")
+
+
+def sync_pending_response(resource: str) -> JSONResponse:
+    """
+    202 for a local read whose first sync has just been scheduled; the same
+    request returns the synced items once that round has finished.
+    """
+    return JSONResponse(status_code=202, content={"status": "sync pending", "resource": resource})
+
+
+async def _ndjson_lines(items: AsyncIterator[BaseModel],
+                        limit: Optional[int]) -> AsyncIterator[bytes]:
+    count = 0
+    try:
+        async for item in items:
+            if limit is not None and count >= limit:
+                break
+            yield item.model_dump_json(by_alias=True).encode() + b"\n"
+            count += 1
+    finally:
+        # Stop the upstream paginator (and its prefetch) on early exit.
+        aclose = getattr(items, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+def ndjson_response(items: AsyncIterator[BaseModel],
+                    limit: Optional[int] = None) -> StreamingResponse:
+    """Streams models as newline-delimited JSON as they are produced."""
+    return StreamingResponse(_ndjson_lines(items, limit), media_type=NDJSON_MEDIA_TYPE)
@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from src.api.v1.endpoints import auth, users, mail, calendar, drive
+from src.api.v1.endpoints import auth, users, mail, calendar, drive, sync, subscriptions
 
 api_router = APIRouter()
 api_router.include_router(auth.router, tags=["Auth"])
@@ -7,3 +7,5 @@ api_router.include_router(users.router, prefix="/users", tags=["Users"])
 api_router.include_router(mail.router, prefix="/mail", tags=["Mail"])
 api_router.include_router(calendar.router, prefix="/calendar", tags=["Calendar"])
 api_router.include_router(drive.router, prefix="/drive", tags=["Drive"])
+api_router.include_router(sync.router, prefix="/sync", tags=["Sync"])
+api_router.include_router(subscriptions.router, prefix="/subscriptions", tags=["Subscriptions"])
@@ -1,8 +1,10 @@
 from fastapi import APIRouter, Depends, Request
 from fastapi.responses import RedirectResponse
 import secrets
-from src.services.auth_service import AuthService
-from src.api.deps import get_auth_service, sessions
+from src.core.config import settings
+from src.core.session_store import SessionStore, get_session_store
+from src.services.auth_service import AuthService, session_from_token
+from src.api.deps import get_auth_service
 
 router = APIRouter()
 
@@ -20,31 +22,38 @@ async def callback(
     request: Request,
     code: str,
     state: str = None,
-    auth_service: AuthService = Depends(get_auth_service)
+    auth_service: AuthService = Depends(get_auth_service),
+    store: SessionStore = Depends(get_session_store)
 ):
     """
     Callback from Microsoft Auth.
     """
-    result = auth_service.acquire_token_by_code(code)
+    result = await auth_service.acquire_token_by_code_async(code)
     
     session_id = secrets.token_urlsafe(32)
-    sessions[session_id] = {
-        "access_token": result["access_token"],
-        "account": result.get("id_token_claims", {})
-    }
+    await store.set(session_id, session_from_token(result))
     
     response = RedirectResponse(url="/")
-    response.set_cookie(key="session_id", value=session_id, httponly=True, max_age=3600)
+    response.set_cookie(key="session_id", value=session_id, httponly=True,
+                        max_age=settings.SESSION_TTL_SECONDS)
     return response
 
 @router.get("/logout")
-async def logout(request: Request):
+async def logout(
+    request: Request,
+    auth_service: AuthService = Depends(get_auth_service),
+    store: SessionStore = Depends(get_session_store)
+):
     """
     Logs out the user.
     """
     session_id = request.cookies.get("session_id")
-    if session_id and session_id in sessions:
-        del sessions[session_id]
+    session = await store.get(session_id) if session_id else None
+    if session:
+        await store.delete(session_id)
+        if session.get("home_account_id"):
+            # Drop the refresh token too, so the account cannot be renewed.
+            await auth_service.remove_account_async(session["home_account_id"])
     
     response = RedirectResponse(url="/")
     response.delete_cookie(key="session_id")
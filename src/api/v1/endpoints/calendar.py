@@ -1,19 +1,70 @@
-from fastapi import APIRouter, Depends
-from typing import List
+from datetime import datetime, timedelta
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from typing import List, Optional
+from src.core.config import settings
 from src.core.graph_client import GraphClient
 from src.services.calendar_service import CalendarService
-from src.models.calendar import Event, CreateEventRequest
-from src.api.deps import get_graph_client
+from src.models.calendar import (
+    BulkCreateEventsRequest, BulkCreateEventsResult, CreateEventRequest, Event, MeetingSlot, SlotSearchRequest,
+)
+from src.services.sync_service import CALENDAR, SyncService
+from src.api.deps import get_graph_client, get_sync_service
+from src.api.responses import models_response, ndjson_response, sync_pending_response
 
 router = APIRouter()
 
 @router.get("/", response_model=List[Event])
-async def get_events(top: int = 10, client: GraphClient = Depends(get_graph_client)):
+async def get_events(
+    background_tasks: BackgroundTasks,
+    top: int = 10,
+    local: bool = False,
+    client: GraphClient = Depends(get_graph_client),
+    sync: SyncService = Depends(get_sync_service)
+):
     """
-    Get calendar events.
+    Get calendar events. With local=true they are served straight from the
+    local store; when its last delta round is older than
+    SYNC_MAX_AGE_SECONDS one runs in the background. Before the first sync
+    has finished the answer is 202 "sync pending".
     """
+    if local:
+        age = await sync.sync_age(CALENDAR)
+        if age is None or age > settings.SYNC_MAX_AGE_SECONDS:
+            background_tasks.add_task(sync.background_sync, CALENDAR, sync.sync_calendar)
+        if age is None:
+            return sync_pending_response(CALENDAR)
+        return models_response(await sync.get_events(top=top))
     service = CalendarService(client)
-    return await service.get_events(top=top)
+    return models_response(await service.get_events(top=top))
+
+@router.get("/view", response_model=List[Event])
+async def get_calendar_view(
+    start: datetime,
+    end: datetime,
+    client: GraphClient = Depends(get_graph_client)
+):
+    """
+    Get events between start and end, with recurring events expanded.
+    Ranges fetched recently are served from a per-user cache.
+    """
+    if end <= start:
+        raise HTTPException(status_code=422, detail="end must be after start")
+    if end - start > timedelta(days=366):
+        raise HTTPException(status_code=422, detail="The range can span at most 366 days")
+    service = CalendarService(client)
+    return models_response(await service.get_events_in_range(start, end))
+
+@router.get("/stream")
+async def stream_events(
+    page_size: int = 50,
+    limit: Optional[int] = None,
+    client: GraphClient = Depends(get_graph_client)
+):
+    """
+    Stream all calendar events as NDJSON, page by page.
+    """
+    service = CalendarService(client)
+    return ndjson_response(service.iter_events(page_size=page_size), limit=limit)
 
 @router.post("/", response_model=Event)
 async def create_event(request: CreateEventRequest, client: GraphClient = Depends(get_graph_client)):
@@ -22,3 +73,23 @@ async def create_event(request: CreateEventRequest, client: GraphClient = Depend
     """
     service = CalendarService(client)
     return await service.create_event(request)
+
+@router.post("/bulk", response_model=BulkCreateEventsResult)
+async def create_events(request: BulkCreateEventsRequest, client: GraphClient = Depends(get_graph_client)):
+    """
+    Create many calendar events through $batch. Items that fail are reported
+    with their index; the others are still created.
+    """
+    if len(request.events) > settings.CALENDAR_BULK_MAX_EVENTS:
+        raise HTTPException(status_code=413,
+                            detail=f"At most {settings.CALENDAR_BULK_MAX_EVENTS} events per call")
+    service = CalendarService(client)
+    return await service.create_events(request.events)
+
+@router.post("/slots", response_model=List[MeetingSlot])
+async def find_meeting_slots(request: SlotSearchRequest, client: GraphClient = Depends(get_graph_client)):
+    """
+    Find the earliest meeting slots when all attendees are free, using their free/busy schedules.
+    """
+    service = CalendarService(client)
+    return await service.find_meeting_slots(request)
@@ -1,10 +1,13 @@
-from fastapi import APIRouter, Depends, UploadFile, File
-from typing import List
-from fastapi.responses import Response
+from fastapi import APIRouter, Depends, UploadFile, File, Header
+from typing import List, Optional
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from src.core.config import settings
 from src.core.graph_client import GraphClient
 from src.services.drive_service import DriveService
 from src.models.drive import FileItem
 from src.api.deps import get_graph_client
+from src.api.responses import models_response, ndjson_response
 
 router = APIRouter()
 
@@ -14,22 +17,78 @@ async def get_files(folder: str = "root", client: GraphClient = Depends(get_grap
     Get files from OneDrive.
     """
     service = DriveService(client)
-    return await service.get_files(folder_path=folder)
+    return models_response(await service.get_files(folder_path=folder))
+
+@router.get("/files/stream")
+async def stream_files(
+    folder: str = "root",
+    page_size: int = 200,
+    limit: Optional[int] = None,
+    client: GraphClient = Depends(get_graph_client)
+):
+    """
+    Stream every item of a folder as NDJSON, page by page.
+    """
+    service = DriveService(client)
+    return ndjson_response(service.iter_files(folder_path=folder, page_size=page_size), limit=limit)
+
+@router.get("/files/crawl")
+async def crawl_files(
+    folder: str = "root",
+    concurrency: Optional[int] = None,
+    batch: Optional[bool] = None,
+    max_depth: Optional[int] = None,
+    limit: Optional[int] = None,
+    client: GraphClient = Depends(get_graph_client)
+):
+    """
+    Stream every file and folder below a folder as NDJSON, walking subfolders
+    concurrently. `concurrency` can lower, not raise, the configured limit.
+    """
+    concurrency = min(concurrency or settings.DRIVE_CRAWL_CONCURRENCY, settings.DRIVE_CRAWL_CONCURRENCY)
+    service = DriveService(client)
+    items = service.crawl(folder_path=folder, concurrency=max(1, concurrency),
+                          batch=batch, max_depth=max_depth)
+    return ndjson_response(items, limit=limit)
 
 @router.get("/files/{item_id}/download")
-async def download_file(item_id: str, client: GraphClient = Depends(get_graph_client)):
+async def download_file(
+    item_id: str,
+    range: Optional[str] = Header(None),
+    client: GraphClient = Depends(get_graph_client)
+):
     """
-    Download a file from OneDrive.
+    Stream a file from OneDrive. Supports HTTP Range requests for resuming.
     """
     service = DriveService(client)
-    content = await service.download_file(item_id)
-    return Response(content=content, media_type="application/octet-stream")
+    stream = await service.open_download(item_id, byte_range=range)
+    return StreamingResponse(
+        stream.aiter_bytes(settings.DRIVE_STREAM_CHUNK_SIZE),
+        status_code=stream.status_code,
+        media_type=stream.media_type,
+        headers=stream.passthrough_headers(),
+        background=BackgroundTask(stream.aclose),
+    )
 
 @router.post("/files/upload", response_model=FileItem)
-async def upload_file(file: UploadFile = File(...), client: GraphClient = Depends(get_graph_client)):
+async def upload_file(
+    file: UploadFile = File(...),
+    skip_unchanged: bool = False,
+    client: GraphClient = Depends(get_graph_client)
+):
     """
-    Upload a file to OneDrive root.
+    Upload a file to OneDrive root. Files above the simple-upload limit are
+    sent in chunks through an upload session. With skip_unchanged=true a
+    file whose content hash matches the copy in OneDrive is not sent again.
     """
     service = DriveService(client)
+    if file.size is not None and file.size > settings.DRIVE_SIMPLE_UPLOAD_LIMIT:
+        if skip_unchanged:
+            item, _ = await service.upload_large_file_if_changed(file.filename, file, file.size)
+            return item
+        return await service.upload_large_file(file.filename, file, file.size)
     content = await file.read()
+    if skip_unchanged:
+        item, _ = await service.upload_file_if_changed(file.filename, content)
+        return item
     return await service.upload_file(file.filename, content)
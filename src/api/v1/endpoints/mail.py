@@ -1,19 +1,110 @@
-from fastapi import APIRouter, Depends
-from typing import List
+from datetime import datetime
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from typing import List, Optional
+from src.core.config import settings
 from src.core.graph_client import GraphClient
+from src.core.tokens import token_subject
+from src.services.bulk_mail_service import BulkMailSender, get_bulk_mail_sender
 from src.services.mail_service import MailService
-from src.models.mail import Message, SendMessageRequest
-from src.api.deps import get_graph_client
+from src.models.mail import BulkSendJob, BulkSendRequest, MailSearchHit, Message, SendMessageRequest
+from src.services.sync_service import MAIL, SyncService
+from src.api.deps import get_access_token, get_graph_client, get_graph_client_factory, get_sync_service
+from src.api.responses import models_response, ndjson_response, sync_pending_response
 
 router = APIRouter()
 
 @router.get("/", response_model=List[Message])
-async def get_emails(top: int = 10, client: GraphClient = Depends(get_graph_client)):
+async def get_emails(
+    background_tasks: BackgroundTasks,
+    top: int = 10,
+    local: bool = False,
+    folder: str = "inbox",
+    summary: bool = False,
+    client: GraphClient = Depends(get_graph_client),
+    sync: SyncService = Depends(get_sync_service)
+):
     """
-    Get user's emails.
+    Get user's emails from all folders. With local=true only one mail folder
+    (`folder`, the inbox by default) is served, straight from the local
+    store; when its last delta round is older than SYNC_MAX_AGE_SECONDS one
+    runs in the background. Before its first sync has finished the answer
+    is 202 "sync pending". With summary=true heavy fields such as the body
+    are not fetched.
     """
+    if local:
+        resource = f"{MAIL}:{folder}"
+        age = await sync.sync_age(resource)
+        if age is None or age > settings.SYNC_MAX_AGE_SECONDS:
+            background_tasks.add_task(sync.background_sync, resource, lambda: sync.sync_mail(folder))
+        if age is None:
+            return sync_pending_response(resource)
+        return models_response(await sync.get_messages(top=top, folder=folder))
     service = MailService(client)
-    return await service.get_messages(top=top)
+    return models_response(await service.get_messages(top=top, summary=summary))
+
+@router.get("/stream")
+async def stream_emails(
+    page_size: int = 50,
+    limit: Optional[int] = None,
+    summary: bool = True,
+    client: GraphClient = Depends(get_graph_client)
+):
+    """
+    Stream all emails as NDJSON, one message per line, page by page.
+    Bodies are left out unless summary=false.
+    """
+    service = MailService(client)
+    messages = service.iter_messages(page_size=page_size, summary=summary)
+    return ndjson_response(messages, limit=limit)
+
+@router.get("/search", response_model=List[MailSearchHit])
+async def search_emails(
+    q: str = "",
+    sender: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    top: int = Query(25, ge=1, le=100),
+    refresh: bool = False,
+    sync: SyncService = Depends(get_sync_service)
+):
+    """
+    Search synced mail by subject, people and body, best matches first.
+    Served from the local index without calling Graph; refresh=true runs an
+    incremental delta round first.
+    """
+    if refresh:
+        await sync.sync_mail()
+    return models_response(await sync.search_messages(
+        q, sender=sender, since=since, until=until, top=top))
+
+@router.post("/send/bulk", response_model=BulkSendJob, status_code=202)
+async def send_bulk_emails(
+    request: BulkSendRequest,
+    access_token: str = Depends(get_access_token),
+    client_factory=Depends(get_graph_client_factory),
+    sender: BulkMailSender = Depends(get_bulk_mail_sender)
+):
+    """
+    Queue many emails for sending. Returns a job to poll for per-message status.
+    """
+    if len(request.messages) > settings.MAIL_BULK_MAX_MESSAGES:
+        raise HTTPException(status_code=413,
+                            detail=f"At most {settings.MAIL_BULK_MAX_MESSAGES} messages per job")
+    return await sender.submit(token_subject(access_token), client_factory, request.messages)
+
+@router.get("/send/bulk/{job_id}", response_model=BulkSendJob)
+async def get_bulk_send_job(
+    job_id: str,
+    access_token: str = Depends(get_access_token),
+    sender: BulkMailSender = Depends(get_bulk_mail_sender)
+):
+    """
+    Status of a bulk send job.
+    """
+    job = await sender.get_job(job_id, token_subject(access_token))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @router.get("/{message_id}", response_model=Message)
 async def get_email(message_id: str, client: GraphClient = Depends(get_graph_client)):
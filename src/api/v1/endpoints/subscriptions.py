@@ -0,0 +1,88 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse
+from typing import List, Optional
+from src.core.exceptions import ConfigurationException
+from src.core.tokens import token_subject
+from src.models.subscription import CreateSubscriptionRequest, Subscription
+from src.services.subscription_service import SubscriptionManager
+from src.api.deps import (get_access_token, get_graph_client_factory, get_session_account_id,
+                          get_subscription_manager)
+
+router = APIRouter()
+
+@router.post("/notifications", status_code=202)
+async def receive_notifications(
+    request: Request,
+    validation_token: Optional[str] = Query(None, alias="validationToken"),
+    manager: SubscriptionManager = Depends(get_subscription_manager)
+):
+    """
+    Webhook for Graph change and lifecycle notifications. Echoes
+    validationToken for the validation handshake; otherwise queues the
+    notifications whose clientState matches and answers 202 at once.
+    """
+    if validation_token is not None:
+        return PlainTextResponse(validation_token)
+    try:
+        await manager.accept(await request.json())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid notification payload")
+    return Response(status_code=202)
+
+@router.post("/", response_model=Subscription, status_code=201)
+async def create_subscription(
+    request: CreateSubscriptionRequest,
+    access_token: str = Depends(get_access_token),
+    client_factory=Depends(get_graph_client_factory),
+    account_id: Optional[str] = Depends(get_session_account_id),
+    manager: SubscriptionManager = Depends(get_subscription_manager)
+):
+    """
+    Subscribe to changes in the user's mail folder, calendar or OneDrive.
+    The subscription is renewed automatically until it is deleted.
+    """
+    try:
+        return await manager.create(token_subject(access_token), client_factory, request.resource,
+                                    folder=request.folder, change_type=request.change_type,
+                                    account_id=account_id)
+    except ConfigurationException as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@router.get("/", response_model=List[Subscription])
+async def list_subscriptions(
+    access_token: str = Depends(get_access_token),
+    manager: SubscriptionManager = Depends(get_subscription_manager)
+):
+    """
+    List the user's active subscriptions.
+    """
+    return await manager.subscriptions(token_subject(access_token))
+
+@router.post("/{subscription_id}/renew", response_model=Subscription)
+async def renew_subscription(
+    subscription_id: str,
+    access_token: str = Depends(get_access_token),
+    client_factory=Depends(get_graph_client_factory),
+    manager: SubscriptionManager = Depends(get_subscription_manager)
+):
+    """
+    Extend a subscription now instead of waiting for automatic renewal.
+    """
+    subscription = await manager.renew(token_subject(access_token), subscription_id, client_factory)
+    if subscription is None:
+        raise HTTPException(status_code=404, detail="Subscription not found")
+    return subscription
+
+@router.delete("/{subscription_id}", status_code=204)
+async def delete_subscription(
+    subscription_id: str,
+    access_token: str = Depends(get_access_token),
+    client_factory=Depends(get_graph_client_factory),
+    manager: SubscriptionManager = Depends(get_subscription_manager)
+):
+    """
+    Stop receiving notifications for a subscription.
+    """
+    if not await manager.delete(token_subject(access_token), subscription_id, client_factory):
+        raise HTTPException(status_code=404, detail="Subscription not found")
+    return Response(status_code=204)
@@ -0,0 +1,19 @@
+from fastapi import APIRouter, Depends
+from src.services.sync_service import SyncService
+from src.api.deps import get_sync_service
+
+router = APIRouter()
+
+@router.post("/mail")
+async def sync_mail(folder: str = "inbox", sync: SyncService = Depends(get_sync_service)):
+    """
+    Run one incremental delta round for a mail folder.
+    """
+    return await sync.sync_mail(folder=folder)
+
+@router.post("/calendar")
+async def sync_calendar(sync: SyncService = Depends(get_sync_service)):
+    """
+    Run one incremental delta round for the calendar.
+    """
+    return await sync.sync_calendar()
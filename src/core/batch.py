@@ -0,0 +1,128 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from src.core.exceptions import GraphAPIException
+
+# Graph accepts at most 20 sub-requests per JSON $batch call.
+MAX_BATCH_SIZE = 20
+
+
+@dataclass
+class BatchRequest:
+    method: str
+    url: str
+    body: Any = None
+    headers: Dict[str, str] = field(default_factory=dict)
+    # Whether the request may be replayed on throttling; not sent to Graph.
+    retry: bool = False
+    # Positions of requests in the same $batch that must finish first.
+    depends_on: List[int] = field(default_factory=list)
+
+
+def build_batch_payload(requests: List[BatchRequest]) -> Dict:
+    items = []
+    for index, request in enumerate(requests):
+        item = {"id": str(index), "method": request.method, "url": request.url}
+        headers = dict(request.headers)
+        if request.body is not None:
+            headers.setdefault("Content-Type", "application/json")
+            item["body"] = request.body
+        if headers:
+            item["headers"] = headers
+        if request.depends_on:
+            item["dependsOn"] = [str(position) for position in request.depends_on]
+        items.append(item)
+    return {"requests": items}
+
+
+def parse_batch_response(payload: Dict, count: int) -> List[Any]:
+    """Orders sub-responses by id; failed items become GraphAPIException."""
+    by_id = {item.get("id"): item for item in (payload or {}).get("responses", [])}
+    results: List[Any] = []
+    for index in range(count):
+        item = by_id.get(str(index))
+        if item is None:
+            results.append(GraphAPIException(
+                status_code=502, message="Missing response in $batch reply"))
+            continue
+
+        status = item.get("status", 500)
+        body = item.get("body")
+        if status >= 400:
+            error = body.get("error", {}) if isinstance(body, dict) else {}
+            results.append(GraphAPIException(
+                status_code=status,
+                message=f"Graph API request failed: {error.get('message', status)}",
+                details=body if isinstance(body, dict) else {"raw": body},
+                headers=item.get("headers"),
+            ))
+        elif status == 204:
+            results.append(None)
+        else:
+            results.append(body)
+    return results
+
+
+class _PendingBatch:
+    def __init__(self, client):
+        self.client = client
+        self.items: List[Tuple[BatchRequest, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.flushed = False
+
+
+class BatchCoalescer:
+    """
+    Collects concurrent calls made with the same token during a short window
+    and sends them to Graph as a single $batch request.
+    """
+
+    def __init__(self, window_seconds: float, max_size: int = MAX_BATCH_SIZE):
+        self.window_seconds = window_seconds
+        self.max_size = max_size
+        self._pending: Dict[str, _PendingBatch] = {}
+
+    async def submit(self, client, request: BatchRequest) -> Any:
+        loop = asyncio.get_running_loop()
+        batch = self._pending.get(client.access_token)
+        if batch is None:
+            batch = _PendingBatch(client)
+            self._pending[client.access_token] = batch
+            batch.timer = loop.call_later(self.window_seconds, self._flush, batch)
+
+        future = loop.create_future()
+        batch.items.append((request, future))
+        if len(batch.items) >= self.max_size:
+            self._flush(batch)
+        return await future
+
+    def _flush(self, batch: _PendingBatch) -> None:
+        if batch.flushed:
+            return
+        batch.flushed = True
+        batch.timer.cancel()
+        if self._pending.get(batch.client.access_token) is batch:
+            del self._pending[batch.client.access_token]
+        asyncio.ensure_future(self._dispatch(batch))
+
+    async def _dispatch(self, batch: _PendingBatch) -> None:
+        requests = [request for request, _ in batch.items]
+        try:
+            if len(requests) == 1:
+                # Nothing to coalesce, skip the $batch envelope.
+                request = requests[0]
+                results = [await batch.client._request(
+                    request.method, request.url, headers=request.headers or None,
+                    retry=request.retry, json=request.body)]
+            else:
+                results = await batch.client.send_batch(requests)
+        except Exception as e:
+            results = [e] * len(requests)
+
+        for (_, future), result in zip(batch.items, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,138 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Optional
+from src.core.config import settings
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    size: int
+    expires_at: float
+    etag: Optional[str] = None
+
+    @property
+    def fresh(self) -> bool:
+        return time.monotonic() < self.expires_at
+
+    @property
+    def age_past_expiry(self) -> float:
+        return max(0.0, time.monotonic() - self.expires_at)
+
+
+class LRUCache:
+    """
+    Bounded LRU mapping with a per-entry TTL and an optional byte budget.
+    Expired entries are kept until evicted so callers can revalidate them.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 60.0,
+                 max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        if entry.fresh:
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+        return entry
+
+    def set(self, key: Hashable, value: Any, size: int = 0,
+            etag: Optional[str] = None, ttl: Optional[float] = None) -> Optional[CacheEntry]:
+        if self.max_bytes is not None and size > self.max_bytes:
+            return None
+        self.delete(key)
+        entry = CacheEntry(value=value, size=size, etag=etag,
+                           expires_at=time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._entries[key] = entry
+        self.bytes += size
+        while len(self._entries) > self.max_entries or (
+                self.max_bytes is not None and self.bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= evicted.size
+            self.evictions += 1
+        return entry
+
+    def touch(self, key: Hashable, ttl: Optional[float] = None) -> None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+
+    def delete(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        keys = [key for key in self._entries if predicate(key)]
+        for key in keys:
+            self.delete(key)
+        return len(keys)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class ResponseCache(LRUCache):
+    """Per-user cache of Graph GET responses, revalidated with ETags."""
+
+    def __init__(self, max_entries: int, ttl: float, max_bytes: int,
+                 stale_while_revalidate: float = 0.0):
+        super().__init__(max_entries=max_entries, ttl=ttl, max_bytes=max_bytes)
+        self.stale_while_revalidate = stale_while_revalidate
+        self.revalidations = 0
+        self.not_modified = 0
+
+    def stats(self) -> Dict[str, int]:
+        stats = super().stats()
+        stats["revalidations"] = self.revalidations
+        stats["not_modified"] = self.not_modified
+        return stats
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(
+            max_entries=settings.GRAPH_CACHE_MAX_ENTRIES,
+            ttl=settings.GRAPH_CACHE_TTL_SECONDS,
+            max_bytes=settings.GRAPH_CACHE_MAX_BYTES,
+            stale_while_revalidate=settings.GRAPH_CACHE_STALE_WHILE_REVALIDATE_SECONDS,
+        )
+    return _response_cache
+
+
+def response_cache_stats() -> Dict[str, int]:
+    """Stats of the response cache; empty while nothing has created it."""
+    return _response_cache.stats() if _response_cache is not None else {}
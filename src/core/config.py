@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 from pydantic import AnyHttpUrl, validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -13,6 +13,130 @@ class Settings(BaseSettings):
     REDIRECT_URI: str = "http://localhost:8000/callback"
     GRAPH_API_ENDPOINT: str = "https://graph.microsoft.com/v1.0"
     SCOPES: str = "User.Read Mail.Read Mail.Send Calendars.ReadWrite Files.ReadWrite"
+    # Renew access tokens silently this long before they expire
+    AUTH_REFRESH_SKEW_SECONDS: int = 300
+    # Optional file also keeping each account's MSAL token cache (holds
+    # refresh tokens; written 0600). The session store is always used.
+    AUTH_TOKEN_CACHE_PATH: Optional[str] = None
+    # How long an account's token cache is kept in the session store
+    # (the lifetime of its refresh token)
+    AUTH_ACCOUNT_CACHE_TTL_SECONDS: int = 90 * 24 * 3600
+    # Worker threads for MSAL's blocking token-endpoint calls
+    AUTH_THREAD_POOL_SIZE: int = 4
+
+    # Decode Graph responses with orjson when it is installed
+    GRAPH_FAST_JSON: bool = True
+    # Build models from Graph payloads without re-running EmailStr checks;
+    # Graph already validated them, and they are most of the validation cost
+    GRAPH_TRUSTED_MODELS: bool = True
+
+    # Graph HTTP connection pool
+    GRAPH_HTTP2: bool = True
+    GRAPH_POOL_MAX_CONNECTIONS: int = 100
+    GRAPH_POOL_MAX_KEEPALIVE: int = 20
+    GRAPH_POOL_KEEPALIVE_EXPIRY: float = 30.0
+    GRAPH_TIMEOUT_SECONDS: float = 30.0
+
+    # Coalesce concurrent calls per token into JSON $batch requests
+    GRAPH_BATCH_ENABLED: bool = False
+    GRAPH_BATCH_WINDOW_MS: float = 5.0
+
+    # Retries on throttling (429/503/504) and transient network errors
+    GRAPH_RETRY_MAX_ATTEMPTS: int = 4
+    GRAPH_RETRY_BASE_DELAY: float = 0.5
+    GRAPH_RETRY_MAX_DELAY: float = 30.0
+    GRAPH_RETRY_BUDGET_SECONDS: float = 60.0
+
+    # Share one upstream call between identical concurrent GETs per user
+    GRAPH_SINGLE_FLIGHT_ENABLED: bool = True
+
+    # Per-user GET response cache with ETag revalidation
+    GRAPH_CACHE_ENABLED: bool = False
+    GRAPH_CACHE_TTL_SECONDS: float = 30.0
+    GRAPH_CACHE_MAX_ENTRIES: int = 2048
+    GRAPH_CACHE_MAX_BYTES: int = 32 * 1024 * 1024
+    GRAPH_CACHE_STALE_WHILE_REVALIDATE_SECONDS: float = 0.0
+    # Endpoints containing any of these fragments are never cached
+    GRAPH_CACHE_EXCLUDE: List[str] = ["/delta", "/content", "$batch"]
+
+    # Bulk mail sends. Exchange Online allows 30 messages a minute per
+    # mailbox by default, about 1,800 an hour: 10,000 an hour needs about
+    # six sending mailboxes, or a tenant with raised limits. Raise these
+    # only if the tenant's limits allow it.
+    MAIL_SEND_RATE_PER_MINUTE: float = 30.0
+    MAIL_SEND_BURST: int = 20
+    MAIL_BULK_CONCURRENCY: int = 4
+    MAIL_BULK_MAX_MESSAGES: int = 10_000
+    # Job status is kept in the session store this long
+    MAIL_BULK_JOB_TTL_SECONDS: int = 24 * 3600
+
+    # Attendee free/busy blocks from getSchedule, cached per attendee and day
+    CALENDAR_SCHEDULE_CACHE_TTL_SECONDS: float = 120.0
+    CALENDAR_SCHEDULE_CACHE_MAX_ENTRIES: int = 50_000
+
+    # calendarView windows already fetched are reused per user for this long
+    CALENDAR_RANGE_CACHE_TTL_SECONDS: float = 300.0
+    CALENDAR_RANGE_CACHE_MAX_USERS: int = 1000
+    CALENDAR_VIEW_PAGE_SIZE: int = 100
+
+    # Events accepted by one bulk create call, sent as $batch groups of 20
+    CALENDAR_BULK_MAX_EVENTS: int = 500
+
+    # OneDrive transfers
+    DRIVE_STREAM_CHUNK_SIZE: int = 64 * 1024
+    # Upload session fragments must be a multiple of 320 KiB
+    DRIVE_UPLOAD_CHUNK_SIZE: int = 10 * 320 * 1024
+    DRIVE_SIMPLE_UPLOAD_LIMIT: int = 4 * 1024 * 1024
+    DRIVE_UPLOAD_MAX_RESUMES: int = 3
+    # Recursive crawls: folders listed at once, items per page, and whether
+    # each worker asks for the first pages of up to 20 folders in one $batch
+    DRIVE_CRAWL_CONCURRENCY: int = 8
+    DRIVE_CRAWL_PAGE_SIZE: int = 200
+    DRIVE_CRAWL_BATCH: bool = False
+    # Local folder mirrors: parallel transfers, and the hash manifest kept
+    # in the local folder so unchanged files are not read again
+    DRIVE_MIRROR_CONCURRENCY: int = 4
+    DRIVE_MIRROR_MANIFEST: str = ".graph-mirror.json"
+
+    # Change notifications. Graph posts to SUBSCRIPTION_NOTIFICATION_URL,
+    # a public HTTPS URL routed to /api/v1/subscriptions/notifications;
+    # subscriptions are renewed this long before they expire. Workers
+    # sharing SUBSCRIPTION_DB_PATH accept each other's notifications
+    SUBSCRIPTION_NOTIFICATION_URL: Optional[str] = None
+    SUBSCRIPTION_DB_PATH: str = "graph_subscriptions.db"
+    SUBSCRIPTION_LIFETIME_MINUTES: int = 3 * 24 * 60
+    SUBSCRIPTION_RENEW_BEFORE_MINUTES: int = 120
+    SUBSCRIPTION_RENEW_CHECK_SECONDS: float = 300.0
+    # Delta rounds started by notifications wait this long, so a burst of
+    # changes to one folder or calendar is synced in one round
+    SUBSCRIPTION_SYNC_DELAY_SECONDS: float = 1.0
+    # Notifications waiting per in-process consumer before new ones are dropped
+    SUBSCRIPTION_QUEUE_SIZE: int = 1000
+
+    # Login sessions: "memory" (single process) or "redis" (shared)
+    SESSION_BACKEND: str = "memory"
+    SESSION_TTL_SECONDS: int = 8 * 3600
+    SESSION_MAX_ENTRIES: int = 10_000
+    SESSION_REDIS_URL: str = "redis://localhost:6379/0"
+    SESSION_REDIS_POOL_SIZE: int = 4
+    SESSION_REDIS_CONNECT_TIMEOUT_SECONDS: float = 2.0
+    SESSION_REDIS_TIMEOUT_SECONDS: float = 2.0
+    SESSION_LOCAL_CACHE_SECONDS: float = 5.0
+
+    # Local delta-sync store
+    SYNC_DB_PATH: str = "graph_sync.db"
+    # ?local=true reads never wait for Graph; when the last delta round is
+    # older than this, the read starts one in the background
+    SYNC_MAX_AGE_SECONDS: float = 60.0
+    # Full-text index of synced mail behind /mail/search
+    MAIL_SEARCH_DB_PATH: str = "mail_search.db"
+    # Only this many of the newest matches are ranked for very common words
+    MAIL_SEARCH_RANK_WINDOW: int = 5000
+    SYNC_CALENDAR_PAST_DAYS: int = 30
+    SYNC_CALENDAR_FUTURE_DAYS: int = 90
+
+    # Serve /metrics (Prometheus text format) and time every API route
+    METRICS_ENABLED: bool = True
 
     # CORS
     BACKEND_CORS_ORIGINS: List[AnyHttpUrl] = []
@@ -4,10 +4,12 @@ class AppException(Exception):
 
 class GraphAPIException(AppException):
     """Exception raised for errors in the Graph API."""
-    def __init__(self, status_code: int, message: str, details: dict = None):
+    def __init__(self, status_code: int, message: str, details: dict = None,
+                 headers: dict = None):
         self.status_code = status_code
         self.message = message
         self.details = details
+        self.headers = headers or {}
         super().__init__(f"Graph API Error {status_code}: {message}")
 
 class AuthException(AppException):
@@ -17,3 +19,7 @@ class AuthException(AppException):
 class ConfigurationException(AppException):
     """Exception raised for configuration errors."""
     pass
+
+class TemplateException(AppException):
+    """Exception raised when a message template cannot be compiled or rendered."""
+    pass
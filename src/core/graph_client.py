@@ -1,14 +1,108 @@
+import asyncio
+import time
 import httpx
-from typing import Any, Dict, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional
+from src.core.batch import (
+    MAX_BATCH_SIZE,
+    BatchCoalescer,
+    BatchRequest,
+    build_batch_payload,
+    parse_batch_response,
+)
+from src.core import fastjson
+from src.core.cache import CacheEntry, get_response_cache
 from src.core.config import settings
 from src.core.exceptions import GraphAPIException
+from src.core.http_pool import get_http_client
+from src.core.metrics import (
+    endpoint_template,
+    graph_request_seconds,
+    graph_requests_in_flight,
+    graph_retries,
+    graph_throttled,
+)
+from src.core.retry import RETRY_STATUSES, RetryPolicy, default_retry_policy
+from src.core.singleflight import graph_get_flights
+from src.core.tokens import token_subject
 from loguru import logger
 
+_coalescer: Optional[BatchCoalescer] = None
+# Cache keys with a stale-while-revalidate refresh in flight.
+_revalidating: set = set()
+# Roots whose resource path starts one segment further in, after the
+# user, group, site or drive id: /users/{id}/messages, /drives/{id}/items.
+_ID_ROOTS = ("users", "groups", "sites", "drives")
+
+# Response headers worth forwarding when proxying a streamed download.
+PASSTHROUGH_HEADERS = (
+    "Content-Length", "Content-Range", "Accept-Ranges", "ETag", "Last-Modified",
+)
+
+
+def get_coalescer() -> BatchCoalescer:
+    global _coalescer
+    if _coalescer is None:
+        _coalescer = BatchCoalescer(settings.GRAPH_BATCH_WINDOW_MS / 1000)
+    return _coalescer
+
+
+def _json_copy(value: Any) -> Any:
+    """A re-decoded copy of a decoded Graph response, like a cache hit returns."""
+    if isinstance(value, (dict, list)):
+        return fastjson.loads(fastjson.dumps(value))
+    return value
+
+
+class GraphStream:
+    """A Graph response whose body is read incrementally; always aclose() it."""
+
+    def __init__(self, response: httpx.Response,
+                 owned_client: Optional[httpx.AsyncClient] = None):
+        self._response = response
+        self._owned_client = owned_client
+
+    @property
+    def status_code(self) -> int:
+        return self._response.status_code
+
+    @property
+    def headers(self) -> httpx.Headers:
+        return self._response.headers
+
+    @property
+    def media_type(self) -> str:
+        return self.headers.get("Content-Type", "application/octet-stream")
+
+    def passthrough_headers(self) -> Dict[str, str]:
+        return {name: self.headers[name]
+                for name in PASSTHROUGH_HEADERS if name in self.headers}
+
+    async def aiter_bytes(self, chunk_size: Optional[int] = None) -> AsyncIterator[bytes]:
+        async for chunk in self._response.aiter_bytes(chunk_size):
+            yield chunk
+
+    async def aclose(self) -> None:
+        await self._response.aclose()
+        if self._owned_client is not None:
+            await self._owned_client.aclose()
+
 
 class GraphClient:
-    def __init__(self, access_token: str):
+    def __init__(self, access_token: str,
+                 http_client: Optional[httpx.AsyncClient] = None,
+                 batching: Optional[bool] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 cache: Optional[bool] = None,
+                 single_flight: Optional[bool] = None):
         self.access_token = access_token
         self.base_url = settings.GRAPH_API_ENDPOINT
+        self._http_client = http_client
+        self.batching = settings.GRAPH_BATCH_ENABLED if batching is None else batching
+        self.retry_policy = retry_policy or default_retry_policy()
+        self.cache_enabled = settings.GRAPH_CACHE_ENABLED if cache is None else cache
+        self._subject: Optional[str] = None
+        self.single_flight = (settings.GRAPH_SINGLE_FLIGHT_ENABLED
+                              if single_flight is None else single_flight)
         self.headers = {
             "Authorization": f"Bearer {self.access_token}",
             "Content-Type": "application/json",
@@ -19,58 +113,366 @@ class GraphClient:
             method: str,
             endpoint: str,
             headers: Optional[Dict] = None,
+            retry: bool = False,
             **kwargs) -> Any:
-        url = f"{self.base_url}{endpoint}"
-        req_headers = self.headers.copy()
+        if endpoint.startswith(self.base_url):
+            # Absolute Graph links such as @odata.nextLink.
+            endpoint = endpoint[len(self.base_url):]
+        # Pre-authenticated absolute URLs (upload sessions) are not Graph
+        # paths and cannot go inside a $batch.
+        if self.batching and "://" not in endpoint and set(kwargs) <= {"json", "params"}:
+            url = endpoint
+            if kwargs.get("params"):
+                separator = "&" if "?" in url else "?"
+                url = f"{url}{separator}{httpx.QueryParams(kwargs['params'])}"
+            request = BatchRequest(
+                method=method, url=url, body=kwargs.get("json"),
+                headers=dict(headers or {}), retry=retry,
+            )
+            result = await get_coalescer().submit(self, request)
+        else:
+            result = await self._request(method, endpoint, headers=headers,
+                                         retry=retry, **kwargs)
+        if method != "GET" and self.cache_enabled:
+            self._invalidate_cached(endpoint)
+        return result
+
+    async def _request(
+            self,
+            method: str,
+            endpoint: str,
+            headers: Optional[Dict] = None,
+            retry: bool = False,
+            **kwargs) -> Any:
+        response = await self._request_response(
+            method, endpoint, headers=headers, retry=retry, **kwargs)
+        return self._decode(response)
+
+    async def _request_response(
+            self,
+            method: str,
+            endpoint: str,
+            headers: Optional[Dict] = None,
+            retry: bool = False,
+            **kwargs) -> httpx.Response:
+        url, req_headers = self._prepare(endpoint, headers)
+
+        logger.debug(f"Graph API Request: {method} {url}")
+
+        response = await self._send_with_retry(
+            method, endpoint, url, req_headers, retry, **kwargs)
+        if response.status_code == 304:
+            return response
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Graph API Error: {e.response.text}")
+            try:
+                details = e.response.json()
+            except Exception:
+                details = {"raw": e.response.text}
+            raise GraphAPIException(
+                status_code=e.response.status_code,
+                message=f"Graph API request failed: {e}",
+                details=details,
+                headers=dict(e.response.headers),
+            )
+        return response
+
+    @staticmethod
+    def _decode(response: httpx.Response) -> Any:
+        if response.status_code == 204:
+            return None
+
+        content_type = response.headers.get("Content-Type", "")
+        if "application/json" in content_type:
+            if settings.GRAPH_FAST_JSON and isinstance(response.content, bytes):
+                return fastjson.loads(response.content)
+            return response.json()
+        return response.content
+
+    def _prepare(self, endpoint: str, headers: Optional[Dict]):
+        if endpoint.startswith(self.base_url):
+            endpoint = endpoint[len(self.base_url):]
+        if endpoint.startswith("https://"):
+            # Pre-authenticated URLs (e.g. upload sessions) must not carry the token.
+            url = endpoint
+            req_headers = {k: v for k, v in self.headers.items() if k != "Authorization"}
+        else:
+            url = f"{self.base_url}{endpoint}"
+            req_headers = self.headers.copy()
         if headers:
             req_headers.update(headers)
+        return url, req_headers
 
-        logger.debug(f"Graph API Request: {method} {url}")
+    async def _send_with_retry(self, method: str, endpoint: str, url: str,
+                               headers: Dict, retry: bool,
+                               **kwargs) -> httpx.Response:
+        policy = self.retry_policy if retry else None
+        deadline = time.monotonic() + (policy.total_budget if policy else 0)
+        template = endpoint_template(endpoint)
+        call = f"{method} {template}"
+        attempt = 0
+        while True:
+            try:
+                response = await self._timed_send(method, template, url, headers, **kwargs)
+            except httpx.RequestError as e:
+                reason = "network"
+                delay = policy.next_delay(attempt, deadline) if policy else None
+                if delay is None:
+                    logger.error(f"Network Error: {e}")
+                    status = 504 if isinstance(e, httpx.TimeoutException) else 503
+                    raise GraphAPIException(
+                        status_code=status, message=f"Network error: {e}")
+                logger.warning(f"Retrying {call} in {delay:.2f}s after network error: {e}")
+            else:
+                reason = str(response.status_code)
+                if policy is None or response.status_code not in RETRY_STATUSES:
+                    return response
+                delay = policy.next_delay(
+                    attempt, deadline, response.headers.get("Retry-After"))
+                if delay is None:
+                    return response
+                await response.aclose()
+                logger.warning(
+                    f"Retrying {call} in {delay:.2f}s after {response.status_code}")
+
+            graph_retries.inc((method, template, reason))
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _timed_send(self, method: str, template: str, url: str,
+                          headers: Dict, **kwargs) -> httpx.Response:
+        status = "error"
+        started = time.perf_counter()
+        graph_requests_in_flight.inc()
+        try:
+            response = await self._send(method, url, headers, **kwargs)
+            status = str(response.status_code)
+            if response.status_code in RETRY_STATUSES:
+                graph_throttled.inc((method, template, status))
+            return response
+        finally:
+            graph_requests_in_flight.dec()
+            graph_request_seconds.observe((method, template, status), time.perf_counter() - started)
+
+    async def paginate(self, endpoint: str, params: Optional[Dict] = None,
+                       prefetch: bool = True) -> AsyncIterator[Dict]:
+        """
+        Yields items from every page of a collection, following
+        @odata.nextLink. With prefetch the next page is requested while the
+        current one is being consumed.
+        """
+        page_task = asyncio.ensure_future(self.get(endpoint, params=params))
+        try:
+            while page_task is not None:
+                page = await page_task or {}
+                page_task = None
+                next_link = page.get("@odata.nextLink")
+                if next_link and prefetch:
+                    page_task = asyncio.ensure_future(self.get(next_link))
+                for item in page.get("value", []):
+                    yield item
+                if next_link and not prefetch:
+                    page_task = asyncio.ensure_future(self.get(next_link))
+        finally:
+            if page_task is not None and not page_task.done():
+                page_task.cancel()
+
+    async def open_stream(self, method: str, endpoint: str,
+                          headers: Optional[Dict] = None) -> GraphStream:
+        """
+        Sends a request and returns the response before its body is read, so
+        large payloads can be forwarded chunk by chunk. Redirects (such as the
+        pre-authenticated download URL behind /content) are followed.
+        """
+        url, req_headers = self._prepare(endpoint, headers)
+
+        logger.debug(f"Graph API Stream: {method} {url}")
+
+        owned_client = None
+        if self._http_client is None and get_http_client() is None:
+            owned_client = httpx.AsyncClient()
+        response = await self._send_with_retry(
+            method, endpoint, url, req_headers, method in ("GET", "HEAD"),
+            stream=True, http_client=owned_client)
+        stream = GraphStream(response, owned_client)
+
+        if response.status_code >= 400:
+            await response.aread()
+            await stream.aclose()
+            try:
+                details = response.json()
+            except Exception:
+                details = {"raw": response.text}
+            raise GraphAPIException(
+                status_code=response.status_code,
+                message="Graph API stream request failed",
+                details=details,
+            )
+        return stream
+
+    async def send_batch(self, requests: List[BatchRequest]) -> List[Any]:
+        """Sends up to 20 requests as one $batch call, results in input order."""
+        payload = build_batch_payload(requests)
+        # The envelope is a POST, but it is only safe to replay when every
+        # item in it may be retried.
+        retry = all(request.retry for request in requests)
+        data = await self._request("POST", "/$batch", retry=retry, json=payload)
+        return parse_batch_response(data, len(requests))
 
+    async def batch(self, requests: List[BatchRequest]) -> List[Any]:
+        """
+        Sends any number of requests in concurrent $batch groups of 20.
+        Failed items are returned as GraphAPIException instead of raised.
+        """
+        groups = [requests[i:i + MAX_BATCH_SIZE]
+                  for i in range(0, len(requests), MAX_BATCH_SIZE)]
+        replies = await asyncio.gather(
+            *(self.send_batch(group) for group in groups), return_exceptions=True
+        )
+        results: List[Any] = []
+        for group, reply in zip(groups, replies):
+            if isinstance(reply, Exception):
+                results.extend([reply] * len(group))
+            else:
+                results.extend(reply)
+        return results
+
+    async def _send(self, method: str, url: str, headers: Dict,
+                    stream: bool = False,
+                    http_client: Optional[httpx.AsyncClient] = None,
+                    **kwargs) -> httpx.Response:
+        # Reuse the shared pool when the app lifespan has started it;
+        # standalone scripts fall back to a short-lived client.
+        http_client = http_client or self._http_client or get_http_client()
+        if stream:
+            request = http_client.build_request(
+                method=method, url=url, headers=headers, **kwargs)
+            return await http_client.send(request, stream=True, follow_redirects=True)
+        if http_client is not None:
+            return await http_client.request(
+                method=method, url=url, headers=headers, **kwargs
+            )
         async with httpx.AsyncClient() as client:
+            return await client.request(
+                method=method, url=url, headers=headers, **kwargs
+            )
+
+    @property
+    def subject(self) -> str:
+        if self._subject is None:
+            self._subject = token_subject(self.access_token)
+        return self._subject
+
+    async def get(self, endpoint: str, params: Optional[Dict] = None,
+                  cache: bool = True) -> Any:
+        if self.single_flight:
+            # Identical concurrent GETs for the same user share one upstream call.
+            key = self._cache_key(endpoint, params)
+            return await graph_get_flights.do(
+                key, lambda: self._get(endpoint, params, cache), copy=_json_copy)
+        return await self._get(endpoint, params, cache)
+
+    async def _get(self, endpoint: str, params: Optional[Dict], cache: bool) -> Any:
+        if cache and self._cacheable(endpoint):
+            return await self._cached_get(endpoint, params)
+        return await self.request("GET", endpoint, retry=True, params=params)
+
+    def _cacheable(self, endpoint: str) -> bool:
+        return self.cache_enabled and not any(
+            pattern in endpoint for pattern in settings.GRAPH_CACHE_EXCLUDE)
+
+    def _cache_key(self, endpoint: str, params: Optional[Dict]):
+        url, _ = self._prepare(endpoint, None)
+        if params:
+            url = str(httpx.URL(url).copy_merge_params(params))
+        return ("GET", url, self.subject)
+
+    async def _cached_get(self, endpoint: str, params: Optional[Dict]) -> Any:
+        cache = get_response_cache()
+        key = self._cache_key(endpoint, params)
+        entry = cache.get(key)
+        if entry is not None:
+            if entry.fresh:
+                return fastjson.loads(entry.value)
+            if entry.etag and entry.age_past_expiry < cache.stale_while_revalidate:
+                self._schedule_revalidation(key, endpoint, params, entry)
+                return fastjson.loads(entry.value)
+        return await self._fetch_into_cache(key, endpoint, params, entry)
+
+    async def _fetch_into_cache(self, key, endpoint: str, params: Optional[Dict],
+                                entry: Optional[CacheEntry]) -> Any:
+        cache = get_response_cache()
+        headers = None
+        if entry is not None and entry.etag:
+            headers = {"If-None-Match": entry.etag}
+            cache.revalidations += 1
+
+        response = await self._request_response(
+            "GET", endpoint, headers=headers, retry=True, params=params)
+        if response.status_code == 304 and entry is not None:
+            cache.not_modified += 1
+            cache.touch(key)
+            return fastjson.loads(entry.value)
+
+        value = self._decode(response)
+        if isinstance(value, (dict, list)):
+            etag = response.headers.get("ETag")
+            if etag is None and isinstance(value, dict):
+                etag = value.get("@odata.etag")
+            # The body is cached, not the decoded value: every hit decodes a
+            # fresh copy, so a caller changing its result cannot alter the cache.
+            cache.set(key, response.content, size=len(response.content), etag=etag)
+        return value
+
+    def _schedule_revalidation(self, key, endpoint: str, params: Optional[Dict],
+                               entry: CacheEntry) -> None:
+        if key in _revalidating:
+            return
+        _revalidating.add(key)
+
+        async def revalidate():
             try:
-                response = await client.request(
-                    method=method, url=url, headers=req_headers, **kwargs
-                )
-                response.raise_for_status()
-
-                if response.status_code == 204:
-                    return None
-
-                content_type = response.headers.get("Content-Type", "")
-                if "application/json" in content_type:
-                    return response.json()
-                return response.content
-
-            except httpx.HTTPStatusError as e:
-                logger.error(f"Graph API Error: {e.response.text}")
-                try:
-                    details = e.response.json()
-                except Exception:
-                    details = {"raw": e.response.text}
-                raise GraphAPIException(
-                    status_code=e.response.status_code,
-                    message=f"Graph API request failed: {e}",
-                    details=details,
-                )
-            except httpx.RequestError as e:
-                logger.error(f"Network Error: {e}")
-                raise GraphAPIException(
-                    status_code=500, message=f"Network error: {e}")
+                await self._fetch_into_cache(key, endpoint, params, entry)
+            except Exception as e:
+                logger.warning(f"Background revalidation of {endpoint} failed: {e}")
+            finally:
+                _revalidating.discard(key)
+
+        asyncio.ensure_future(revalidate())
 
-    async def get(self, endpoint: str, params: Optional[Dict] = None) -> Any:
-        return await self.request("GET", endpoint, params=params)
+    def _invalidate_cached(self, endpoint: str) -> None:
+        # A write makes this user's cached reads of the resource it belongs to
+        # stale: the item itself and every collection listing it, e.g. a
+        # PATCH of /me/messages/{id} drops /me/messages?$top=10 as well.
+        url, _ = self._prepare(endpoint.split("?")[0], None)
+        if url.startswith(self.base_url):
+            segments = url[len(self.base_url):].strip("/").split("/")
+            depth = 3 if segments[0] in _ID_ROOTS else 2
+            url = f"{self.base_url}/{'/'.join(segments[:depth])}"
+        subject = self.subject
+        get_response_cache().invalidate(
+            lambda key: key[2] == subject and key[1].startswith(url)
+            and key[1][len(url):len(url) + 1] in ("", "/", "?"))
 
-    async def post(self, endpoint: str, data: Optional[Dict] = None) -> Any:
-        return await self.request("POST", endpoint, json=data)
+    async def post(self, endpoint: str, data: Optional[Dict] = None,
+                   retry: bool = False) -> Any:
+        # POST is not idempotent, so it is only retried when the caller opts in.
+        return await self.request("POST", endpoint, retry=retry, json=data)
 
     async def put(self, endpoint: str, data: Any = None,
                   content_type: str = "application/json") -> Any:
         headers = {"Content-Type": content_type}
         if isinstance(data, (dict, list)):
-            return await self.request("PUT", endpoint, headers=headers, json=data)
+            return await self.request("PUT", endpoint, headers=headers,
+                                      retry=True, json=data)
         else:
-            return await self.request("PUT", endpoint, headers=headers, content=data)
+            return await self.request("PUT", endpoint, headers=headers,
+                                      retry=True, content=data)
+
+    async def patch(self, endpoint: str, data: Optional[Dict] = None) -> Any:
+        return await self.request("PATCH", endpoint, retry=True, json=data)
 
     async def delete(self, endpoint: str) -> Any:
-        return await self.request("DELETE", endpoint)
+        return await self.request("DELETE", endpoint, retry=True)
@@ -0,0 +1,81 @@
+import httpx
+from typing import Dict, Optional
+from src.core.config import settings
+from loguru import logger
+
+# Process-wide connection pool shared by every GraphClient.
+# Created and closed by the FastAPI lifespan in src/main.py.
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def create_http_client() -> httpx.AsyncClient:
+    http2 = settings.GRAPH_HTTP2 and _http2_available()
+    if settings.GRAPH_HTTP2 and not http2:
+        logger.warning("h2 is not installed, Graph requests will use HTTP/1.1")
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=settings.GRAPH_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.GRAPH_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=settings.GRAPH_POOL_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(settings.GRAPH_TIMEOUT_SECONDS),
+    )
+
+
+async def init_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = create_http_client()
+        logger.info("Graph HTTP connection pool started")
+    return _http_client
+
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+        logger.info("Graph HTTP connection pool closed")
+
+
+def get_http_client() -> Optional[httpx.AsyncClient]:
+    return _http_client
+
+
+def pool_stats() -> Dict[str, int]:
+    """Snapshot of the shared pool's connections and queued requests."""
+    stats = {"open": 0, "connections": 0, "idle": 0, "active": 0,
+             "http2": 0, "pending_requests": 0}
+    if _http_client is None:
+        return stats
+
+    stats["open"] = 1
+    # httpx does not expose its pool; these are httpcore internals, so any
+    # change in their shape leaves the counts at zero instead of failing.
+    try:
+        pool = _http_client._transport._pool
+        connections = list(pool.connections)
+        pending = len(pool._requests)
+    except (AttributeError, TypeError):
+        return stats
+
+    for connection in connections:
+        try:
+            idle, info = connection.is_idle(), connection.info()
+        except (AttributeError, TypeError):
+            continue
+        stats["connections"] += 1
+        stats["idle" if idle else "active"] += 1
+        if "HTTP/2" in info:
+            stats["http2"] += 1
+    stats["pending_requests"] = pending
+    return stats
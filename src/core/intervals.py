@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, List, Tuple, TypeVar
+
+T = TypeVar("T")
+Interval = Tuple[T, T]
+
+
+def merge(intervals: Iterable[Interval]) -> List[Interval]:
+    """
+    Sorts half-open intervals and merges overlapping or touching ones in a
+    single sweep, O(n log n).
+    """
+    merged: List[list] = []
+    for start, end in sorted(intervals):
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def subtract(windows: List[Interval], busy: List[Interval]) -> List[Interval]:
+    """
+    Parts of `windows` not covered by `busy`. Both lists must be sorted and
+    non-overlapping (as returned by `merge`); runs in O(len(windows) + len(busy)).
+    """
+    free: List[Interval] = []
+    i = 0
+    for start, end in windows:
+        cursor = start
+        while i < len(busy) and busy[i][1] <= cursor:
+            i += 1
+        j = i
+        while j < len(busy) and busy[j][0] < end:
+            if busy[j][0] > cursor:
+                free.append((cursor, busy[j][0]))
+            cursor = max(cursor, busy[j][1])
+            j += 1
+        if cursor < end:
+            free.append((cursor, end))
+    return free
+
+
+def slots(free: Iterable[Interval], duration: timedelta,
+          step: timedelta) -> Iterator[Tuple[datetime, datetime]]:
+    """
+    Start-aligned slots of `duration` inside the free intervals, earliest
+    first. Starts fall on multiples of `step` from midnight.
+    """
+    for start, end in free:
+        midnight = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        offset = (start - midnight) % step
+        cursor = start if not offset else start + (step - offset)
+        while cursor + duration <= end:
+            yield cursor, cursor + duration
+            cursor += step
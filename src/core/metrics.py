@@ -0,0 +1,293 @@
+import re
+import time
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+from src.core.cache import response_cache_stats
+from src.core.config import settings
+from src.core.http_pool import pool_stats
+from src.core.singleflight import graph_get_flights
+
+# Latency buckets in seconds, from cache-speed answers to slow Graph calls.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[str, ...]
+# Called at scrape time; yields (name, type, help, [(labels, value)]).
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = (), max_series: int = 2000):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.max_series = max_series
+        self._series: Dict[Labels, object] = {}
+
+    def _key(self, labels: Labels) -> Labels:
+        # Past max_series new label sets share one series, so a label that
+        # turns out to be unbounded cannot grow memory without limit.
+        if labels in self._series or len(self._series) < self.max_series:
+            return labels
+        return ("other",) * len(self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self._series.items()):
+            lines.extend(self._render_series(labels, value))
+        return lines
+
+    def _render_series(self, labels: Labels, value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, labels: Labels = (), amount: float = 1) -> None:
+        key = self._key(labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, labels: Labels = ()) -> float:
+        return self._series.get(labels, 0)
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: Labels = (), amount: float = 1) -> None:
+        self.inc(labels, -amount)
+
+    def set(self, labels: Labels, value: float) -> None:
+        self._series[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """
+    Bucket counts are kept per bucket and made cumulative only when
+    rendered, so an observation is one bisect and three additions.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, max_series: int = 2000):
+        super().__init__(name, help, label_names, max_series)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, labels: Labels, value: float) -> None:
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            # [count per bucket..., count above the last bucket, sum]
+            series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, labels: Labels = ()) -> int:
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def _render_series(self, labels: Labels, series) -> List[str]:
+        lines, total = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+            total += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {total}")
+        suffix = _format_labels(self.label_names, labels)
+        lines.append(f"{self.name}_sum{suffix} {_format_value(series[-1])}")
+        lines.append(f"{self.name}_count{suffix} {total}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Metrics rendered in the Prometheus text exposition format. Metrics are
+    updated from the event loop without locks; statistics that other
+    modules already keep (pool, caches, token endpoint) are read through
+    collectors when /metrics is scraped, so they cost nothing in between.
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Collector] = []
+
+    def counter(self, name: str, help: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, label_names))
+
+    def gauge(self, name: str, help: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, label_names))
+
+    def histogram(self, name: str, help: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, label_names, buckets))
+
+    def add_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, kind, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} "
+                                 f"{_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+registry = MetricsRegistry()
+
+graph_request_seconds = registry.histogram(
+    "graph_request_duration_seconds",
+    "Time to the response headers of each Graph HTTP attempt, retries included as separate attempts.",
+    ("method", "endpoint", "status"))
+graph_requests_in_flight = registry.gauge(
+    "graph_requests_in_flight", "Graph HTTP requests currently waiting for a response.")
+graph_throttled = registry.counter(
+    "graph_throttled_total", "Graph responses with a throttling or transient status (429, 503, 504).",
+    ("method", "endpoint", "status"))
+graph_retries = registry.counter(
+    "graph_retries_total", "Graph requests retried, by the reason for the retry.",
+    ("method", "endpoint", "reason"))
+http_request_seconds = registry.histogram(
+    "http_request_duration_seconds", "Latency of this API's own requests by route template.",
+    ("method", "route", "status"))
+http_requests_in_flight = registry.gauge(
+    "http_requests_in_flight", "Requests to this API currently being handled.")
+
+
+_PATH_ADDRESS = re.compile(r":/[^:]*(:|$)")
+_KEY = re.compile(r"\([^)]*\)")
+_NAME = re.compile(r"^[A-Za-z$][A-Za-z._\-]{0,63}$")
+
+
+@lru_cache(maxsize=4096)
+def endpoint_template(endpoint: str) -> str:
+    """
+    The Graph endpoint with ids, keys and item paths replaced by
+    placeholders, so metric labels stay few: "/me/messages/AAMkAD=" becomes
+    "/me/messages/{id}" and "/me/drive/root:/a/b.pdf:/content" becomes
+    "/me/drive/root:{path}:/content". Pre-authenticated absolute URLs, such
+    as upload sessions, are reported as "{external}".
+    """
+    path = endpoint.split("?", 1)[0]
+    if path.startswith(settings.GRAPH_API_ENDPOINT):
+        path = path[len(settings.GRAPH_API_ENDPOINT):]
+    elif "://" in path:
+        return "{external}"
+    path = _KEY.sub("({key})", _PATH_ADDRESS.sub(lambda m: ":{path}" + m.group(1), path))
+    # Names of collections, properties and actions have no digits; ids do.
+    return "/".join(segment if not segment or "{" in segment or _NAME.match(segment) else "{id}"
+                    for segment in path.split("/"))
+
+
+def route_template(scope) -> str:
+    """The path template of the route a request matched, or "{unmatched}"."""
+    route_path = getattr(scope.get("route"), "path", None)
+    if route_path is None:
+        return "{unmatched}"
+    # Depending on the FastAPI version, a route of an included router knows
+    # its full path or only the part after the router's prefix. Prefixes are
+    # literal, so the prefix is whatever precedes that part in the URL.
+    parts = scope["path"].split("/")
+    return "/".join(parts[:max(len(parts) - route_path.count("/"), 1)]) + route_path
+
+
+class RouteMetricsMiddleware:
+    """
+    ASGI middleware timing every request by the route template it matched
+    (e.g. "/api/v1/mail/{message_id}"), method and status. Streamed
+    responses are timed until their last chunk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight.dec()
+            http_request_seconds.observe((scope["method"], route_template(scope), str(status)),
+                                         time.perf_counter() - started)
+
+
+def _graph_client_stats():
+    pool = pool_stats()
+    yield ("graph_pool_open", "gauge", "Whether the shared Graph connection pool is open.",
+           [({}, pool["open"])])
+    yield ("graph_pool_connections", "gauge", "Connections in the shared Graph pool by state.",
+           [({"state": state}, pool[state]) for state in ("idle", "active")])
+    yield ("graph_pool_http2_connections", "gauge", "Pool connections speaking HTTP/2.",
+           [({}, pool["http2"])])
+    yield ("graph_pool_pending_requests", "gauge", "Requests waiting for a pool connection.",
+           [({}, pool["pending_requests"])])
+
+    cache = response_cache_stats()
+    if cache:
+        yield ("graph_cache_entries", "gauge", "Responses held in the Graph GET cache.",
+               [({}, cache["entries"])])
+        yield ("graph_cache_bytes", "gauge", "Size of the responses held in the Graph GET cache.",
+               [({}, cache["bytes"])])
+        yield ("graph_cache_lookups_total", "counter", "Graph GET cache lookups by result.",
+               [({"result": result}, cache[key]) for result, key in
+                (("hit", "hits"), ("stale", "stale_hits"), ("miss", "misses"))])
+        yield ("graph_cache_revalidations_total", "counter", "Cached responses revalidated with an ETag.",
+               [({"result": "sent"}, cache["revalidations"]),
+                ({"result": "not_modified"}, cache["not_modified"])])
+        yield ("graph_cache_evictions_total", "counter", "Responses evicted from the Graph GET cache.",
+               [({}, cache["evictions"])])
+
+    flights = graph_get_flights.stats()
+    yield ("graph_single_flight_in_flight", "gauge", "Distinct Graph GETs currently shared by callers.",
+           [({}, flights["in_flight"])])
+    yield ("graph_single_flight_calls_total", "counter",
+           "Graph GETs that called Graph (leader) or waited on an identical call (shared).",
+           [({"role": "leader"}, flights["leaders"]), ({"role": "shared"}, flights["shared"])])
+
+
+registry.add_collector(_graph_client_stats)
+
+
+def render_metrics() -> str:
+    return registry.render()
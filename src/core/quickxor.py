@@ -0,0 +1,76 @@
+import base64
+import hashlib
+from typing import BinaryIO, Dict
+
+WIDTH_BITS = 160
+SHIFT = 11
+# Byte i lands at bit (11 * i) % 160, so every 160th byte shares a position.
+BLOCK = WIDTH_BITS
+_MASK = (1 << WIDTH_BITS) - 1
+
+
+def _fold(data: bytes) -> int:
+    """XOR of the 160-byte blocks of `data` (zero-padded), as a little-endian int."""
+    value = int.from_bytes(data, "little")
+    blocks = -(-len(data) // BLOCK)
+    while blocks > 1:
+        half = -(-blocks // 2)
+        bits = half * BLOCK * 8
+        value = (value & ((1 << bits) - 1)) ^ (value >> bits)
+        blocks = half
+    return value
+
+
+class QuickXorHash:
+    """
+    OneDrive's quickXorHash with a hashlib-style interface. Instead of
+    shifting every byte into place, bytes 160 apart are XOR-ed together first
+    (on big ints, so the work stays in C) and placed once at digest time.
+    """
+
+    name = "quickXorHash"
+
+    def __init__(self, data: bytes = b""):
+        self._folded = 0
+        self._length = 0
+        if data:
+            self.update(data)
+
+    def update(self, data: bytes) -> None:
+        if not data:
+            return
+        offset = self._length % BLOCK
+        # Leading zeros align the chunk to its position; they do not change the XOR.
+        self._folded ^= _fold(bytes(offset) + bytes(data) if offset else bytes(data))
+        self._length += len(data)
+
+    def digest(self) -> bytes:
+        block = self._folded.to_bytes(BLOCK, "little")
+        state = 0
+        for index, byte in enumerate(block):
+            if byte:
+                shifted = byte << (SHIFT * index % WIDTH_BITS)
+                state ^= (shifted & _MASK) | (shifted >> WIDTH_BITS)
+        out = bytearray(state.to_bytes(WIDTH_BITS // 8, "little"))
+        for index, byte in enumerate(self._length.to_bytes(8, "little")):
+            out[WIDTH_BITS // 8 - 8 + index] ^= byte
+        return bytes(out)
+
+    def b64digest(self) -> str:
+        """The digest as Graph reports it in `file.hashes.quickXorHash`."""
+        return base64.b64encode(self.digest()).decode()
+
+
+def file_hashes(source: BinaryIO, chunk_size: int = BLOCK * 8192) -> Dict[str, str]:
+    """
+    quickXorHash and sha1Hash of a binary stream in one read, in the format of
+    Graph's `file.hashes` (base64 and upper-case hex).
+    """
+    quick_xor, sha1 = QuickXorHash(), hashlib.sha1()
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        quick_xor.update(chunk)
+        sha1.update(chunk)
+    return {"quickXorHash": quick_xor.b64digest(), "sha1Hash": sha1.hexdigest().upper()}
@@ -0,0 +1,64 @@
+import random
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, Iterable, Optional
+from src.core.config import settings
+
+# Statuses Graph uses for throttling and transient service failures.
+RETRY_STATUSES = frozenset({429, 503, 504})
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parses a Retry-After header given either in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def longest_retry_after(errors: Iterable[Any]) -> Optional[str]:
+    """The longest Retry-After hint among throttled $batch items (GraphAPIException)."""
+    hints = [value for error in errors for key, value in (error.headers or {}).items()
+             if key.lower() == "retry-after"]
+    return max(hints, key=lambda value: parse_retry_after(value) or 0.0, default=None)
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    total_budget: float = 60.0
+
+    def backoff(self, attempt: int) -> float:
+        # Full jitter keeps many clients from retrying in lockstep.
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def next_delay(self, attempt: int, deadline: float,
+                   retry_after: Optional[str] = None) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None to give up."""
+        if attempt + 1 >= self.max_attempts:
+            return None
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            delay = self.backoff(attempt)
+        if time.monotonic() + delay > deadline:
+            return None
+        return delay
+
+
+def default_retry_policy() -> RetryPolicy:
+    return RetryPolicy(
+        max_attempts=settings.GRAPH_RETRY_MAX_ATTEMPTS,
+        base_delay=settings.GRAPH_RETRY_BASE_DELAY,
+        max_delay=settings.GRAPH_RETRY_MAX_DELAY,
+        total_budget=settings.GRAPH_RETRY_BUDGET_SECONDS,
+    )
@@ -0,0 +1,260 @@
+import asyncio
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+from src.core.config import settings
+from src.core.exceptions import ConfigurationException
+
+
+class SessionStore(ABC):
+    """Where login sessions live between requests."""
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    async def set(self, session_id: str, data: Dict, ttl: Optional[int] = None) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> None:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """In-process sessions with a TTL and an LRU bound on the entry count."""
+
+    def __init__(self, ttl: int = 3600, max_entries: int = 10_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_nowait(self, session_id: str) -> Optional[Dict]:
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[session_id]
+            return None
+        self._entries.move_to_end(session_id)
+        return data
+
+    def set_nowait(self, session_id: str, data: Dict, ttl: Optional[int] = None) -> None:
+        self._entries[session_id] = (time.monotonic() + (ttl or self.ttl), data)
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, session_id: str) -> Optional[Dict]:
+        return self.get_nowait(session_id)
+
+    async def set(self, session_id: str, data: Dict, ttl: Optional[int] = None) -> None:
+        self.set_nowait(session_id, data, ttl)
+
+    async def delete(self, session_id: str) -> None:
+        self._entries.pop(session_id, None)
+
+    def purge_expired(self) -> int:
+        now = time.monotonic()
+        expired = [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+        return len(expired)
+
+
+class RedisProtocolError(Exception):
+    pass
+
+
+class RedisErrorReply(RedisProtocolError):
+    """An error reply read in full; the connection stays usable."""
+
+
+class _RedisConnection:
+    """One RESP2 connection; commands on it are serialized by a lock."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.lock = asyncio.Lock()
+
+    async def execute(self, *args: Any) -> Any:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        async with self.lock:
+            self.writer.write(b"".join(parts))
+            await self.writer.drain()
+            return await self._read_reply()
+
+    async def _read_reply(self) -> Any:
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RedisErrorReply(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self.reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RedisProtocolError(f"Unexpected reply: {line!r}")
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Sessions in any server speaking the Redis protocol, shared by every
+    worker and replica. Reads are answered from a short-lived local copy
+    when possible, so the request hot path rarely waits on the network;
+    a logout in another process is seen within `local_ttl` seconds.
+    """
+
+    def __init__(self, url: str, ttl: int = 3600, pool_size: int = 4,
+                 local_ttl: float = 5.0, key_prefix: str = "session:",
+                 connect_timeout: Optional[float] = 2.0, timeout: Optional[float] = 2.0):
+        parsed = urlparse(url)
+        if parsed.scheme != "redis":
+            raise ConfigurationException(f"Unsupported session store URL: {url}")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self.local_ttl = local_ttl
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self._local = MemorySessionStore(ttl=1, max_entries=10_000) if local_ttl > 0 else None
+        self._pool_size = pool_size
+        self._pool: Optional[asyncio.Queue] = None
+        self._connections: List[_RedisConnection] = []
+
+    async def _connect(self) -> _RedisConnection:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        connection = _RedisConnection(reader, writer)
+        try:
+            if self.password:
+                await connection.execute("AUTH", self.password)
+            if self.db:
+                await connection.execute("SELECT", self.db)
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    def _drop(self, connection: _RedisConnection) -> None:
+        connection.close()
+        if connection in self._connections:
+            self._connections.remove(connection)
+
+    async def _execute(self, *args: Any) -> Any:
+        if self._pool is None:
+            self._pool = asyncio.Queue()
+            for _ in range(self._pool_size):
+                self._pool.put_nowait(None)
+        slot = await self._pool.get()
+        try:
+            if slot is None:
+                slot = await asyncio.wait_for(self._connect(), self.connect_timeout)
+                self._connections.append(slot)
+            return await asyncio.wait_for(slot.execute(*args), self.timeout)
+        except RedisErrorReply:
+            raise
+        except BaseException:
+            # Interrupted for any reason (timeout, cancellation, broken socket,
+            # unreadable reply), the connection may still owe the reply to
+            # this command, which the next command would read as its own.
+            # Drop it; the slot reconnects on next use.
+            if slot is not None:
+                self._drop(slot)
+            slot = None
+            raise
+        finally:
+            self._pool.put_nowait(slot)
+
+    async def get(self, session_id: str) -> Optional[Dict]:
+        if self._local is not None:
+            cached = self._local.get_nowait(session_id)
+            if cached is not None:
+                return cached
+        raw = await self._execute("GET", self.key_prefix + session_id)
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        if self._local is not None:
+            self._local.set_nowait(session_id, data, self.local_ttl)
+        return data
+
+    async def set(self, session_id: str, data: Dict, ttl: Optional[int] = None) -> None:
+        await self._execute("SET", self.key_prefix + session_id, json.dumps(data),
+                            "EX", int(ttl or self.ttl))
+        if self._local is not None:
+            self._local.set_nowait(session_id, data, self.local_ttl)
+
+    async def delete(self, session_id: str) -> None:
+        if self._local is not None:
+            await self._local.delete(session_id)
+        await self._execute("DEL", self.key_prefix + session_id)
+
+    async def close(self) -> None:
+        for connection in self._connections:
+            connection.close()
+        self._connections.clear()
+        self._pool = None
+
+
+_session_store: Optional[SessionStore] = None
+
+
+def create_session_store() -> SessionStore:
+    if settings.SESSION_BACKEND == "memory":
+        return MemorySessionStore(ttl=settings.SESSION_TTL_SECONDS,
+                                  max_entries=settings.SESSION_MAX_ENTRIES)
+    if settings.SESSION_BACKEND == "redis":
+        return RedisSessionStore(settings.SESSION_REDIS_URL,
+                                 ttl=settings.SESSION_TTL_SECONDS,
+                                 pool_size=settings.SESSION_REDIS_POOL_SIZE,
+                                 local_ttl=settings.SESSION_LOCAL_CACHE_SECONDS,
+                                 connect_timeout=settings.SESSION_REDIS_CONNECT_TIMEOUT_SECONDS,
+                                 timeout=settings.SESSION_REDIS_TIMEOUT_SECONDS)
+    raise ConfigurationException(f"Unknown SESSION_BACKEND: {settings.SESSION_BACKEND}")
+
+
+def get_session_store() -> SessionStore:
+    global _session_store
+    if _session_store is None:
+        _session_store = create_session_store()
+    return _session_store
+
+
+async def close_session_store() -> None:
+    global _session_store
+    if _session_store is not None:
+        await _session_store.close()
+        _session_store = None
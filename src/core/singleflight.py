@@ -0,0 +1,62 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call:
+    __slots__ = ("future", "callers")
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.callers = 1
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Callers that arrive while a call
+    is in flight await the same result, or the same exception.
+
+    With `copy`, a result that more than one caller awaited is handed to
+    each of them as its own copy, so one caller changing it cannot change
+    what the others see.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]],
+                 copy: Optional[Callable[[T], T]] = None) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = _Call(asyncio.ensure_future(fn()))
+            call.future.add_done_callback(lambda done: self._forget(key, call))
+            self.leaders += 1
+        else:
+            call.callers += 1
+            self.shared += 1
+        # Shield so one caller giving up does not cancel the call for the rest.
+        result = await asyncio.shield(call.future)
+        # The flight is forgotten before any caller resumes, so the count
+        # is final here; the leader copies too, as it may not resume first.
+        if copy is not None and call.callers > 1:
+            return copy(result)
+        return result
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "shared": self.shared}
+
+
+# Process-wide group used by GraphClient.get.
+graph_get_flights = SingleFlight()
+# One silent token renewal per session, however many requests need it.
+token_refresh_flights = SingleFlight()
@@ -0,0 +1,21 @@
+import base64
+import hashlib
+import json
+
+
+def token_subject(access_token: str) -> str:
+    """
+    Stable per-user key for an access token. Uses the `oid`/`sub` claim of
+    the JWT (decoded without verification; Graph verifies the token) and
+    falls back to a hash of the token when it is not a readable JWT.
+    """
+    try:
+        payload = access_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        subject = claims.get("oid") or claims.get("sub")
+        if subject:
+            return str(subject)
+    except (IndexError, ValueError, AttributeError):
+        pass
+    return hashlib.sha256(access_token.encode()).hexdigest()[:32]
@@ -1,13 +1,42 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from src.core.config import settings
 from src.core.logging import setup_logging
+from src.core.http_pool import init_http_client, close_http_client
+from src.core.metrics import RouteMetricsMiddleware, render_metrics
+from src.core.session_store import close_session_store
+from src.services.auth_service import close_auth_executor
+from src.services.bulk_mail_service import close_bulk_mail_sender
+from src.api.deps import close_auth_service, close_subscription_manager, get_subscription_manager
 from src.api.v1.api import api_router
+from src.api.responses import FastJSONResponse
 
 setup_logging()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_http_client()
+    if settings.SUBSCRIPTION_NOTIFICATION_URL:
+        # Renews the subscriptions stored by earlier runs as well.
+        get_subscription_manager().start()
+    try:
+        yield
+    finally:
+        try:
+            await close_bulk_mail_sender()
+            await close_subscription_manager()
+            await close_session_store()
+            close_auth_service()
+            close_auth_executor()
+        finally:
+            # Closed last and regardless, so its sockets never outlive the app.
+            await close_http_client()
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     docs_url="/docs",
     redoc_url="/redoc",
@@ -23,12 +52,20 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_headers=["*"],
     )
 
+if settings.METRICS_ENABLED:
+    app.add_middleware(RouteMetricsMiddleware)
+
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
 @app.get("/health")
 def health_check():
     return {"status": "healthy"}
 
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
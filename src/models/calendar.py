@@ -1,6 +1,7 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field, model_validator
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, time
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 class DateTimeTimeZone(BaseModel):
     dateTime: str
@@ -29,3 +30,50 @@ class CreateEventRequest(BaseModel):
     attendees: List[EmailStr] = []
     body: Optional[str] = None
     location: Optional[str] = None
+
+class SlotSearchRequest(BaseModel):
+    attendees: List[EmailStr] = Field(..., min_length=1)
+    start: datetime
+    end: datetime
+    duration_minutes: int = Field(30, gt=0, le=24 * 60)
+    max_results: int = Field(5, gt=0, le=100)
+    # Working hours, weekends and naive datetimes are read in this zone.
+    time_zone: str = "UTC"
+    day_start: time = time(9)
+    day_end: time = time(18)
+    include_weekends: bool = False
+    # Treat tentatively accepted meetings as free time.
+    allow_tentative: bool = False
+    granularity_minutes: int = Field(30, gt=0, le=24 * 60)
+
+    @model_validator(mode="after")
+    def check_range(self):
+        if self.end <= self.start:
+            raise ValueError("end must be after start")
+        if self.day_end <= self.day_start:
+            raise ValueError("day_end must be after day_start")
+        try:
+            ZoneInfo(self.time_zone)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Unknown time zone: {self.time_zone}")
+        return self
+
+class MeetingSlot(BaseModel):
+    start: datetime
+    end: datetime
+
+class BulkCreateEventsRequest(BaseModel):
+    events: List[CreateEventRequest] = Field(..., min_length=1)
+
+class BulkEventItem(BaseModel):
+    index: int
+    status: str  # created or failed
+    event: Optional[Event] = None
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+
+class BulkCreateEventsResult(BaseModel):
+    created: int
+    failed: int
+    failed_indexes: List[int] = []
+    items: List[BulkEventItem] = []
@@ -11,3 +11,4 @@ class FileItem(BaseModel):
     lastModifiedDateTime: Optional[datetime] = None
     file: Optional[dict] = None
     folder: Optional[dict] = None
+    parentReference: Optional[dict] = None
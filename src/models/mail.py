@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import List, Optional
+from typing import ClassVar, FrozenSet, List, Optional
 from datetime import datetime
 
 class EmailAddress(BaseModel):
@@ -14,6 +14,9 @@ class MessageBody(BaseModel):
     content: str
 
 class Message(BaseModel):
+    # Left out of $select when listing in summary mode.
+    graph_heavy_fields: ClassVar[FrozenSet[str]] = frozenset({"body"})
+
     id: str
     subject: Optional[str] = None
     bodyPreview: Optional[str] = None
@@ -24,8 +27,34 @@ class Message(BaseModel):
     receivedDateTime: Optional[datetime] = None
     isRead: Optional[bool] = None
 
+class MailSearchHit(BaseModel):
+    # Higher is a better match; 0 when no search text was given.
+    score: float
+    snippet: Optional[str] = None
+    message: Message
+
 class SendMessageRequest(BaseModel):
     to: List[EmailStr]
     subject: str
     body: str
     content_type: str = "HTML"
+
+class BulkSendRequest(BaseModel):
+    messages: List[SendMessageRequest] = Field(..., min_length=1)
+
+class BulkSendItem(BaseModel):
+    index: int
+    status: str = "pending"  # pending, sent or failed
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+    attempts: int = 0
+
+class BulkSendJob(BaseModel):
+    id: str
+    status: str = "queued"  # queued, running or completed
+    total: int
+    sent: int = 0
+    failed: int = 0
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    items: List[BulkSendItem] = []
@@ -0,0 +1,24 @@
+from functools import lru_cache
+from typing import FrozenSet, List, Type
+from pydantic import BaseModel
+
+
+def graph_fields(model: Type[BaseModel], exclude: FrozenSet[str] = frozenset()) -> List[str]:
+    """Graph property names for a model's fields, honouring aliases (from_ -> from)."""
+    return [field.alias or name
+            for name, field in model.model_fields.items() if name not in exclude]
+
+
+@lru_cache(maxsize=None)
+def select_query(model: Type[BaseModel], summary: bool = False) -> str:
+    """
+    OData query fragment asking Graph only for the properties the model keeps.
+    In summary mode the model's `graph_heavy_fields` (e.g. message body) are
+    left out as well. `graph_expand` adds an $expand clause when set.
+    """
+    exclude = getattr(model, "graph_heavy_fields", frozenset()) if summary else frozenset()
+    query = "$select=" + ",".join(graph_fields(model, exclude))
+    expand = getattr(model, "graph_expand", ())
+    if expand:
+        query += "&$expand=" + ",".join(expand)
+    return query
@@ -0,0 +1,34 @@
+from pydantic import BaseModel, Field
+from typing import Dict, List, Literal, Optional
+from datetime import datetime
+
+class CreateSubscriptionRequest(BaseModel):
+    resource: Literal["mail", "events", "drive"]
+    # Mail only: the folder to watch.
+    folder: str = "inbox"
+    # Defaults to created,updated,deleted; OneDrive only supports "updated".
+    change_type: Optional[str] = None
+
+class Subscription(BaseModel):
+    id: str
+    resource: str
+    changeType: str
+    notificationUrl: Optional[str] = None
+    lifecycleNotificationUrl: Optional[str] = None
+    expirationDateTime: datetime
+    clientState: Optional[str] = None
+
+class ChangeNotification(BaseModel):
+    subscriptionId: str
+    clientState: Optional[str] = None
+    changeType: Optional[str] = None
+    resource: Optional[str] = None
+    resourceData: Optional[Dict] = None
+    subscriptionExpirationDateTime: Optional[datetime] = None
+    tenantId: Optional[str] = None
+    # Set on lifecycle notifications: reauthorizationRequired,
+    # subscriptionRemoved or missed.
+    lifecycleEvent: Optional[str] = None
+
+class NotificationBatch(BaseModel):
+    value: List[ChangeNotification] = Field(default_factory=list)
@@ -0,0 +1,69 @@
+import copy
+import types
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Type, TypeVar, Union, get_args, get_origin
+from pydantic import BaseModel, EmailStr, TypeAdapter, create_model
+from src.core.config import settings
+
+M = TypeVar("M", bound=BaseModel)
+
+
+@lru_cache(maxsize=None)
+def list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    """
+    Cached List[model] adapter: validates a whole page, or dumps one to
+    JSON, in one pydantic-core call.
+    """
+    return TypeAdapter(List[model])
+
+
+def _relax(annotation: Any) -> Any:
+    if annotation is EmailStr:
+        return str
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return trusted_model(annotation)
+    origin = get_origin(annotation)
+    if origin is None:
+        return annotation
+    args = get_args(annotation)
+    relaxed = tuple(_relax(arg) for arg in args)
+    if relaxed == args:
+        return annotation
+    if origin in (Union, types.UnionType):
+        return Union[relaxed]
+    if origin is list:
+        return List[relaxed[0]]
+    return origin[relaxed]
+
+
+@lru_cache(maxsize=None)
+def trusted_model(model: Type[M]) -> Type[M]:
+    """
+    Subclass of `model` for data that came from Graph: EmailStr fields are
+    plain strings and nested models use their trusted variants. Instances
+    are still `model` instances and serialize the same way.
+    """
+    overrides: Dict[str, Any] = {}
+    for name, field in model.model_fields.items():
+        relaxed = _relax(field.annotation)
+        if relaxed is not field.annotation:
+            overrides[name] = (relaxed, copy.copy(field))
+    if not overrides:
+        return model
+    return create_model(f"Trusted{model.__name__}", __base__=model,
+                        __module__=model.__module__, **overrides)
+
+
+def _target(model: Type[M], trusted: Optional[bool]) -> Type[M]:
+    if settings.GRAPH_TRUSTED_MODELS if trusted is None else trusted:
+        return trusted_model(model)
+    return model
+
+
+def validate_page(model: Type[M], items: Iterable[Dict],
+                  trusted: Optional[bool] = None) -> List[M]:
+    return list_adapter(_target(model, trusted)).validate_python(list(items))
+
+
+def validate_item(model: Type[M], data: Dict, trusted: Optional[bool] = None) -> M:
+    return _target(model, trusted).model_validate(data)
@@ -1,20 +1,144 @@
+import asyncio
+import base64
+import json
+import os
+import threading
+import time
 import msal
-from typing import Dict
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
 from src.core.config import settings
 from src.core.exceptions import AuthException
+from src.core.metrics import registry
+from src.core.session_store import SessionStore, get_session_store
 from loguru import logger
 
+# Session store key of an account's serialized MSAL token cache.
+ACCOUNT_CACHE_PREFIX = "account:"
+
+# MSAL talks to the token endpoint with blocking HTTP calls; they run on this
+# bounded pool so a login never stalls the event loop. Closed by the lifespan.
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_auth_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.AUTH_THREAD_POOL_SIZE,
+                                       thread_name_prefix="msal")
+    return _executor
+
+
+def close_auth_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+@dataclass
+class TokenEndpointStats:
+    calls: int = 0
+    errors: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    # Time spent waiting for a free worker thread before the call started.
+    queued_seconds: float = 0.0
+
+    def snapshot(self) -> Dict[str, float]:
+        calls = self.calls or 1
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_ms": round(self.total_seconds / calls * 1000, 3),
+            "max_ms": round(self.max_seconds * 1000, 3),
+            "avg_queued_ms": round(self.queued_seconds / calls * 1000, 3),
+        }
+
+
+_token_stats: Dict[str, TokenEndpointStats] = {}
+_token_stats_lock = threading.Lock()
+
+
+def _observe(operation: str, seconds: float, queued: float, ok: bool) -> None:
+    with _token_stats_lock:
+        stats = _token_stats.setdefault(operation, TokenEndpointStats())
+        stats.calls += 1
+        stats.errors += 0 if ok else 1
+        stats.total_seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+        stats.queued_seconds += queued
+
+
+def token_endpoint_stats() -> Dict[str, Dict[str, float]]:
+    """Latency of MSAL calls per operation ("authorization_code", "silent")."""
+    with _token_stats_lock:
+        return {operation: stats.snapshot() for operation, stats in _token_stats.items()}
+
+def _token_metrics():
+    with _token_stats_lock:
+        stats = {operation: (s.calls, s.errors, s.total_seconds, s.queued_seconds)
+                 for operation, s in _token_stats.items()}
+    for index, (name, help) in enumerate((
+            ("graph_token_requests_total", "MSAL token endpoint calls by operation."),
+            ("graph_token_errors_total", "MSAL token endpoint calls that failed."),
+            ("graph_token_request_seconds_total", "Time spent in MSAL token endpoint calls."),
+            ("graph_token_queued_seconds_total", "Time token calls waited for a worker thread."))):
+        yield name, "counter", help, [({"operation": operation}, values[index])
+                                      for operation, values in stats.items()]
+
+
+registry.add_collector(_token_metrics)
+
 class AuthService:
-    def __init__(self):
+    """
+    MSAL confidential client. Each signed-in account has its own serialized
+    token cache, holding its refresh token, in the session store, so any
+    worker or replica sharing that store can renew the account's access
+    tokens silently instead of sending the user through login again.
+
+    token_cache_path optionally keeps the account caches in a file as well
+    (mode 0600), so a single-process deployment with in-memory sessions
+    keeps them across restarts.
+    """
+
+    def __init__(self, token_cache_path: Optional[str] = None,
+                 account_store: Optional[SessionStore] = None):
         self.authority = f"https://login.microsoftonline.com/{settings.TENANT_ID}"
         self.scopes = settings.SCOPES.split()
-        
-        self._msal_app = msal.ConfidentialClientApplication(
+        self.token_cache_path = token_cache_path
+        self.account_store = account_store
+        self._file_lock = threading.Lock()
+        # Authority discovery responses and one HTTP session, shared by the
+        # per-account apps so only the first one fetches discovery and every
+        # token call reuses the pooled connection to the token endpoint.
+        self._http_cache: Dict = {}
+        self._http_client = requests.Session()
+        # What MSAL mounts on the session it would otherwise build per app.
+        adapter = requests.adapters.HTTPAdapter(max_retries=1)
+        self._http_client.mount("http://", adapter)
+        self._http_client.mount("https://", adapter)
+        self._msal_app = self._app(msal.SerializableTokenCache())
+
+    def _app(self, token_cache: msal.SerializableTokenCache) -> msal.ConfidentialClientApplication:
+        return msal.ConfidentialClientApplication(
             client_id=settings.CLIENT_ID,
             client_credential=settings.CLIENT_SECRET,
-            authority=self.authority
+            authority=self.authority,
+            token_cache=token_cache,
+            http_client=self._http_client,
+            http_cache=self._http_cache,
         )
 
+    def close(self) -> None:
+        self._http_client.close()
+
+    @property
+    def _accounts(self) -> SessionStore:
+        return self.account_store if self.account_store is not None else get_session_store()
+
     def get_auth_url(self, state: str) -> str:
         return self._msal_app.get_authorization_request_url(
             scopes=self.scopes,
@@ -22,9 +146,12 @@ class AuthService:
             redirect_uri=settings.REDIRECT_URI
         )
 
-    def acquire_token_by_code(self, code: str) -> Dict:
+    def acquire_token_by_code(self, code: str,
+                              token_cache: Optional[msal.SerializableTokenCache] = None) -> Dict:
+        """Redeems an authorization code; the account's tokens land in `token_cache`."""
+        app = self._app(token_cache if token_cache is not None else msal.SerializableTokenCache())
         try:
-            result = self._msal_app.acquire_token_by_authorization_code(
+            result = app.acquire_token_by_authorization_code(
                 code=code,
                 scopes=self.scopes,
                 redirect_uri=settings.REDIRECT_URI
@@ -38,3 +165,147 @@ class AuthService:
                 raise
             logger.exception("Unexpected error during token acquisition")
             raise AuthException(f"Authentication failed: {str(e)}")
+
+    def acquire_token_silent(self, home_account_id: str,
+                             token_cache: msal.SerializableTokenCache) -> Optional[Dict]:
+        """
+        Returns a fresh token for the account from its token cache, redeeming
+        its refresh token when needed, or None when the user has to sign in
+        again.
+        """
+        app = self._app(token_cache)
+        account = next((account for account in app.get_accounts()
+                        if account.get("home_account_id") == home_account_id), None)
+        if account is None:
+            return None
+        try:
+            result = app.acquire_token_silent(self.scopes, account=account)
+        except Exception:
+            logger.exception("Unexpected error during silent token renewal")
+            return None
+        if not result or "error" in result:
+            logger.warning(f"Silent token renewal failed: {(result or {}).get('error_description')}")
+            return None
+        return result
+
+    async def acquire_token_by_code_async(self, code: str) -> Dict:
+        token_cache = msal.SerializableTokenCache()
+        result = await self._run("authorization_code", self.acquire_token_by_code, code, token_cache)
+        account_id = home_account_id(result)
+        if account_id:
+            await self._save_account_cache(account_id, token_cache.serialize())
+        return result
+
+    async def acquire_token_silent_async(self, home_account_id: str) -> Optional[Dict]:
+        serialized = await self._load_account_cache(home_account_id)
+        if serialized is None:
+            return None
+        token_cache = msal.SerializableTokenCache()
+        token_cache.deserialize(serialized)
+        result = await self._run("silent", self.acquire_token_silent, home_account_id, token_cache)
+        if token_cache.has_state_changed:
+            await self._save_account_cache(home_account_id, token_cache.serialize())
+        return result
+
+    async def remove_account_async(self, home_account_id: str) -> None:
+        """Forgets the account's tokens, so it cannot be renewed any more."""
+        await self._accounts.delete(ACCOUNT_CACHE_PREFIX + home_account_id)
+        if self.token_cache_path:
+            await asyncio.get_running_loop().run_in_executor(
+                get_auth_executor(), self._write_cache_file, home_account_id, None)
+
+    async def _load_account_cache(self, home_account_id: str) -> Optional[str]:
+        entry = await self._accounts.get(ACCOUNT_CACHE_PREFIX + home_account_id)
+        if entry is not None:
+            return entry["cache"]
+        if not self.token_cache_path:
+            return None
+        serialized = await asyncio.get_running_loop().run_in_executor(
+            get_auth_executor(), self._read_cache_file, home_account_id)
+        if serialized is not None:
+            await self._accounts.set(ACCOUNT_CACHE_PREFIX + home_account_id, {"cache": serialized},
+                                     ttl=settings.AUTH_ACCOUNT_CACHE_TTL_SECONDS)
+        return serialized
+
+    async def _save_account_cache(self, home_account_id: str, serialized: str) -> None:
+        await self._accounts.set(ACCOUNT_CACHE_PREFIX + home_account_id, {"cache": serialized},
+                                 ttl=settings.AUTH_ACCOUNT_CACHE_TTL_SECONDS)
+        if self.token_cache_path:
+            await asyncio.get_running_loop().run_in_executor(
+                get_auth_executor(), self._write_cache_file, home_account_id, serialized)
+
+    async def _run(self, operation: str, fn: Callable[..., Any], *args: Any) -> Any:
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            result = None
+            try:
+                result = fn(*args)
+                return result
+            finally:
+                _observe(operation, time.perf_counter() - started,
+                         started - submitted, result is not None)
+
+        return await asyncio.get_running_loop().run_in_executor(get_auth_executor(), timed)
+
+    def _read_cache_file(self, home_account_id: str) -> Optional[str]:
+        with self._file_lock:
+            return self._read_cache_map().get(home_account_id)
+
+    def _write_cache_file(self, home_account_id: str, serialized: Optional[str]) -> None:
+        with self._file_lock:
+            caches = self._read_cache_map()
+            if serialized is None:
+                if caches.pop(home_account_id, None) is None:
+                    return
+            else:
+                caches[home_account_id] = serialized
+            # Refresh tokens: readable by this user only, and never half written.
+            tmp_path = f"{self.token_cache_path}.tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(caches, f)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.token_cache_path)
+
+    def _read_cache_map(self) -> Dict[str, str]:
+        """The file's {home_account_id: serialized cache} map."""
+        try:
+            with open(self.token_cache_path, "r") as f:
+                caches = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.warning(f"Ignoring unreadable token cache file {self.token_cache_path}")
+            return {}
+        return caches if isinstance(caches, dict) else {}
+
+
+def home_account_id(result: Dict) -> Optional[str]:
+    """MSAL's account key for a token result: "<uid>.<utid>" from client_info."""
+    client_info = result.get("client_info")
+    if client_info:
+        try:
+            client_info += "=" * (-len(client_info) % 4)
+            info = json.loads(base64.urlsafe_b64decode(client_info))
+            return f"{info['uid']}.{info['utid']}"
+        except (ValueError, KeyError, TypeError):
+            pass
+    claims = result.get("id_token_claims") or {}
+    if claims.get("oid") and claims.get("tid"):
+        return f"{claims['oid']}.{claims['tid']}"
+    return None
+
+
+def session_from_token(result: Dict, account_id: Optional[str] = None) -> Dict:
+    """Session data for a token result; `expires_at` is a Unix timestamp."""
+    session = {
+        "access_token": result["access_token"],
+        "expires_at": time.time() + int(result.get("expires_in", 0)),
+        "home_account_id": account_id or home_account_id(result),
+    }
+    # Tokens served from the cache carry no ID token; keep the old claims then.
+    if "id_token_claims" in result:
+        session["account"] = result["id_token_claims"]
+    return session
@@ -0,0 +1,243 @@
+import asyncio
+import secrets
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from src.core.batch import MAX_BATCH_SIZE, BatchRequest
+from src.core.config import settings
+from src.core.exceptions import GraphAPIException
+from src.core.graph_client import GraphClient
+from src.core.rate_limit import RateLimiter
+from src.core.retry import RetryPolicy, default_retry_policy, parse_retry_after
+from src.core.session_store import SessionStore, get_session_store
+from src.models.mail import BulkSendItem, BulkSendJob, SendMessageRequest
+from src.services.mail_service import MailService
+from loguru import logger
+
+# Returns a client with a currently valid token; jobs can outlive one token.
+ClientFactory = Callable[[], Awaitable[GraphClient]]
+
+# Sub-request statuses meaning the message was not sent and can be retried.
+THROTTLED_STATUSES = frozenset({429, 503})
+# An earlier item of the same dependsOn chain failed, so this one never ran.
+FAILED_DEPENDENCY = 424
+# Exchange Online serves at most 4 concurrent requests per mailbox.
+MAILBOX_CONCURRENCY = 4
+# Session store key of a job's status, so any worker can answer for it.
+JOB_KEY_PREFIX = "bulk-job:"
+
+
+@dataclass
+class _Chunk:
+    job: BulkSendJob
+    owner: str
+    client_factory: ClientFactory
+    payloads: List[Tuple[int, Dict]]
+
+
+def _retry_after(error: GraphAPIException) -> Optional[float]:
+    headers = {key.lower(): value for key, value in (error.headers or {}).items()}
+    return parse_retry_after(headers.get("retry-after"))
+
+
+class BulkMailSender:
+    """
+    Sends queued messages as $batch groups of sendMail calls. A fixed number
+    of workers bounds concurrency, a token bucket per mailbox keeps each
+    sender under its send limit, and throttled items are retried after the
+    mailbox's bucket has been paused for Graph's Retry-After.
+
+    Graph runs the items of a $batch in parallel, so a mailbox has one group
+    in flight at a time and its items are chained with dependsOn into
+    MAILBOX_CONCURRENCY sequences, staying within Exchange's concurrent
+    request limit per mailbox.
+
+    Messages are sent by the worker that accepted the job; its status is
+    written to the session store after every group, so with a shared store
+    any worker answers status requests.
+    """
+
+    def __init__(self, limiter: RateLimiter, concurrency: int = 4,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 job_store: Optional[SessionStore] = None, job_ttl: int = 24 * 3600):
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.retry_policy = retry_policy or default_retry_policy()
+        self.job_store = job_store
+        self.job_ttl = job_ttl
+        self.group_size = max(1, min(MAX_BATCH_SIZE, int(limiter.capacity)))
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        # Bounded like the limiter's buckets; only idle locks are evicted.
+        self._mailboxes: "OrderedDict[str, asyncio.Lock]" = OrderedDict()
+        self._saving = asyncio.Lock()
+
+    @property
+    def _jobs(self) -> SessionStore:
+        return self.job_store if self.job_store is not None else get_session_store()
+
+    async def submit(self, owner: str, client_factory: ClientFactory,
+                     messages: List[SendMessageRequest]) -> BulkSendJob:
+        job = BulkSendJob(
+            id=secrets.token_urlsafe(12),
+            total=len(messages),
+            created_at=datetime.now(timezone.utc),
+            items=[BulkSendItem(index=index) for index in range(len(messages))],
+        )
+        await self._save(owner, job)
+
+        self._start()
+        payloads = [(index, MailService.send_payload(message))
+                    for index, message in enumerate(messages)]
+        for start in range(0, len(payloads), self.group_size):
+            self._queue.put_nowait(_Chunk(job, owner, client_factory,
+                                          payloads[start:start + self.group_size]))
+        return job
+
+    async def get_job(self, job_id: str, owner: str) -> Optional[BulkSendJob]:
+        entry = await self._jobs.get(JOB_KEY_PREFIX + job_id)
+        if entry is None or entry.get("owner") != owner:
+            return None
+        return BulkSendJob.model_validate(entry["job"])
+
+    async def join(self) -> None:
+        """Waits until every queued message has been sent or has failed."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    def _start(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._work())
+                             for _ in range(self.concurrency)]
+
+    async def _work(self) -> None:
+        while True:
+            chunk = await self._queue.get()
+            try:
+                await self._send_chunk(chunk)
+            except Exception as e:
+                logger.error(f"Bulk send job {chunk.job.id} chunk failed: {e}")
+                status_code = e.status_code if isinstance(e, GraphAPIException) else None
+                for index, _ in chunk.payloads:
+                    self._settle(chunk.job, index, error=str(e), status_code=status_code)
+            try:
+                await self._save(chunk.owner, chunk.job)
+            except Exception as e:
+                logger.error(f"Saving bulk send job {chunk.job.id} failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _save(self, owner: str, job: BulkSendJob) -> None:
+        # One save at a time, each taking its snapshot under the lock, so an
+        # older snapshot never overwrites a newer one.
+        async with self._saving:
+            await self._jobs.set(JOB_KEY_PREFIX + job.id,
+                                 {"owner": owner, "job": job.model_dump(mode="json")},
+                                 ttl=self.job_ttl)
+
+    def _mailbox(self, owner: str) -> asyncio.Lock:
+        lock = self._mailboxes.get(owner)
+        if lock is None:
+            lock = self._mailboxes[owner] = asyncio.Lock()
+            if len(self._mailboxes) > self.limiter.max_keys:
+                idle = [key for key, held in self._mailboxes.items() if not held.locked()]
+                for key in idle[:len(self._mailboxes) - self.limiter.max_keys]:
+                    del self._mailboxes[key]
+        else:
+            self._mailboxes.move_to_end(owner)
+        return lock
+
+    async def _send_chunk(self, chunk: _Chunk) -> None:
+        job = chunk.job
+        job.status = "running"
+        await self.limiter.acquire(chunk.owner, len(chunk.payloads))
+        client = await chunk.client_factory()
+        for index, _ in chunk.payloads:
+            job.items[index].attempts += 1
+
+        requests = [BatchRequest("POST", "/me/sendMail", body=payload,
+                                 depends_on=[position - MAILBOX_CONCURRENCY]
+                                 if position >= MAILBOX_CONCURRENCY else [])
+                    for position, (_, payload) in enumerate(chunk.payloads)]
+        try:
+            async with self._mailbox(chunk.owner):
+                results = await client.send_batch(requests)
+        except GraphAPIException as e:
+            if e.status_code != 429:
+                raise
+            # The whole envelope was throttled, so none of its items ran.
+            results = [e] * len(requests)
+
+        retry: List[Tuple[int, Dict]] = []
+        delays: List[float] = []
+        for (index, payload), result in zip(chunk.payloads, results):
+            if not isinstance(result, GraphAPIException):
+                self._settle(job, index)
+            elif result.status_code == FAILED_DEPENDENCY:
+                # Never sent; resending it does not count as another attempt.
+                job.items[index].attempts -= 1
+                retry.append((index, payload))
+            elif (result.status_code in THROTTLED_STATUSES
+                  and job.items[index].attempts < self.retry_policy.max_attempts):
+                retry.append((index, payload))
+                delay = _retry_after(result)
+                if delay is not None:
+                    delays.append(delay)
+            else:
+                self._settle(job, index, error=result.message, status_code=result.status_code)
+
+        if retry:
+            attempt = max(job.items[index].attempts for index, _ in retry)
+            delay = max(delays) if delays else self.retry_policy.backoff(attempt)
+            logger.warning(f"Bulk send job {job.id}: {len(retry)} throttled, retrying in {delay:.2f}s")
+            # Pausing the bucket holds back every send from this mailbox, not just the retry.
+            self.limiter.bucket(chunk.owner).pause(delay)
+            self._queue.put_nowait(_Chunk(job, chunk.owner, chunk.client_factory, retry))
+
+    @staticmethod
+    def _settle(job: BulkSendJob, index: int, error: Optional[str] = None,
+                status_code: Optional[int] = None) -> None:
+        item = job.items[index]
+        if error is None:
+            item.status = "sent"
+            job.sent += 1
+        else:
+            item.status = "failed"
+            item.error = error
+            item.status_code = status_code
+            job.failed += 1
+        if job.sent + job.failed == job.total:
+            job.status = "completed"
+            job.finished_at = datetime.now(timezone.utc)
+
+
+_bulk_mail_sender: Optional[BulkMailSender] = None
+
+
+def get_bulk_mail_sender() -> BulkMailSender:
+    global _bulk_mail_sender
+    if _bulk_mail_sender is None:
+        _bulk_mail_sender = BulkMailSender(
+            limiter=RateLimiter(rate=settings.MAIL_SEND_RATE_PER_MINUTE / 60,
+                                capacity=settings.MAIL_SEND_BURST),
+            concurrency=settings.MAIL_BULK_CONCURRENCY,
+            job_ttl=settings.MAIL_BULK_JOB_TTL_SECONDS,
+        )
+    return _bulk_mail_sender
+
+
+async def close_bulk_mail_sender() -> None:
+    global _bulk_mail_sender
+    if _bulk_mail_sender is not None:
+        await _bulk_mail_sender.close()
+        _bulk_mail_sender = None
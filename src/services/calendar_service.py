@@ -1,17 +1,193 @@
-from typing import List
+import asyncio
+import bisect
+import time as clock
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta, timezone
+from itertools import islice
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+from src.core import intervals
+from src.core.batch import MAX_BATCH_SIZE, BatchRequest
+from src.core.cache import LRUCache
+from src.core.config import settings
+from src.core.exceptions import GraphAPIException
 from src.core.graph_client import GraphClient
-from src.models.calendar import Event, CreateEventRequest
+from src.core.retry import longest_retry_after
+from src.models.calendar import (
+    BulkCreateEventsResult, BulkEventItem, CreateEventRequest, Event, MeetingSlot, SlotSearchRequest,
+)
+from src.models.projection import select_query
+from src.models.validation import validate_item, validate_page
+from loguru import logger
+
+# Limits of one getSchedule call.
+SCHEDULE_BATCH_SIZE = 20
+SCHEDULE_MAX_DAYS = 62
+
+# Item statuses in a parsed $batch reply meaning the item was not applied.
+THROTTLED_STATUSES = frozenset({429, 503})
+
+# (start, end, status) in UTC, as reported by getSchedule.
+BusyBlock = Tuple[datetime, datetime, str]
+
+_schedule_cache: Optional[LRUCache] = None
+
+
+def get_schedule_cache() -> LRUCache:
+    global _schedule_cache
+    if _schedule_cache is None:
+        _schedule_cache = LRUCache(
+            max_entries=settings.CALENDAR_SCHEDULE_CACHE_MAX_ENTRIES,
+            ttl=settings.CALENDAR_SCHEDULE_CACHE_TTL_SECONDS,
+        )
+    return _schedule_cache
+
+
+def parse_graph_datetime(value: str) -> datetime:
+    """Parses Graph's "2024-03-01T10:00:00.0000000" (UTC) into an aware datetime."""
+    return datetime.fromisoformat(value[:26]).replace(tzinfo=timezone.utc)
+
+
+def _graph_datetime(value: datetime) -> Dict[str, str]:
+    return {"dateTime": value.strftime("%Y-%m-%dT%H:%M:%S"), "timeZone": "UTC"}
+
+
+def _days(start: datetime, end: datetime) -> List[date]:
+    """UTC days touched by [start, end)."""
+    first, last = start.date(), (end - timedelta(microseconds=1)).date()
+    return [first + timedelta(days=i) for i in range((last - first).days + 1)]
+
+
+def _working_windows(start: datetime, end: datetime, tz: ZoneInfo, day_start: time,
+                     day_end: time, include_weekends: bool) -> List[Tuple[datetime, datetime]]:
+    windows = []
+    day = start.astimezone(tz).date()
+    last = end.astimezone(tz).date()
+    while day <= last:
+        if include_weekends or day.weekday() < 5:
+            window_start = datetime.combine(day, day_start, tz).astimezone(timezone.utc)
+            window_end = datetime.combine(day, day_end, tz).astimezone(timezone.utc)
+            window_start, window_end = max(window_start, start), min(window_end, end)
+            if window_start < window_end:
+                windows.append((window_start, window_end))
+        day += timedelta(days=1)
+    return windows
+
+
+class EventRangeIndex:
+    """
+    One user's calendarView results: the time windows already fetched, each
+    with its own expiry, and the events in them sorted by start. Lookups
+    bisect on start, so a range query costs O(log n + k).
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._windows: List[Tuple[datetime, datetime, float]] = []
+        self._events: Dict[str, Tuple[datetime, datetime, Dict]] = {}
+        self._starts: List[Tuple[datetime, str]] = []
+        self._longest = timedelta(0)
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def missing(self, start: datetime, end: datetime) -> List[Tuple[datetime, datetime]]:
+        """Parts of [start, end) not covered by a fresh fetched window."""
+        now = clock.monotonic()
+        self._windows = [window for window in self._windows if window[2] > now]
+        covered = intervals.merge((w_start, w_end) for w_start, w_end, _ in self._windows)
+        return intervals.subtract([(start, end)], covered)
+
+    def add(self, start: datetime, end: datetime, events: List[Dict]) -> None:
+        """
+        Stores a fetched window. calendarView returns every event overlapping
+        it, so events already indexed there are replaced, dropping deleted ones.
+        """
+        for event_id in [event_id for event_id, (e_start, e_end, _) in self._events.items()
+                         if e_start < end and e_end > start]:
+            del self._events[event_id]
+        for event in events:
+            e_start = parse_graph_datetime(event["start"]["dateTime"])
+            e_end = parse_graph_datetime(event["end"]["dateTime"])
+            self._events[event["id"]] = (e_start, e_end, event)
+        self._windows.append((start, end, clock.monotonic() + self.ttl))
+        self._starts = sorted((e_start, event_id) for event_id, (e_start, _, _) in self._events.items())
+        self._longest = max((e_end - e_start for e_start, e_end, _ in self._events.values()),
+                            default=timedelta(0))
+
+    def query(self, start: datetime, end: datetime) -> List[Dict]:
+        """Events overlapping [start, end), ordered by start."""
+        first = bisect.bisect_left(self._starts, (start - self._longest,))
+        last = bisect.bisect_left(self._starts, (end,))
+        found = []
+        for _, event_id in self._starts[first:last]:
+            _, e_end, event = self._events[event_id]
+            if e_end > start:
+                found.append(event)
+        return found
+
+
+_range_indexes: Optional[LRUCache] = None
+
+
+def get_range_indexes() -> LRUCache:
+    global _range_indexes
+    if _range_indexes is None:
+        # Entries never expire as a whole; each fetched window has its own TTL.
+        _range_indexes = LRUCache(max_entries=settings.CALENDAR_RANGE_CACHE_MAX_USERS,
+                                  ttl=float("inf"))
+    return _range_indexes
+
 
 class CalendarService:
-    def __init__(self, client: GraphClient):
+    def __init__(self, client: GraphClient, schedule_cache: Optional[LRUCache] = None,
+                 range_indexes: Optional[LRUCache] = None):
         self.client = client
+        self.schedule_cache = schedule_cache if schedule_cache is not None else get_schedule_cache()
+        self.range_indexes = range_indexes if range_indexes is not None else get_range_indexes()
 
     async def get_events(self, top: int = 10) -> List[Event]:
-        data = await self.client.get(f"/me/events?$top={top}&$orderby=start/dateTime")
-        return [Event(**event) for event in data.get("value", [])]
+        data = await self.client.get(f"/me/events?$top={top}&$orderby=start/dateTime&{select_query(Event)}")
+        return validate_page(Event, data.get("value", []))
 
-    async def create_event(self, request: CreateEventRequest) -> Event:
-        event_payload = {
+    async def iter_events(self, page_size: int = 50) -> AsyncIterator[Event]:
+        endpoint = f"/me/events?$top={page_size}&$orderby=start/dateTime&{select_query(Event)}"
+        async for event in self.client.paginate(endpoint):
+            yield validate_item(Event, event)
+
+    async def get_events_in_range(self, start: datetime, end: datetime) -> List[Event]:
+        """
+        Events overlapping [start, end), with recurring series expanded into
+        occurrences. Windows fetched earlier are answered from the user's
+        range index; Graph is only asked for the gaps.
+        """
+        start, end = self._to_utc(start, timezone.utc), self._to_utc(end, timezone.utc)
+        index = self._range_index()
+        gaps = index.missing(start, end)
+        if gaps:
+            pages = await asyncio.gather(*(self._fetch_view(gap_start, gap_end)
+                                           for gap_start, gap_end in gaps))
+            for (gap_start, gap_end), events in zip(gaps, pages):
+                index.add(gap_start, gap_end, events)
+        return validate_page(Event, index.query(start, end))
+
+    async def _fetch_view(self, start: datetime, end: datetime) -> List[Dict]:
+        endpoint = (f"/me/calendarView?startDateTime={start.strftime('%Y-%m-%dT%H:%M:%SZ')}"
+                    f"&endDateTime={end.strftime('%Y-%m-%dT%H:%M:%SZ')}"
+                    f"&$top={settings.CALENDAR_VIEW_PAGE_SIZE}&{select_query(Event)}")
+        return [event async for event in self.client.paginate(endpoint)]
+
+    def _range_index(self) -> EventRangeIndex:
+        entry = self.range_indexes.get(self.client.subject)
+        if entry is None:
+            index = EventRangeIndex(ttl=settings.CALENDAR_RANGE_CACHE_TTL_SECONDS)
+            self.range_indexes.set(self.client.subject, index)
+            return index
+        return entry.value
+
+    @staticmethod
+    def event_payload(request: CreateEventRequest) -> Dict:
+        payload = {
             "subject": request.subject,
             "body": {
                 "contentType": "HTML",
@@ -29,14 +205,203 @@ class CalendarService:
                 "displayName": request.location
             }
         }
-        
+
         if request.attendees:
-            event_payload["attendees"] = [
+            payload["attendees"] = [
                 {
                     "emailAddress": {"address": email},
                     "type": "required"
                 } for email in request.attendees
             ]
+        return payload
+
+    async def create_event(self, request: CreateEventRequest) -> Event:
+        data = await self.client.post("/me/events", data=self.event_payload(request))
+        self._events_changed(request.attendees)
+        return validate_item(Event, data)
+
+    async def create_events(self, requests: List[CreateEventRequest]) -> BulkCreateEventsResult:
+        """
+        Creates many events through concurrent $batch groups of 20. Items
+        a $batch reply marks as throttled were not created, so only those
+        are sent again; every other failure is reported with its index.
+        """
+        policy = self.client.retry_policy
+        deadline = clock.monotonic() + policy.total_budget
+        batch_requests = [BatchRequest("POST", "/me/events", body=self.event_payload(request))
+                          for request in requests]
+        results: List[Any] = [None] * len(requests)
+        pending = list(range(len(requests)))
+        attempt = 0
+        while pending:
+            groups = [pending[i:i + MAX_BATCH_SIZE] for i in range(0, len(pending), MAX_BATCH_SIZE)]
+            replies = await asyncio.gather(
+                *(self.client.send_batch([batch_requests[index] for index in group])
+                  for group in groups),
+                return_exceptions=True,
+            )
+            throttled = []
+            for group, reply in zip(groups, replies):
+                if isinstance(reply, Exception):
+                    # The $batch call itself failed. Its items may have been
+                    # created before the reply was lost (a network error
+                    # surfaces as 503/504), so they are not sent again unless
+                    # Graph throttled the whole call.
+                    for index in group:
+                        results[index] = reply
+                    if isinstance(reply, GraphAPIException) and reply.status_code == 429:
+                        throttled.extend(group)
+                    continue
+                for index, item in zip(group, reply):
+                    results[index] = item
+                    if isinstance(item, GraphAPIException) and item.status_code in THROTTLED_STATUSES:
+                        throttled.append(index)
+            if not throttled:
+                break
+            delay = policy.next_delay(attempt, deadline, longest_retry_after(results[i] for i in throttled))
+            if delay is None:
+                break
+            logger.warning(f"{len(throttled)} event creations throttled, retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            pending = throttled
+            attempt += 1
+
+        self._events_changed(email for request in requests for email in request.attendees)
+        items = []
+        for index, reply in enumerate(results):
+            if isinstance(reply, Exception):
+                items.append(BulkEventItem(
+                    index=index, status="failed",
+                    status_code=getattr(reply, "status_code", None),
+                    error=getattr(reply, "message", str(reply))))
+            else:
+                items.append(BulkEventItem(index=index, status="created",
+                                           event=validate_item(Event, reply)))
+        failed = [item.index for item in items if item.status == "failed"]
+        return BulkCreateEventsResult(created=len(items) - len(failed), failed=len(failed),
+                                      failed_indexes=failed, items=items)
+
+    async def find_meeting_slots(self, request: SlotSearchRequest) -> List[MeetingSlot]:
+        """
+        Earliest slots in working hours when every attendee is free. Busy
+        blocks of all attendees are merged with one sorted sweep, so the
+        search is O(n log n) in the number of blocks.
+        """
+        tz = ZoneInfo(request.time_zone)
+        start = self._to_utc(request.start, tz)
+        end = self._to_utc(request.end, tz)
+        schedules = await self.get_busy_blocks(request.attendees, start, end)
+
+        busy_statuses = {"busy", "oof"} if request.allow_tentative else {"busy", "oof", "tentative"}
+        busy = intervals.merge(
+            (block_start, block_end)
+            for blocks in schedules.values()
+            for block_start, block_end, status in blocks
+            if status in busy_statuses
+        )
+        windows = _working_windows(start, end, tz, request.day_start, request.day_end,
+                                   request.include_weekends)
+        free = [(free_start.astimezone(tz), free_end.astimezone(tz))
+                for free_start, free_end in intervals.subtract(windows, busy)]
+        found = intervals.slots(free, timedelta(minutes=request.duration_minutes),
+                                timedelta(minutes=request.granularity_minutes))
+        return [MeetingSlot(start=slot_start, end=slot_end)
+                for slot_start, slot_end in islice(found, request.max_results)]
+
+    async def get_busy_blocks(self, attendees: Iterable[str], start: datetime,
+                              end: datetime) -> Dict[str, List[BusyBlock]]:
+        """
+        Busy blocks per attendee overlapping [start, end). Blocks are cached
+        per attendee and UTC day, so only attendees with a cold day are fetched.
+        """
+        owner = self.client.subject
+        days = _days(start, end)
+        result: Dict[str, List[BusyBlock]] = {}
+        missing: List[str] = []
+        for attendee in dict.fromkeys(address.lower() for address in attendees):
+            blocks: List[BusyBlock] = []
+            for day in days:
+                entry = self.schedule_cache.get((owner, attendee, day))
+                if entry is None or not entry.fresh:
+                    missing.append(attendee)
+                    break
+                blocks.extend(entry.value)
+            else:
+                result[attendee] = blocks
+
+        if missing:
+            range_start = datetime.combine(days[0], time(), timezone.utc)
+            range_end = datetime.combine(days[-1] + timedelta(days=1), time(), timezone.utc)
+            fetched = await self._get_schedules(missing, range_start, range_end)
+            for attendee in missing:
+                if attendee not in fetched:
+                    continue  # Graph could not report this schedule; do not cache
+                by_day: Dict[date, List[BusyBlock]] = {day: [] for day in days}
+                for block in fetched[attendee]:
+                    for day in _days(block[0], block[1]):
+                        if day in by_day:
+                            by_day[day].append(block)
+                for day, day_blocks in by_day.items():
+                    self.schedule_cache.set((owner, attendee, day), day_blocks, size=len(day_blocks))
+                result[attendee] = fetched[attendee]
+        return result
+
+    async def _get_schedules(self, attendees: List[str], start: datetime,
+                             end: datetime) -> Dict[str, List[BusyBlock]]:
+        calls = []
+        window = timedelta(days=SCHEDULE_MAX_DAYS)
+        for i in range(0, len(attendees), SCHEDULE_BATCH_SIZE):
+            chunk_start = start
+            while chunk_start < end:
+                chunk_end = min(chunk_start + window, end)
+                calls.append(self._get_schedule(
+                    attendees[i:i + SCHEDULE_BATCH_SIZE], chunk_start, chunk_end))
+                chunk_start = chunk_end
+
+        schedules: Dict[str, List[BusyBlock]] = defaultdict(list)
+        for reply in await asyncio.gather(*calls):
+            for attendee, blocks in reply.items():
+                schedules[attendee].extend(blocks)
+        return schedules
+
+    async def _get_schedule(self, attendees: List[str], start: datetime,
+                            end: datetime) -> Dict[str, List[BusyBlock]]:
+        # getSchedule only reads, so it is safe to retry when throttled.
+        data = await self.client.request(
+            "POST", "/me/calendar/getSchedule",
+            headers={"Prefer": 'outlook.timezone="UTC"'},
+            retry=True,
+            json={
+                "schedules": attendees,
+                "startTime": _graph_datetime(start),
+                "endTime": _graph_datetime(end),
+                "availabilityViewInterval": 30,
+            },
+        )
+        schedules: Dict[str, List[BusyBlock]] = {}
+        for schedule in (data or {}).get("value", []):
+            attendee = schedule.get("scheduleId", "").lower()
+            if "error" in schedule:
+                logger.warning(f"No free/busy for {attendee}: {schedule['error'].get('message')}")
+                continue
+            schedules[attendee] = [
+                (parse_graph_datetime(item["start"]["dateTime"]),
+                 parse_graph_datetime(item["end"]["dateTime"]),
+                 item.get("status", "busy"))
+                for item in schedule.get("scheduleItems", [])
+            ]
+        return schedules
+
+    def _events_changed(self, attendees: Iterable[str]) -> None:
+        """Drops cached free/busy of the attendees and the user's range index."""
+        owner = self.client.subject
+        addresses = {address.lower() for address in attendees}
+        if addresses:
+            self.schedule_cache.invalidate(lambda key: key[0] == owner and key[1] in addresses)
+        self.range_indexes.delete(owner)
 
-        data = await self.client.post("/me/events", data=event_payload)
-        return Event(**data)
+    @staticmethod
+    def _to_utc(value: datetime, tz: ZoneInfo) -> datetime:
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=tz)
+        return value.astimezone(timezone.utc)
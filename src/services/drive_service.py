@@ -1,21 +1,300 @@
-from typing import List
-from src.core.graph_client import GraphClient
+import asyncio
+import hashlib
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from src.core.batch import MAX_BATCH_SIZE, BatchRequest
+from src.core.config import settings
+from src.core.exceptions import GraphAPIException
+from src.core.graph_client import GraphClient, GraphStream
+from src.core.quickxor import QuickXorHash
+from src.core.retry import RETRY_STATUSES, longest_retry_after
 from src.models.drive import FileItem
+from src.models.projection import select_query
+from src.models.validation import validate_item, validate_page
+from loguru import logger
+
+UPLOAD_FRAGMENT_MULTIPLE = 320 * 1024
+
+# (children endpoint, depth below the folder the crawl started from)
+_Folder = Tuple[str, int]
+_CRAWL_DONE = object()
+
+
+def same_content(hashes: Dict[str, str], item: FileItem) -> bool:
+    """
+    Whether local `hashes` match the content hash Graph reports for the item.
+    OneDrive for Business only reports quickXorHash; personal drives may
+    only report sha1Hash.
+    """
+    remote = (item.file or {}).get("hashes") or {}
+    if hashes.get("quickXorHash") and remote.get("quickXorHash"):
+        return hashes["quickXorHash"] == remote["quickXorHash"]
+    if hashes.get("sha1Hash") and remote.get("sha1Hash"):
+        return hashes["sha1Hash"].upper() == remote["sha1Hash"].upper()
+    return False
+
+async def _stream_hashes(source: Any, chunk_size: int) -> Dict[str, str]:
+    """file_hashes for a source with async read/seek, read from the start."""
+    quick_xor, sha1 = QuickXorHash(), hashlib.sha1()
+    await source.seek(0)
+    while True:
+        chunk = await source.read(chunk_size)
+        if not chunk:
+            break
+        quick_xor.update(chunk)
+        sha1.update(chunk)
+    return {"quickXorHash": quick_xor.b64digest(), "sha1Hash": sha1.hexdigest().upper()}
 
 class DriveService:
     def __init__(self, client: GraphClient):
         self.client = client
 
     async def get_files(self, folder_path: str = "root") -> List[FileItem]:
-        endpoint = f"/me/drive/{folder_path}/children" if folder_path == "root" else f"/me/drive/root:/{folder_path}:/children"
-        data = await self.client.get(endpoint)
-        return [FileItem(**item) for item in data.get("value", [])]
+        data = await self.client.get(
+            f"{self._children_endpoint(folder_path)}?{select_query(FileItem)}")
+        return validate_page(FileItem, data.get("value", []))
+
+    async def iter_files(self, folder_path: str = "root",
+                         page_size: int = 200) -> AsyncIterator[FileItem]:
+        endpoint = f"{self._children_endpoint(folder_path)}?$top={page_size}&{select_query(FileItem)}"
+        async for item in self.client.paginate(endpoint):
+            yield validate_item(FileItem, item)
+
+    async def crawl(self, folder_path: str = "root", concurrency: Optional[int] = None,
+                    page_size: Optional[int] = None, batch: Optional[bool] = None,
+                    max_depth: Optional[int] = None) -> AsyncIterator[FileItem]:
+        """
+        Yields every item below a folder, walking the tree breadth-first with
+        `concurrency` workers listing folders at the same time and following
+        pagination. With batch=True a worker asks for the first page of up
+        to 20 queued folders in one $batch call; folders the reply marks as
+        throttled are asked for again after Graph's Retry-After. `max_depth=0`
+        lists only the folder itself. Folders Graph refuses to list with a
+        permanent 4xx, such as 403 or 404, are logged and skipped; any other
+        error stops the crawl rather than leave a subtree out silently.
+        """
+        concurrency = concurrency or settings.DRIVE_CRAWL_CONCURRENCY
+        page_size = page_size or settings.DRIVE_CRAWL_PAGE_SIZE
+        batch = settings.DRIVE_CRAWL_BATCH if batch is None else batch
+        query = f"$top={page_size}&{select_query(FileItem)}"
+
+        folders: asyncio.Queue = asyncio.Queue()
+        # Bounded, so a slow reader holds the workers back instead of the
+        # whole drive piling up in memory.
+        found: asyncio.Queue = asyncio.Queue(maxsize=page_size * concurrency)
+        folders.put_nowait((f"{self._children_endpoint(folder_path)}?{query}", 0))
+
+        async def finish():
+            await folders.join()
+            await found.put(_CRAWL_DONE)
+
+        tasks = [asyncio.create_task(self._crawl_worker(folders, found, query, batch, max_depth))
+                 for _ in range(concurrency)]
+        tasks.append(asyncio.create_task(finish()))
+        try:
+            while True:
+                item = await found.get()
+                if item is _CRAWL_DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _crawl_worker(self, folders: asyncio.Queue, found: asyncio.Queue, query: str,
+                            batch: bool, max_depth: Optional[int]) -> None:
+        try:
+            while True:
+                work = [await folders.get()]
+                while batch and len(work) < MAX_BATCH_SIZE and not folders.empty():
+                    work.append(folders.get_nowait())
+                await self._list_folders(work, folders, found, query, batch, max_depth)
+                for _ in work:
+                    folders.task_done()
+        except Exception as e:
+            # Handed to the reader, which raises it and stops the crawl.
+            await found.put(e)
+
+    async def _list_folders(self, work: List[_Folder], folders: asyncio.Queue,
+                            found: asyncio.Queue, query: str, batch: bool,
+                            max_depth: Optional[int]) -> None:
+        if batch and len(work) > 1:
+            first_pages = await self._first_pages([endpoint for endpoint, _ in work])
+        else:
+            first_pages = [None] * len(work)
 
-    async def download_file(self, item_id: str) -> bytes:
-        return await self.client.get(f"/me/drive/items/{item_id}/content")
+        for (endpoint, depth), first_page in zip(work, first_pages):
+            try:
+                if isinstance(first_page, GraphAPIException):
+                    raise first_page
+                pages = (self.client.paginate(endpoint) if first_page is None
+                         else self._follow(first_page))
+                async for data in pages:
+                    item = validate_item(FileItem, data)
+                    # Queue subfolders first so idle workers can start on them.
+                    if (item.folder is not None and item.folder.get("childCount", 1)
+                            and (max_depth is None or depth < max_depth)):
+                        folders.put_nowait((f"/me/drive/items/{item.id}/children?{query}", depth + 1))
+                    await found.put(item)
+            except GraphAPIException as e:
+                if not 400 <= e.status_code < 500 or e.status_code == 429:
+                    raise
+                logger.warning(f"Skipping folder {endpoint.split('?')[0]}: {e.message}")
+
+    async def _first_pages(self, endpoints: List[str]) -> List[Any]:
+        """
+        First page of each folder through one $batch call, sending the items
+        Graph throttled again after its Retry-After, within the client's
+        retry policy. Items still failing are returned as GraphAPIException.
+        """
+        policy = self.client.retry_policy
+        deadline = time.monotonic() + policy.total_budget
+        pages: List[Any] = [None] * len(endpoints)
+        pending = list(range(len(endpoints)))
+        attempt = 0
+        while pending:
+            replies = await self.client.send_batch(
+                [BatchRequest("GET", endpoints[index], retry=True) for index in pending])
+            throttled = []
+            for index, reply in zip(pending, replies):
+                pages[index] = reply
+                if isinstance(reply, GraphAPIException) and reply.status_code in RETRY_STATUSES:
+                    throttled.append(index)
+            if not throttled:
+                break
+            delay = policy.next_delay(attempt, deadline,
+                                      longest_retry_after(pages[index] for index in throttled))
+            if delay is None:
+                break
+            logger.warning(f"{len(throttled)} folder listings throttled, retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            pending = throttled
+            attempt += 1
+        return pages
+
+    async def _follow(self, page: Dict) -> AsyncIterator[Dict]:
+        for item in page.get("value", []):
+            yield item
+        next_link = page.get("@odata.nextLink")
+        if next_link:
+            async for item in self.client.paginate(next_link):
+                yield item
+
+    @staticmethod
+    def _children_endpoint(folder_path: str) -> str:
+        if folder_path == "root":
+            return f"/me/drive/{folder_path}/children"
+        return f"/me/drive/root:/{folder_path}:/children"
+
+    async def get_item(self, path: str) -> Optional[FileItem]:
+        """Metadata of the item at a path below the drive root, or None when there is none."""
+        try:
+            data = await self.client.get(f"/me/drive/root:/{path}?{select_query(FileItem)}")
+        except GraphAPIException as e:
+            if e.status_code == 404:
+                return None
+            raise
+        return validate_item(FileItem, data)
+
+    async def open_download(self, item_id: str,
+                            byte_range: Optional[str] = None) -> GraphStream:
+        headers = {"Range": byte_range} if byte_range else None
+        return await self.client.open_stream(
+            "GET", f"/me/drive/items/{item_id}/content", headers=headers)
     
     async def upload_file(self, filename: str, content: bytes) -> FileItem:
         # Simple upload to root
         endpoint = f"/me/drive/root:/{filename}:/content"
         data = await self.client.put(endpoint, data=content)
-        return FileItem(**data)
+        return validate_item(FileItem, data)
+
+    async def upload_file_if_changed(self, filename: str, content: bytes) -> Tuple[FileItem, bool]:
+        """
+        Uploads unless the file in OneDrive already has exactly these bytes,
+        judged by its content hash. Returns the item and whether it was sent.
+        """
+        existing = await self.get_item(filename)
+        if existing is not None and existing.size == len(content) and same_content(
+                {"quickXorHash": QuickXorHash(content).b64digest()}, existing):
+            return existing, False
+        return await self.upload_file(filename, content), True
+
+    async def upload_large_file_if_changed(self, filename: str, source: Any, size: int,
+                                           chunk_size: Optional[int] = None) -> Tuple[FileItem, bool]:
+        """
+        upload_large_file, skipped when OneDrive already has these bytes. The
+        source is only read to hash it when an item of the same size exists.
+        """
+        existing = await self.get_item(filename)
+        if existing is not None and existing.size == size and same_content(
+                await _stream_hashes(source, settings.DRIVE_UPLOAD_CHUNK_SIZE), existing):
+            return existing, False
+        return await self.upload_large_file(filename, source, size, chunk_size), True
+
+    async def upload_large_file(self, filename: str, source: Any, size: int,
+                                chunk_size: Optional[int] = None) -> FileItem:
+        """
+        Uploads through a Graph upload session, reading `source` (an object
+        with async read/seek, such as UploadFile) one chunk at a time.
+        Graph requires a session's fragments in order, so they are sent one
+        after another; the next chunk is read while the current one is in
+        flight, so at most two chunks are held in memory. After a failed
+        fragment the upload resumes from the range Graph reports as next
+        expected.
+        """
+        chunk_size = chunk_size or settings.DRIVE_UPLOAD_CHUNK_SIZE
+        if chunk_size % UPLOAD_FRAGMENT_MULTIPLE:
+            raise ValueError("chunk_size must be a multiple of 320 KiB")
+
+        session = await self.client.post(
+            f"/me/drive/root:/{filename}:/createUploadSession",
+            data={"item": {"@microsoft.graph.conflictBehavior": "replace"}},
+            retry=True,
+        )
+        upload_url = session["uploadUrl"]
+
+        offset = 0
+        resumes = 0
+        while True:
+            try:
+                return await self._upload_from(upload_url, source, size, offset, chunk_size)
+            except GraphAPIException as e:
+                if resumes >= settings.DRIVE_UPLOAD_MAX_RESUMES or e.status_code == 404:
+                    raise
+                resumes += 1
+                offset = await self._next_expected_offset(upload_url)
+                logger.warning(f"Resuming upload of {filename} at byte {offset}: {e.message}")
+
+    async def _upload_from(self, upload_url: str, source: Any, size: int,
+                           offset: int, chunk_size: int) -> FileItem:
+        await source.seek(offset)
+        chunk = await source.read(chunk_size)
+        while True:
+            end = offset + len(chunk)
+            next_read = asyncio.ensure_future(source.read(chunk_size)) if end < size else None
+            try:
+                data = await self.client.request(
+                    "PUT", upload_url, retry=True, content=chunk,
+                    headers={
+                        "Content-Type": "application/octet-stream",
+                        "Content-Range": f"bytes {offset}-{end - 1}/{size}",
+                    },
+                )
+            except BaseException:
+                # Let the read-ahead settle so a resume can safely seek.
+                if next_read is not None:
+                    await asyncio.wait([next_read])
+                raise
+            if next_read is None:
+                return validate_item(FileItem, data)
+            offset, chunk = end, await next_read
+
+    async def _next_expected_offset(self, upload_url: str) -> int:
+        # A plain request: the pre-authenticated session URL must not be
+        # cached, shared between callers or put inside a $batch.
+        status = await self.client.request("GET", upload_url, retry=True)
+        ranges = status.get("nextExpectedRanges") or ["0-"]
+        return int(ranges[0].split("-")[0])
@@ -1,21 +1,35 @@
-from typing import List
+from typing import AsyncIterator, Dict, List
 from src.core.graph_client import GraphClient
 from src.models.mail import Message, SendMessageRequest
+from src.models.projection import select_query
+from src.models.validation import validate_item, validate_page
 
 class MailService:
     def __init__(self, client: GraphClient):
         self.client = client
 
-    async def get_messages(self, top: int = 10) -> List[Message]:
-        data = await self.client.get(f"/me/messages?$top={top}&$orderby=receivedDateTime desc")
-        return [Message(**msg) for msg in data.get("value", [])]
+    async def get_messages(self, top: int = 10, summary: bool = False) -> List[Message]:
+        data = await self.client.get(
+            f"/me/messages?$top={top}&$orderby=receivedDateTime desc&{select_query(Message, summary)}")
+        return validate_page(Message, data.get("value", []))
+
+    async def iter_messages(self, page_size: int = 50,
+                            summary: bool = False) -> AsyncIterator[Message]:
+        endpoint = (f"/me/messages?$top={page_size}&$orderby=receivedDateTime desc"
+                    f"&{select_query(Message, summary)}")
+        async for msg in self.client.paginate(endpoint):
+            yield validate_item(Message, msg)
 
     async def get_message(self, message_id: str) -> Message:
-        data = await self.client.get(f"/me/messages/{message_id}")
-        return Message(**data)
+        data = await self.client.get(f"/me/messages/{message_id}?{select_query(Message)}")
+        return validate_item(Message, data)
 
     async def send_message(self, request: SendMessageRequest) -> None:
-        message_payload = {
+        await self.client.post("/me/sendMail", data=self.send_payload(request))
+
+    @staticmethod
+    def send_payload(request: SendMessageRequest) -> Dict:
+        return {
             "message": {
                 "subject": request.subject,
                 "body": {
@@ -28,4 +42,3 @@ class MailService:
             },
             "saveToSentItems": True
         }
-        await self.client.post("/me/sendMail", data=message_payload)
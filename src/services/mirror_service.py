@@ -0,0 +1,228 @@
+import asyncio
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+from urllib.parse import quote, unquote
+from src.core.config import settings
+from src.core.exceptions import GraphAPIException
+from src.core.quickxor import QuickXorHash, file_hashes
+from src.models.drive import FileItem
+from src.services.drive_service import DriveService, same_content
+from loguru import logger
+
+
+@dataclass
+class MirrorResult:
+    uploaded: List[str] = field(default_factory=list)
+    downloaded: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    failed: Dict[str, str] = field(default_factory=dict)
+    bytes_transferred: int = 0
+
+
+class MirrorManifest:
+    """
+    Content hashes of local files by relative path, together with the size
+    and mtime they were computed for. A file whose size and mtime have not
+    changed is not read again.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._entries: Dict[str, Dict] = {}
+        if path.exists():
+            try:
+                self._entries = json.loads(path.read_text()).get("files", {})
+            except (ValueError, OSError) as e:
+                logger.warning(f"Ignoring unreadable mirror manifest {path}: {e}")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def hashes(self, relative: str, stat: os.stat_result) -> Optional[Dict[str, str]]:
+        entry = self._entries.get(relative)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            return None
+        return entry["hashes"]
+
+    def record(self, relative: str, stat: os.stat_result, hashes: Dict[str, str]) -> None:
+        self._entries[relative] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hashes": hashes}
+
+    def retain(self, relatives: set) -> None:
+        """Drops entries of files that no longer exist."""
+        self._entries = {key: value for key, value in self._entries.items() if key in relatives}
+
+    def save(self) -> None:
+        partial = self.path.with_name(self.path.name + ".tmp")
+        partial.write_text(json.dumps({"version": 1, "files": self._entries}))
+        os.replace(partial, self.path)
+
+
+class _LocalFile:
+    """Async read/seek over a local file, as DriveService.upload_large_file expects."""
+
+    def __init__(self, path: Path):
+        self._file = open(path, "rb")
+
+    async def read(self, size: int) -> bytes:
+        return await asyncio.to_thread(self._file.read, size)
+
+    async def seek(self, offset: int) -> None:
+        await asyncio.to_thread(self._file.seek, offset)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class DriveMirror:
+    """
+    Mirrors a local folder and a OneDrive folder by content hash. `push`
+    uploads local files that are missing or different in OneDrive, `pull`
+    downloads remote files that are missing or different locally; files
+    with matching quickXorHash/sha1Hash are left alone and nothing is ever
+    deleted. Transfers run on a fixed number of workers. Local hashes are
+    kept in a manifest, so unchanged files are not re-hashed on later runs.
+    """
+
+    def __init__(self, drive: DriveService, local_root: str, remote_root: str,
+                 concurrency: Optional[int] = None, manifest_path: Optional[str] = None):
+        self.drive = drive
+        self.local_root = Path(local_root)
+        self.remote_root = remote_root.strip("/")
+        self.concurrency = concurrency or settings.DRIVE_MIRROR_CONCURRENCY
+        self.manifest = MirrorManifest(
+            Path(manifest_path) if manifest_path else self.local_root / settings.DRIVE_MIRROR_MANIFEST)
+
+    async def push(self) -> MirrorResult:
+        local = await asyncio.to_thread(self.scan_local)
+        remote = await self.scan_remote()
+        result = MirrorResult()
+        changed = [path for path, hashes in local.items()
+                   if path not in remote or not same_content(hashes, remote[path])]
+        result.unchanged = len(local) - len(changed)
+        await self._transfer(changed, self._upload, result, result.uploaded)
+        return result
+
+    async def pull(self) -> MirrorResult:
+        local = await asyncio.to_thread(self.scan_local)
+        remote = await self.scan_remote()
+        result = MirrorResult()
+        changed = [path for path, item in remote.items()
+                   if path not in local or not same_content(local[path], item)]
+        result.unchanged = len(remote) - len(changed)
+        await self._transfer(changed, lambda path: self._download(path, remote[path]),
+                             result, result.downloaded)
+        return result
+
+    def scan_local(self) -> Dict[str, Dict[str, str]]:
+        """Hashes of every local file by relative path, reading only files not in the manifest."""
+        found: Dict[str, Dict[str, str]] = {}
+        hashed = 0
+        self.local_root.mkdir(parents=True, exist_ok=True)
+        for path in self.local_root.rglob("*"):
+            if not path.is_file() or path == self.manifest.path or path.name.endswith(".part"):
+                continue
+            relative = path.relative_to(self.local_root).as_posix()
+            stat = path.stat()
+            hashes = self.manifest.hashes(relative, stat)
+            if hashes is None:
+                with open(path, "rb") as f:
+                    hashes = file_hashes(f)
+                self.manifest.record(relative, stat, hashes)
+                hashed += 1
+            found[relative] = hashes
+        self.manifest.retain(set(found))
+        self.manifest.save()
+        logger.info(f"Mirror scan of {self.local_root}: {len(found)} files, {hashed} hashed")
+        return found
+
+    async def scan_remote(self) -> Dict[str, FileItem]:
+        """Files below the remote folder by path relative to it."""
+        prefix = f"/drive/root:/{self.remote_root}" if self.remote_root else "/drive/root:"
+        found: Dict[str, FileItem] = {}
+        start = quote(self.remote_root) if self.remote_root else "root"
+        async for item in self.drive.crawl(folder_path=start):
+            parent = unquote((item.parentReference or {}).get("path", ""))
+            if item.file is None or not parent.startswith(prefix):
+                continue
+            folder = parent[len(prefix):].strip("/")
+            found[f"{folder}/{item.name}" if folder else item.name] = item
+        return found
+
+    async def _transfer(self, paths: List[str], transfer: Callable[[str], Awaitable[int]],
+                        result: MirrorResult, done: List[str]) -> None:
+        queue: asyncio.Queue = asyncio.Queue()
+        for path in paths:
+            queue.put_nowait(path)
+
+        async def work():
+            while not queue.empty():
+                path = queue.get_nowait()
+                try:
+                    size = await transfer(path)
+                    result.bytes_transferred += size
+                    done.append(path)
+                except (GraphAPIException, OSError) as e:
+                    logger.error(f"Mirror transfer of {path} failed: {e}")
+                    result.failed[path] = str(e)
+
+        try:
+            await asyncio.gather(*(work() for _ in range(min(self.concurrency, len(paths)))))
+        finally:
+            self.manifest.save()
+
+    def _remote_path(self, relative: str) -> str:
+        return quote(f"{self.remote_root}/{relative}" if self.remote_root else relative)
+
+    async def _upload(self, relative: str) -> int:
+        path = self.local_root / relative
+        size = path.stat().st_size
+        if size <= settings.DRIVE_SIMPLE_UPLOAD_LIMIT:
+            content = await asyncio.to_thread(path.read_bytes)
+            await self.drive.upload_file(self._remote_path(relative), content)
+            return size
+        source = _LocalFile(path)
+        try:
+            await self.drive.upload_large_file(self._remote_path(relative), source, size)
+        finally:
+            source.close()
+        return size
+
+    async def _download(self, relative: str, item: FileItem) -> int:
+        target = self.local_root / relative
+        partial = target.with_name(target.name + ".part")
+        await asyncio.to_thread(target.parent.mkdir, parents=True, exist_ok=True)
+        quick_xor, sha1 = QuickXorHash(), hashlib.sha1()
+        written = 0
+        stream = await self.drive.open_download(item.id)
+        try:
+            f = await asyncio.to_thread(open, partial, "wb")
+            try:
+                async for chunk in stream.aiter_bytes(settings.DRIVE_STREAM_CHUNK_SIZE):
+                    await asyncio.to_thread(_write_chunk, f, chunk, quick_xor, sha1)
+                    written += len(chunk)
+            finally:
+                await asyncio.to_thread(f.close)
+
+            hashes = {"quickXorHash": quick_xor.b64digest(), "sha1Hash": sha1.hexdigest().upper()}
+            remote = (item.file or {}).get("hashes") or {}
+            if (remote.get("quickXorHash") or remote.get("sha1Hash")) and not same_content(hashes, item):
+                raise OSError(f"Downloaded content of {relative} does not match its hash in OneDrive")
+            await asyncio.to_thread(os.replace, partial, target)
+        except BaseException:
+            # Failed, mismatched or cancelled downloads leave no partial file behind.
+            partial.unlink(missing_ok=True)
+            raise
+        finally:
+            await stream.aclose()
+        self.manifest.record(relative, await asyncio.to_thread(target.stat), hashes)
+        return written
+
+
+def _write_chunk(f, chunk: bytes, *digests) -> None:
+    f.write(chunk)
+    for digest in digests:
+        digest.update(chunk)
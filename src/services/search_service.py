@@ -0,0 +1,268 @@
+import html
+import json
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from src.models.mail import MailSearchHit, Message
+from src.models.validation import validate_item
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    rowid INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    id TEXT NOT NULL,
+    sender TEXT,
+    received TEXT,
+    data TEXT NOT NULL,
+    UNIQUE (owner, id)
+);
+CREATE INDEX IF NOT EXISTS messages_by_received ON messages (owner, received);
+CREATE INDEX IF NOT EXISTS messages_by_sender ON messages (owner, sender, received);
+-- Prefix indexes keep short prefixes ("pre*") from merging the postings of
+-- every word they match.
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    subject, people, body, sender, prefix = '2 3 4', tokenize = 'unicode61 remove_diacritics 2'
+);
+-- bm25 column weights: a hit in the subject counts more than one in the body.
+-- The sender column is only there to filter on.
+INSERT INTO messages_fts (messages_fts, rank) VALUES ('rank', 'bm25(5.0, 2.0, 1.0, 0.0)');
+"""
+
+# Rowids are the second a message was received followed by a sequence number,
+# so the full-text index lists matches newest first and date filters become
+# rowid ranges it can seek to.
+_SEQUENCE_BITS = 20
+
+_HIDDEN_HTML = re.compile(r"<(style|script|head)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_TAG = re.compile(r"<[^>]+>")
+_SPACE = re.compile(r"\s+")
+_QUERY_TERM = re.compile(r'"([^"]*)"|(\w+)(\*?)')
+
+
+def html_text(content: str) -> str:
+    """Visible text of an HTML body, tags and entities removed."""
+    text = _TAG.sub(" ", _HIDDEN_HTML.sub(" ", content))
+    return _SPACE.sub(" ", html.unescape(text)).strip()
+
+
+def fts_query(text: str) -> Optional[str]:
+    """
+    An FTS5 MATCH expression for user input: every word must match, "quoted
+    text" matches as a phrase and a trailing * makes a word a prefix
+    ("presu*"). Operators and other punctuation in the input are never
+    passed through to FTS5.
+    """
+    parts = []
+    for phrase, word, star in _QUERY_TERM.findall(text):
+        if word:
+            # Prefix queries merge the postings of every matching word, so
+            # they are only run when asked for.
+            parts.append(f'"{word}"' + star)
+        else:
+            words = re.findall(r"\w+", phrase)
+            if words:
+                parts.append('"' + " ".join(words) + '"')
+    return " ".join(parts) or None
+
+
+def _utc_text(value: datetime) -> str:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _first_rowid(received: Optional[str]) -> int:
+    """The lowest rowid for messages received in the same second as `received`."""
+    try:
+        moment = datetime.fromisoformat(received[:19]).replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return 0
+    return max(int(moment.timestamp()), 0) << _SEQUENCE_BITS
+
+
+def _address(recipient: Optional[Dict]) -> Tuple[str, str]:
+    email = (recipient or {}).get("emailAddress") or {}
+    return email.get("name") or "", (email.get("address") or "").lower()
+
+
+def _sender_token(address: str) -> str:
+    """
+    The sender address as a single token; matching it as a phrase of its
+    words would read the postings of "com" and the domain for every search.
+    """
+    return address.encode().hex()
+
+
+def _document(message: Dict) -> Tuple[str, str, str, str]:
+    """The (subject, people, body, sender) text indexed for a Graph message."""
+    people = [_address(message.get("from") or message.get("sender"))]
+    people += [_address(recipient) for recipient in message.get("toRecipients") or []]
+    body = message.get("body") or {}
+    if body.get("content"):
+        text = body["content"]
+        text = html_text(text) if (body.get("contentType") or "").lower() == "html" else text
+    else:
+        text = message.get("bodyPreview") or ""
+    return (message.get("subject") or "",
+            " ".join(part for pair in people for part in pair if part), text,
+            _sender_token(people[0][1]))
+
+
+class MailSearchIndex:
+    """
+    SQLite FTS5 index over synced messages, so mail can be searched with
+    ranking and filters without calling Graph. Delta rounds update it in
+    place; partial updates are merged like in the sync store, and the text
+    is only re-indexed when the subject, people or body changed.
+
+    bm25 costs about 3 us per matching message, so a word found in nearly
+    every message would take ~0.5 s to rank across 200k. Only the
+    `rank_window` most recently received matches are ranked; rarer words are
+    ranked across the whole mailbox. The sender and date filters are part of
+    the full-text query, so a selective filter on a common word only reads
+    the messages that pass it.
+    """
+
+    def __init__(self, path: str, rank_window: int = 5000):
+        self.path = path
+        self.rank_window = rank_window
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.executescript("PRAGMA journal_mode=WAL;" + _SCHEMA)
+        return self._db
+
+    def apply_round(self, owner: str, folder: str, upserts: Iterable[Dict],
+                    removed_ids: Iterable[str] = (), reset: bool = False) -> None:
+        with self._lock, self._conn:
+            conn = self._conn
+            if reset:
+                conn.execute("DELETE FROM messages_fts WHERE rowid IN "
+                             "(SELECT rowid FROM messages WHERE owner = ? AND folder = ?)",
+                             (owner, folder))
+                conn.execute("DELETE FROM messages WHERE owner = ? AND folder = ?", (owner, folder))
+            documents = []
+            for item in upserts:
+                row = conn.execute("SELECT rowid, data FROM messages WHERE owner = ? AND id = ?",
+                                   (owner, item["id"])).fetchone()
+                previous = json.loads(row[1]) if row else None
+                merged = {**previous, **item} if previous else item
+                received = merged.get("receivedDateTime")
+                sender = _address(merged.get("from") or merged.get("sender"))[1] or None
+                values = (folder, sender, received, json.dumps(merged))
+                document = _document(merged)
+                first = _first_rowid(received)
+                if row is not None and row[0] >> _SEQUENCE_BITS != first >> _SEQUENCE_BITS:
+                    # The received time moved; the message takes a rowid in its new second.
+                    conn.execute("DELETE FROM messages_fts WHERE rowid = ?", (row[0],))
+                    conn.execute("DELETE FROM messages WHERE rowid = ?", (row[0],))
+                    row = None
+                if row is None:
+                    last = conn.execute("SELECT MAX(rowid) FROM messages WHERE rowid >= ? AND rowid < ?",
+                                        (first, first + (1 << _SEQUENCE_BITS))).fetchone()[0]
+                    rowid = first if last is None else last + 1
+                    conn.execute(
+                        "INSERT INTO messages (rowid, owner, id, folder, sender, received, data) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)", (rowid, owner, item["id"], *values))
+                else:
+                    rowid = row[0]
+                    conn.execute("UPDATE messages SET folder = ?, sender = ?, received = ?, data = ? "
+                                 "WHERE rowid = ?", (*values, rowid))
+                    if _document(previous) == document:
+                        continue
+                    conn.execute("DELETE FROM messages_fts WHERE rowid = ?", (rowid,))
+                documents.append((rowid, *document))
+            # FTS5 flushes its pending changes whenever a rowid is lower than
+            # the last one written, so a round is indexed in rowid order.
+            documents.sort()
+            conn.executemany("INSERT INTO messages_fts (rowid, subject, people, body, sender) "
+                             "VALUES (?, ?, ?, ?, ?)", documents)
+            for item_id in removed_ids:
+                row = conn.execute("SELECT rowid FROM messages WHERE owner = ? AND id = ?",
+                                   (owner, item_id)).fetchone()
+                if row is not None:
+                    conn.execute("DELETE FROM messages_fts WHERE rowid = ?", row)
+                    conn.execute("DELETE FROM messages WHERE rowid = ?", row)
+
+    def search(self, owner: str, query: str = "", sender: Optional[str] = None,
+               since: Optional[datetime] = None, until: Optional[datetime] = None,
+               top: int = 25) -> List[MailSearchHit]:
+        """
+        Messages matching `query`, best first; without a query the filters
+        alone apply and the newest messages come first.
+        """
+        match = fts_query(query)
+        where, params = ["m.owner = ?"], [owner]
+        if sender:
+            where.append("m.sender = ?")
+            params.append(sender.lower())
+            if match is not None:
+                match += f' AND sender : "{_sender_token(sender.lower())}"'
+        if since is not None:
+            where.append("m.received >= ?")
+            params.append(_utc_text(since))
+            if match is not None:
+                where.append("f.rowid >= ?")
+                params.append(_first_rowid(params[-2]))
+        if until is not None:
+            where.append("m.received < ?")
+            params.append(_utc_text(until))
+            if match is not None:
+                where.append("f.rowid < ?")
+                params.append(_first_rowid(params[-2]))
+
+        filters = " AND ".join(where)
+        with self._lock:
+            if match is None:
+                rows = self._conn.execute(
+                    f"SELECT m.data, 0.0, NULL FROM messages m WHERE {filters} "
+                    f"ORDER BY m.received DESC LIMIT ?", (*params, top)).fetchall()
+            else:
+                rows = self._ranked(match, filters, params, top)
+        # bm25 is lower for better matches; flip it so a higher score is better.
+        return [MailSearchHit(score=-rank, snippet=snippet,
+                              message=validate_item(Message, json.loads(data)))
+                for data, rank, snippet in rows]
+
+    def _ranked(self, match: str, filters: str, params: List, top: int) -> List[Tuple]:
+        ranked = self._conn.execute(
+            f"SELECT rowid, rank FROM ("
+            f"  SELECT f.rowid AS rowid, f.rank AS rank FROM messages_fts f"
+            # CROSS JOIN keeps the FTS match as the outer loop; otherwise SQLite
+            # may walk the owner index and probe the full-text index per row.
+            f"  CROSS JOIN messages m ON m.rowid = f.rowid"
+            f"  WHERE messages_fts MATCH ? AND {filters}"
+            f"  ORDER BY f.rowid DESC LIMIT ?"
+            f") ORDER BY rank LIMIT ?", (match, *params, self.rank_window, top)).fetchall()
+        if not ranked:
+            return []
+        # Snippets and stored messages only for the hits that are returned.
+        rowids = [rowid for rowid, _ in ranked]
+        marks = ", ".join("?" * len(rowids))
+        data = dict(self._conn.execute(
+            f"SELECT rowid, data FROM messages WHERE rowid IN ({marks})", rowids))
+        # One pass over the hits' rowid range: a rowid IN (...) constraint would
+        # run the match once per hit, and a prefix match merges its postings
+        # every time. The unary + keeps SQLite from handing it to FTS5.
+        snippets = dict(self._conn.execute(
+            f"SELECT rowid, snippet(messages_fts, 2, '[', ']', '...', 12) FROM messages_fts "
+            f"WHERE messages_fts MATCH ? AND rowid BETWEEN ? AND ? AND +rowid IN ({marks})",
+            (match, min(rowids), max(rowids), *rowids)))
+        return [(data[rowid], rank, snippets.get(rowid)) for rowid, rank in ranked]
+
+    def count(self, owner: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages WHERE owner = ?",
+                                      (owner,)).fetchone()[0]
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,532 @@
+import asyncio
+import re
+import secrets
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+import httpx
+from src.core.config import settings
+from src.core.exceptions import AuthException, ConfigurationException, GraphAPIException
+from src.core.graph_client import GraphClient
+from src.models.subscription import ChangeNotification, NotificationBatch, Subscription
+from src.services.search_service import MailSearchIndex
+from src.services.sync_service import CALENDAR, MAIL, SyncService, SyncStore
+from loguru import logger
+
+# Returns a client with a currently valid token; subscriptions outlive one token.
+ClientFactory = Callable[[], Awaitable[GraphClient]]
+# Returns a client for a home account id, or None once it has to sign in again.
+AccountClient = Callable[[str], Awaitable[Optional[GraphClient]]]
+NotificationHandler = Callable[[ChangeNotification], Awaitable[None]]
+
+
+@dataclass(frozen=True)
+class _Resource:
+    path: str
+    change_type: str
+    # A few minutes under Graph's maximum lifetime, so clock skew between us
+    # and Graph does not get the request rejected.
+    max_minutes: int
+    lifecycle: bool
+
+
+RESOURCES = {
+    "mail": _Resource("me/mailFolders('{folder}')/messages", "created,updated,deleted", 10070, True),
+    "events": _Resource("me/events", "created,updated,deleted", 10070, True),
+    # OneDrive only reports "updated", on the root of the changed hierarchy.
+    "drive": _Resource("me/drive/root", "updated", 42290, False),
+}
+
+
+def _utc_text(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.0000000Z")
+
+
+def _same_secret(given: Optional[str], expected: str) -> bool:
+    return secrets.compare_digest((given or "").encode(), expected.encode())
+
+
+class _Consumer:
+    def __init__(self, handler: NotificationHandler, queue_size: int):
+        self.handler = handler
+        self.name = getattr(handler, "__name__", repr(handler))
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.worker: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.worker is None:
+            self.worker = asyncio.create_task(self._work())
+
+    async def _work(self) -> None:
+        while True:
+            notification = await self.queue.get()
+            try:
+                await self.handler(notification)
+            except Exception as e:
+                logger.error(f"Notification consumer {self.name} failed on "
+                             f"{notification.resource}: {e}")
+            finally:
+                self.queue.task_done()
+
+
+class NotificationHub:
+    """
+    Fans notifications out to in-process consumers. Each consumer has its
+    own bounded queue and worker, so a slow consumer only falls behind
+    itself; when its queue is full, new notifications for it are dropped
+    and counted rather than holding up the webhook.
+    """
+
+    def __init__(self, queue_size: int = 1000):
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._consumers: List[_Consumer] = []
+
+    def add_consumer(self, handler: NotificationHandler) -> None:
+        self._consumers.append(_Consumer(handler, self.queue_size))
+
+    def remove_consumer(self, handler: NotificationHandler) -> None:
+        for consumer in [c for c in self._consumers if c.handler is handler]:
+            if consumer.worker is not None:
+                consumer.worker.cancel()
+            self._consumers.remove(consumer)
+
+    def publish(self, notifications: Iterable[ChangeNotification]) -> None:
+        notifications = list(notifications)
+        for consumer in self._consumers:
+            consumer.start()
+            for notification in notifications:
+                try:
+                    consumer.queue.put_nowait(notification)
+                except asyncio.QueueFull:
+                    self.dropped += 1
+                    logger.warning(f"Notification queue of {consumer.name} is full, "
+                                   f"dropping {notification.changeType} {notification.resource}")
+
+    async def join(self) -> None:
+        """
+        Waits until every consumer has handled what was published so far,
+        including work a consumer with a `join()` method left running.
+        """
+        for consumer in self._consumers:
+            await consumer.queue.join()
+            if hasattr(consumer.handler, "join"):
+                await consumer.handler.join()
+
+    async def close(self) -> None:
+        workers = [c.worker for c in self._consumers if c.worker is not None]
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for consumer in self._consumers:
+            consumer.worker = None
+            if hasattr(consumer.handler, "close"):
+                await consumer.handler.close()
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    account_id TEXT,
+    client_state TEXT NOT NULL,
+    max_minutes INTEGER NOT NULL,
+    expires_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS subscriptions_by_owner ON subscriptions (owner);
+CREATE INDEX IF NOT EXISTS subscriptions_by_expiry ON subscriptions (expires_at);
+"""
+
+_MAIL_FOLDER = re.compile(r"^me/mailFolders\('([^']*)'\)/messages$")
+
+
+@dataclass
+class _Entry:
+    owner: str
+    # MSAL home account id of the user who subscribed; renewals get tokens
+    # from the account's own token cache rather than from a login session.
+    account_id: Optional[str]
+    subscription: Subscription
+    client_state: str
+    max_minutes: int
+
+
+def _expiry_key(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+class SubscriptionStore:
+    """
+    SQLite store for subscriptions and their clientState, so every worker
+    sharing the file accepts their notifications and renews them after a
+    restart.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.executescript("PRAGMA journal_mode=WAL;" + _SCHEMA)
+        return self._db
+
+    def save(self, entry: _Entry) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO subscriptions "
+                "(id, owner, account_id, client_state, max_minutes, expires_at, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (entry.subscription.id, entry.owner, entry.account_id, entry.client_state,
+                 entry.max_minutes, _expiry_key(entry.subscription.expirationDateTime),
+                 entry.subscription.model_dump_json()),
+            )
+
+    def get(self, subscription_id: str) -> Optional[_Entry]:
+        rows = self._select("WHERE id = ?", (subscription_id,))
+        return rows[0] if rows else None
+
+    def list(self, owner: str) -> List[_Entry]:
+        return self._select("WHERE owner = ? ORDER BY rowid", (owner,))
+
+    def expiring(self, before: datetime) -> List[_Entry]:
+        return self._select("WHERE expires_at <= ?", (_expiry_key(before),))
+
+    def delete(self, subscription_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM subscriptions WHERE id = ?", (subscription_id,))
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _select(self, where: str, params: Tuple) -> List[_Entry]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT owner, account_id, client_state, max_minutes, data FROM subscriptions "
+                + where, params).fetchall()
+        return [_Entry(owner, account_id, Subscription.model_validate_json(data), client_state, max_minutes)
+                for owner, account_id, client_state, max_minutes, data in rows]
+
+
+class SubscriptionManager:
+    """
+    Creates Graph change-notification subscriptions and keeps them alive, so
+    integrations are told about new mail, events and files instead of
+    polling for them. Every subscription gets a random clientState that the
+    webhook checks before a notification is queued for consumers.
+
+    Subscriptions are kept in a SubscriptionStore and renewed in the
+    background `renew_before_minutes` ahead of expiry. Renewals take their
+    client from `account_client`, which renews the subscriber's token from
+    the account's token cache, since the first renewal comes days after the
+    login session that created the subscription has expired.
+    """
+
+    def __init__(self, hub: NotificationHub, store: SubscriptionStore,
+                 notification_url: Optional[str], lifetime_minutes: int = 4320,
+                 renew_before_minutes: int = 120, check_interval: float = 300.0,
+                 account_client: Optional[AccountClient] = None):
+        self.hub = hub
+        self.store = store
+        self.notification_url = notification_url
+        self.lifetime_minutes = lifetime_minutes
+        self.renew_before_minutes = renew_before_minutes
+        self.check_interval = check_interval
+        self.account_client = account_client
+        self.rejected = 0
+        self._renewer: Optional[asyncio.Task] = None
+        self._pending: Set[asyncio.Task] = set()
+
+    async def create(self, owner: str, client_factory: ClientFactory, resource: str,
+                     folder: str = "inbox", change_type: Optional[str] = None,
+                     account_id: Optional[str] = None) -> Subscription:
+        if not self.notification_url:
+            raise ConfigurationException("SUBSCRIPTION_NOTIFICATION_URL is not set")
+        spec = RESOURCES[resource]
+        client_state = secrets.token_urlsafe(32)
+        payload = {
+            "changeType": change_type or spec.change_type,
+            "notificationUrl": self.notification_url,
+            "resource": spec.path.format(folder=folder),
+            "expirationDateTime": self._expiration(spec.max_minutes),
+            "clientState": client_state,
+        }
+        if spec.lifecycle:
+            payload["lifecycleNotificationUrl"] = self.notification_url
+        # Graph validates the notification URL before answering, so the
+        # webhook has to be reachable while this request is in flight.
+        client = await client_factory()
+        subscription = Subscription.model_validate(await client.post("/subscriptions", data=payload))
+        await asyncio.to_thread(self.store.save, _Entry(owner, account_id, subscription,
+                                                         client_state, spec.max_minutes))
+        self.start()
+        logger.info(f"Subscribed to {payload['resource']} until {subscription.expirationDateTime}")
+        return subscription
+
+    async def subscriptions(self, owner: str) -> List[Subscription]:
+        return [entry.subscription for entry in await asyncio.to_thread(self.store.list, owner)]
+
+    async def lookup(self, subscription_id: str) -> Optional[_Entry]:
+        return await asyncio.to_thread(self.store.get, subscription_id)
+
+    async def renew(self, owner: str, subscription_id: str,
+                    client_factory: Optional[ClientFactory] = None) -> Optional[Subscription]:
+        entry = await self.lookup(subscription_id)
+        if entry is None or entry.owner != owner:
+            return None
+        return await self._renew(entry, client_factory)
+
+    async def delete(self, owner: str, subscription_id: str,
+                     client_factory: Optional[ClientFactory] = None) -> bool:
+        entry = await self.lookup(subscription_id)
+        if entry is None or entry.owner != owner:
+            return False
+        client = await self.client_for(entry, client_factory)
+        try:
+            await client.delete(f"/subscriptions/{subscription_id}")
+        except GraphAPIException as e:
+            if e.status_code != 404:
+                raise
+        await asyncio.to_thread(self.store.delete, subscription_id)
+        return True
+
+    async def renew_due(self, now: Optional[datetime] = None) -> int:
+        """Renews every subscription expiring within `renew_before_minutes`."""
+        horizon = (now or datetime.now(timezone.utc)) + timedelta(minutes=self.renew_before_minutes)
+        due = await asyncio.to_thread(self.store.expiring, horizon)
+        results = await asyncio.gather(*(self._renew(entry) for entry in due), return_exceptions=True)
+        renewed = 0
+        for entry, result in zip(due, results):
+            if not isinstance(result, Exception):
+                renewed += 1
+            elif isinstance(result, GraphAPIException) and result.status_code == 404:
+                logger.warning(f"Subscription {entry.subscription.id} no longer exists, dropping it")
+                await asyncio.to_thread(self.store.delete, entry.subscription.id)
+            else:
+                # Left in place; the next check tries again until it expires.
+                logger.error(f"Renewing subscription {entry.subscription.id} failed: {result}")
+        return renewed
+
+    async def accept(self, payload: Dict) -> Tuple[int, int]:
+        """
+        Queues the notifications of a webhook request whose subscription and
+        clientState are known, and returns (accepted, rejected). Raises
+        ValueError for a payload that is not a notification batch.
+        """
+        notifications = NotificationBatch.model_validate(payload).value
+        entries: Dict[str, Optional[_Entry]] = {}
+        for subscription_id in {n.subscriptionId for n in notifications}:
+            entries[subscription_id] = await self.lookup(subscription_id)
+        accepted: List[ChangeNotification] = []
+        rejected = 0
+        for notification in notifications:
+            entry = entries[notification.subscriptionId]
+            if entry is None or not _same_secret(notification.clientState, entry.client_state):
+                rejected += 1
+                logger.warning(f"Rejected notification for subscription {notification.subscriptionId}")
+                continue
+            if notification.lifecycleEvent == "reauthorizationRequired":
+                self._spawn(self._renew(entry))
+            elif notification.lifecycleEvent == "subscriptionRemoved":
+                await asyncio.to_thread(self.store.delete, notification.subscriptionId)
+            accepted.append(notification)
+        self.rejected += rejected
+        self.hub.publish(accepted)
+        if accepted:
+            self.start()
+        return len(accepted), rejected
+
+    async def client_for(self, entry: _Entry,
+                         client_factory: Optional[ClientFactory] = None) -> GraphClient:
+        """A client for the subscriber, from the request's session when there is one."""
+        if client_factory is not None:
+            return await client_factory()
+        client = None
+        if entry.account_id and self.account_client is not None:
+            client = await self.account_client(entry.account_id)
+        if client is None:
+            raise AuthException(f"No token for the owner of subscription {entry.subscription.id}; "
+                                "they have to sign in again")
+        return client
+
+    def start(self) -> None:
+        """Starts the background renewals; needs a running event loop."""
+        if self._renewer is None:
+            self._renewer = asyncio.create_task(self._renew_loop())
+
+    async def close(self) -> None:
+        tasks = list(self._pending)
+        if self._renewer is not None:
+            tasks.append(self._renewer)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._renewer = None
+        await self.hub.close()
+        self.store.close()
+
+    def _expiration(self, max_minutes: int) -> str:
+        minutes = min(self.lifetime_minutes, max_minutes)
+        return _utc_text(datetime.now(timezone.utc) + timedelta(minutes=minutes))
+
+    async def _renew(self, entry: _Entry, client_factory: Optional[ClientFactory] = None) -> Subscription:
+        client = await self.client_for(entry, client_factory)
+        data = await client.patch(f"/subscriptions/{entry.subscription.id}",
+                                  {"expirationDateTime": self._expiration(entry.max_minutes)})
+        entry.subscription = Subscription.model_validate(data)
+        await asyncio.to_thread(self.store.save, entry)
+        return entry.subscription
+
+    def _spawn(self, coroutine: Awaitable) -> None:
+        task = asyncio.ensure_future(coroutine)
+        self._pending.add(task)
+        task.add_done_callback(self._settled)
+
+    def _settled(self, task: asyncio.Task) -> None:
+        self._pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Subscription reauthorization failed: {task.exception()}")
+
+    async def _renew_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.renew_due()
+            except Exception as e:
+                logger.error(f"Subscription renewal check failed: {e}")
+
+
+class DeltaSyncConsumer:
+    """
+    Notification consumer that runs a delta round for the mail folder or
+    calendar a notification is about, so the local store behind
+    `?local=true` reads and mail search follows changes as Graph reports
+    them. Only stores the user has already synced are kept up to date; a
+    notification never starts a first full sync.
+
+    Graph sends one notification per changed item, and a single delta round
+    picks up all of them. Rounds wait `delay` seconds and notifications for a
+    resource that already has a round waiting are dropped, so a burst costs
+    one round, plus one more if changes arrive while it runs.
+    """
+
+    __name__ = "delta_sync"
+
+    def __init__(self, manager: SubscriptionManager, store: SyncStore,
+                 search_index: MailSearchIndex, delay: float = 1.0):
+        self.manager = manager
+        self.store = store
+        self.search_index = search_index
+        self.delay = delay
+        self._waiting: Set[Tuple[str, str]] = set()
+        self._running: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self._rounds: Set[asyncio.Task] = set()
+
+    async def __call__(self, notification: ChangeNotification) -> None:
+        if notification.lifecycleEvent in ("reauthorizationRequired", "subscriptionRemoved"):
+            return
+        entry = await self.manager.lookup(notification.subscriptionId)
+        if entry is None or entry.account_id is None:
+            return
+        resource = entry.subscription.resource
+        folder = _MAIL_FOLDER.match(resource)
+        if folder:
+            synced = f"{MAIL}:{folder.group(1)}"
+        elif resource == RESOURCES["events"].path:
+            synced = CALENDAR
+        else:
+            return
+        key = (entry.account_id, synced)
+        if key in self._waiting:
+            return
+        self._waiting.add(key)
+        task = asyncio.create_task(self._round(key, entry, folder.group(1) if folder else None))
+        self._rounds.add(task)
+        task.add_done_callback(self._settled)
+
+    async def _round(self, key: Tuple[str, str], entry: _Entry, folder: Optional[str]) -> None:
+        # Waits for a round of the same resource that is still running; the
+        # changes that arrived meanwhile need one more.
+        try:
+            async with self._running.setdefault(key, asyncio.Lock()):
+                await asyncio.sleep(self.delay)
+                self._waiting.discard(key)
+                sync = SyncService(await self.manager.client_for(entry), self.store, self.search_index)
+                if not await sync.has_synced(key[1]):
+                    return
+                if folder is not None:
+                    await sync.sync_mail(folder)
+                else:
+                    await sync.sync_calendar()
+        finally:
+            if key not in self._waiting:
+                self._running.pop(key, None)
+
+    def _settled(self, task: asyncio.Task) -> None:
+        self._rounds.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Notification consumer {self.__name__} failed: {task.exception()}")
+
+    async def join(self) -> None:
+        """Waits for the delta rounds started so far, and the ones they queue up."""
+        while self._rounds:
+            await asyncio.gather(*self._rounds, return_exceptions=True)
+
+    async def close(self) -> None:
+        rounds = list(self._rounds)
+        for task in rounds:
+            task.cancel()
+        await asyncio.gather(*rounds, return_exceptions=True)
+        self._waiting.clear()
+        self._running.clear()
+
+
+class LocalNotificationSender:
+    """
+    Stands in for Graph when developing or testing against the webhook: runs
+    the validation handshake and posts notifications shaped like Graph's
+    through any httpx client, e.g. one bound to the app with ASGITransport.
+    """
+
+    def __init__(self, http: httpx.AsyncClient, url: str):
+        self.http = http
+        self.url = url
+
+    async def validate(self, token: Optional[str] = None) -> bool:
+        """True when the webhook echoes the token as plain text, as Graph requires."""
+        token = token or secrets.token_urlsafe(24)
+        response = await self.http.post(self.url, params={"validationToken": token},
+                                        headers={"Content-Type": "text/plain"})
+        return (response.status_code == 200 and response.text == token
+                and response.headers.get("content-type", "").startswith("text/plain"))
+
+    @staticmethod
+    def notification(subscription: Subscription, client_state: Optional[str],
+                     change_type: str = "created", resource_id: str = "AAMkAGI2",
+                     lifecycle_event: Optional[str] = None) -> Dict:
+        body = {
+            "subscriptionId": subscription.id,
+            "subscriptionExpirationDateTime": _utc_text(subscription.expirationDateTime),
+            "clientState": client_state,
+            "tenantId": settings.TENANT_ID,
+        }
+        if lifecycle_event:
+            body["lifecycleEvent"] = lifecycle_event
+            return body
+        return {
+            **body,
+            "changeType": change_type,
+            "resource": f"{subscription.resource}/{resource_id}",
+            "resourceData": {"@odata.id": f"{subscription.resource}/{resource_id}", "id": resource_id},
+        }
+
+    async def send(self, notifications: List[Dict]) -> httpx.Response:
+        return await self.http.post(self.url, json={"value": notifications})
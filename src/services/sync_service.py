@@ -0,0 +1,291 @@
+import asyncio
+import json
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from src.core.config import settings
+from src.core.exceptions import GraphAPIException
+from src.core.graph_client import GraphClient
+from src.core.tokens import token_subject
+from src.models.calendar import Event
+from src.models.mail import MailSearchHit, Message
+from src.models.projection import select_query
+from src.models.validation import validate_page
+from src.services.search_service import MailSearchIndex
+from loguru import logger
+
+MAIL = "mail"
+CALENDAR = "calendar"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS delta_state (
+    owner TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    delta_link TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (owner, resource)
+);
+CREATE TABLE IF NOT EXISTS items (
+    owner TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    id TEXT NOT NULL,
+    sort_key TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (owner, resource, id)
+);
+CREATE INDEX IF NOT EXISTS items_by_sort_key ON items (owner, resource, sort_key);
+CREATE TABLE IF NOT EXISTS delta_bounds (
+    owner TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    bounds TEXT NOT NULL,
+    PRIMARY KEY (owner, resource)
+);
+"""
+
+# (owner, resource) pairs with a background round running in this process.
+_background_syncs: set = set()
+
+
+@dataclass
+class SyncResult:
+    resource: str
+    upserted: int = 0
+    removed: int = 0
+    full_resync: bool = False
+
+
+class SyncStore:
+    """SQLite store for delta links and the items they have synced."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # Opened on first use so plain Graph reads never touch the file.
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.executescript("PRAGMA journal_mode=WAL;" + _SCHEMA)
+        return self._db
+
+    def get_delta_link(self, owner: str, resource: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT delta_link FROM delta_state WHERE owner = ? AND resource = ?",
+                (owner, resource),
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_updated_at(self, owner: str, resource: str) -> Optional[datetime]:
+        """When the last round of `resource` was stored, or None before the first one."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT updated_at FROM delta_state WHERE owner = ? AND resource = ?",
+                (owner, resource),
+            ).fetchone()
+        return datetime.fromisoformat(row[0]) if row else None
+
+    def get_bounds(self, owner: str, resource: str) -> Optional[str]:
+        """The window a bounded delta query (calendarView) was started with."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT bounds FROM delta_bounds WHERE owner = ? AND resource = ?",
+                (owner, resource),
+            ).fetchone()
+        return row[0] if row else None
+
+    def apply_round(self, owner: str, resource: str, upserts: List[Dict],
+                    removed_ids: List[str], delta_link: str, sort_field: str,
+                    reset: bool = False, bounds: Optional[str] = None) -> None:
+        """Writes one delta round atomically, merging partial updates."""
+        with self._lock, self._conn:
+            if reset:
+                self._conn.execute(
+                    "DELETE FROM items WHERE owner = ? AND resource = ?", (owner, resource))
+            for item in upserts:
+                row = self._conn.execute(
+                    "SELECT data FROM items WHERE owner = ? AND resource = ? AND id = ?",
+                    (owner, resource, item["id"]),
+                ).fetchone()
+                merged = {**json.loads(row[0]), **item} if row else item
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO items (owner, resource, id, sort_key, data) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (owner, resource, item["id"], _sort_value(merged, sort_field),
+                     json.dumps(merged)),
+                )
+            self._conn.executemany(
+                "DELETE FROM items WHERE owner = ? AND resource = ? AND id = ?",
+                [(owner, resource, item_id) for item_id in removed_ids],
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO delta_state (owner, resource, delta_link, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (owner, resource, delta_link, datetime.now(timezone.utc).isoformat()),
+            )
+            if bounds is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO delta_bounds (owner, resource, bounds) VALUES (?, ?, ?)",
+                    (owner, resource, bounds),
+                )
+
+    def list_items(self, owner: str, resource: str, top: int,
+                   descending: bool = False) -> List[Dict]:
+        order = "DESC" if descending else "ASC"
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT data FROM items WHERE owner = ? AND resource = ? "
+                f"ORDER BY sort_key {order} LIMIT ?",
+                (owner, resource, top),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def _sort_value(item: Dict, sort_field: str) -> Optional[str]:
+    value = item
+    for part in sort_field.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def calendar_window(now: Optional[datetime] = None) -> Tuple[str, str]:
+    """
+    The calendarView range kept in sync, aligned to the UTC day so it moves
+    forward once a day.
+    """
+    today = (now or datetime.now(timezone.utc)).replace(hour=0, minute=0, second=0, microsecond=0)
+    start = today - timedelta(days=settings.SYNC_CALENDAR_PAST_DAYS)
+    end = today + timedelta(days=settings.SYNC_CALENDAR_FUTURE_DAYS)
+    return start.strftime("%Y-%m-%dT%H:%M:%SZ"), end.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class SyncService:
+    """
+    Keeps a local copy of the user's mail folder and calendar up to date with
+    Graph delta queries, so reads can be served without a full re-fetch.
+    """
+
+    def __init__(self, client: GraphClient, store: SyncStore,
+                 search_index: Optional[MailSearchIndex] = None):
+        self.client = client
+        self.store = store
+        self.search_index = search_index
+        self.owner = token_subject(client.access_token)
+
+    async def sync_mail(self, folder: str = "inbox") -> SyncResult:
+        return await self._sync(
+            f"{MAIL}:{folder}",
+            f"/me/mailFolders/{folder}/messages/delta?{select_query(Message)}",
+            sort_field="receivedDateTime",
+        )
+
+    async def sync_calendar(self) -> SyncResult:
+        # A calendarView delta link keeps the range it was started with, so
+        # once the day's window has moved on a new full round replaces it.
+        start, end = calendar_window()
+        bounds = f"{start}/{end}"
+        synced_bounds = await asyncio.to_thread(self.store.get_bounds, self.owner, CALENDAR)
+        return await self._sync(
+            CALENDAR,
+            f"/me/calendarView/delta?startDateTime={start}&endDateTime={end}",
+            sort_field="start.dateTime",
+            restart=synced_bounds != bounds,
+            bounds=bounds,
+        )
+
+    async def has_synced(self, resource: str) -> bool:
+        """Whether a first full round has been stored for `resource`."""
+        delta_link = await asyncio.to_thread(self.store.get_delta_link, self.owner, resource)
+        return delta_link is not None
+
+    async def sync_age(self, resource: str) -> Optional[float]:
+        """Seconds since the last round of `resource` was stored, or None before the first one."""
+        updated_at = await asyncio.to_thread(self.store.get_updated_at, self.owner, resource)
+        if updated_at is None:
+            return None
+        return (datetime.now(timezone.utc) - updated_at).total_seconds()
+
+    async def background_sync(self, resource: str,
+                              run: Callable[[], Awaitable[SyncResult]]) -> None:
+        """
+        Runs a round of `resource` as background work; a round already
+        running for the same user and resource is not started twice.
+        """
+        key = (self.owner, resource)
+        if key in _background_syncs:
+            return
+        _background_syncs.add(key)
+        try:
+            await run()
+        except GraphAPIException as e:
+            logger.error(f"Background sync of {resource} failed: {e.message}")
+        finally:
+            _background_syncs.discard(key)
+
+    async def get_messages(self, top: int = 10, folder: str = "inbox") -> List[Message]:
+        items = await asyncio.to_thread(
+            self.store.list_items, self.owner, f"{MAIL}:{folder}", top, True)
+        return validate_page(Message, items)
+
+    async def search_messages(self, query: str = "", sender: Optional[str] = None,
+                              since: Optional[datetime] = None, until: Optional[datetime] = None,
+                              top: int = 25) -> List[MailSearchHit]:
+        return await asyncio.to_thread(self.search_index.search, self.owner, query,
+                                       sender, since, until, top)
+
+    async def get_events(self, top: int = 10) -> List[Event]:
+        items = await asyncio.to_thread(self.store.list_items, self.owner, CALENDAR, top)
+        return validate_page(Event, items)
+
+    async def _sync(self, resource: str, initial_endpoint: str, sort_field: str,
+                    restart: bool = False, bounds: Optional[str] = None) -> SyncResult:
+        delta_link = None
+        if not restart:
+            delta_link = await asyncio.to_thread(self.store.get_delta_link, self.owner, resource)
+        result = SyncResult(resource=resource, full_resync=delta_link is None)
+        try:
+            upserts, removed, delta_link = await self._run_round(delta_link or initial_endpoint)
+        except GraphAPIException as e:
+            if e.status_code != 410 or result.full_resync:
+                raise
+            # The delta token expired; start over with a full round.
+            logger.warning(f"Delta token for {resource} expired, running a full sync")
+            result.full_resync = True
+            upserts, removed, delta_link = await self._run_round(initial_endpoint)
+
+        await asyncio.to_thread(
+            self.store.apply_round, self.owner, resource, upserts, removed,
+            delta_link, sort_field, result.full_resync, bounds,
+        )
+        if self.search_index is not None and resource.startswith(f"{MAIL}:"):
+            await asyncio.to_thread(
+                self.search_index.apply_round, self.owner, resource.split(":", 1)[1],
+                upserts, removed, result.full_resync,
+            )
+        result.upserted = len(upserts)
+        result.removed = len(removed)
+        return result
+
+    async def _run_round(self, endpoint: str):
+        upserts: List[Dict] = []
+        removed: List[str] = []
+        while True:
+            page = await self.client.get(endpoint)
+            for item in page.get("value", []):
+                if "@removed" in item:
+                    removed.append(item["id"])
+                else:
+                    upserts.append(item)
+            if "@odata.nextLink" in page:
+                endpoint = page["@odata.nextLink"]
+            else:
+                return upserts, removed, page["@odata.deltaLink"]
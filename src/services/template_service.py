@@ -0,0 +1,197 @@
+import html
+import keyword
+import re
+import string
+from operator import methodcaller
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+from src.core.cache import LRUCache
+from src.core.exceptions import TemplateException
+from src.models.mail import SendMessageRequest
+from src.models.validation import validate_page
+
+_formatter = string.Formatter()
+_MISSING = object()
+# Plain spec characters only: a nested "{field}" in a spec is not supported.
+_SPEC = re.compile(r"^[\w .,<>=^+\-#%:/]*$")
+
+
+class RenderedMessage(NamedTuple):
+    subject: str
+    body: str
+    content_type: str
+
+
+class CompiledText:
+    """
+    A `str.format`-style text such as "Hola {nombre}" or "${monto:.2f}",
+    split once into literal chunks and the fields between them.
+    """
+
+    def __init__(self, text: str):
+        self.chunks: List[Tuple[str, Optional[str], str]] = []
+        try:
+            for literal, field, spec, conversion in _formatter.parse(text):
+                if field is not None and (not field.isidentifier() or keyword.iskeyword(field)
+                                          or conversion or not _SPEC.match(spec or "")):
+                    raise TemplateException(f"Unsupported template field: {{{field}}}")
+                self.chunks.append((literal, field, spec or ""))
+        except ValueError as e:
+            raise TemplateException(f"Invalid template: {e}")
+        self.names = tuple(dict.fromkeys(field for _, field, _ in self.chunks if field))
+
+    def parts(self, params: Dict[str, type], escape: bool) -> List[Tuple[str, Optional[Callable]]]:
+        """
+        (literal, None) and (field, formatter) pairs, with each field's
+        formatter picked for its declared type, spec and escaping.
+        """
+        parts: List[Tuple[str, Optional[Callable]]] = []
+        for literal, field, spec in self.chunks:
+            if literal:
+                parts.append((literal, None))
+            if field is not None:
+                parts.append((field, _formatter_for(params[field], spec, escape)))
+        return parts
+
+
+def _formatter_for(kind: type, spec: str, escape: bool) -> Callable[[Any], str]:
+    if not escape or kind in (int, float):
+        # Numbers format to digits and signs only; nothing to escape.
+        return methodcaller("__format__", spec) if spec else str
+    if kind is str and not spec:
+        return html.escape
+    return lambda value: html.escape(format(value, spec))
+
+
+def _fill(parts: List[Tuple[str, Optional[Callable]]], values: Dict[str, Any]) -> str:
+    if len(parts) == 1 and parts[0][1] is None:
+        return parts[0][0]
+    return "".join([text if fn is None else fn(values[text]) for text, fn in parts])
+
+
+class CompiledTemplate:
+    """
+    A notification template split into literal text and fields once, at
+    registration. Parameters are typed: values are coerced to the declared
+    type (so "15" renders with "{x:.2f}" as a float would) and missing ones
+    fall back to their defaults. HTML bodies escape every value.
+    """
+
+    def __init__(self, name: str, subject: str, body: str,
+                 params: Optional[Dict[str, type]] = None,
+                 defaults: Optional[Dict[str, Any]] = None,
+                 content_type: str = "HTML", cache_size: int = 1024):
+        self.name = name
+        self.content_type = content_type
+        self.defaults = defaults or {}
+        subject_text, body_text = CompiledText(subject), CompiledText(body)
+        used = dict.fromkeys(subject_text.names + body_text.names)
+        if params is None:
+            params = {field: object for field in used}
+        undeclared = [field for field in used if field not in params]
+        if undeclared:
+            raise TemplateException(
+                f"Template {name!r} uses undeclared parameters: {', '.join(undeclared)}")
+        self.params = params
+        self._names = tuple(params)
+        self._subject = subject_text.parts(params, escape=False)
+        self._body = body_text.parts(params, escape=content_type.upper() == "HTML")
+        self._cache = LRUCache(max_entries=cache_size, ttl=float("inf")) if cache_size else None
+
+    def _render(self, values: Dict[str, Any]) -> RenderedMessage:
+        resolved = values
+        for name, kind in self.params.items():
+            value = values.get(name)
+            if value is None:
+                value = self._default(name)
+            elif kind is object or value.__class__ is kind:
+                continue
+            if kind is not object:
+                value = self._coerce(name, kind, value)
+            if resolved is values:
+                # Copied only when a value is filled in or coerced.
+                resolved = dict(values)
+            resolved[name] = value
+        return RenderedMessage(_fill(self._subject, resolved), _fill(self._body, resolved),
+                               self.content_type)
+
+    def _default(self, name: str) -> Any:
+        value = self.defaults.get(name, _MISSING)
+        if value is _MISSING or value is None:
+            raise TemplateException(f"Template {self.name!r} is missing {name!r}")
+        return value
+
+    def _coerce(self, name: str, kind: type, value: Any) -> Any:
+        if isinstance(value, kind):
+            return value
+        try:
+            return kind(value)
+        except (TypeError, ValueError):
+            raise TemplateException(
+                f"Template {self.name!r}: {name!r} must be {kind.__name__}, got {value!r}")
+
+    def render(self, values: Dict[str, Any]) -> RenderedMessage:
+        if self._cache is None:
+            return self._render(values)
+        try:
+            # Typed, so 1, 1.0 and True do not share an entry for an untyped param.
+            key = tuple((value.__class__, value) for value in map(values.get, self._names))
+            entry = self._cache.get(key)
+        except TypeError:  # unhashable value, render without the cache
+            return self._render(values)
+        if entry is not None:
+            return entry.value
+        rendered = self._render(values)
+        self._cache.set(key, rendered)
+        return rendered
+
+    def cache_stats(self) -> Dict[str, int]:
+        return self._cache.stats() if self._cache is not None else {}
+
+
+Recipients = Union[str, Sequence[str]]
+
+
+class TemplateRegistry:
+    """Named templates, compiled once and rendered many times."""
+
+    def __init__(self, cache_size: int = 1024):
+        self.cache_size = cache_size
+        self._templates: Dict[str, CompiledTemplate] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._templates
+
+    def register(self, name: str, subject: str, body: str,
+                 params: Optional[Dict[str, type]] = None,
+                 defaults: Optional[Dict[str, Any]] = None,
+                 content_type: str = "HTML") -> CompiledTemplate:
+        template = CompiledTemplate(name, subject, body, params=params, defaults=defaults,
+                                    content_type=content_type, cache_size=self.cache_size)
+        self._templates[name] = template
+        return template
+
+    def get(self, name: str) -> CompiledTemplate:
+        try:
+            return self._templates[name]
+        except KeyError:
+            raise TemplateException(f"Unknown template: {name!r}")
+
+    def render(self, name: str, values: Dict[str, Any]) -> RenderedMessage:
+        return self.get(name).render(values)
+
+    def render_batch(self, name: str,
+                     recipients: Iterable[Tuple[Recipients, Dict[str, Any]]],
+                     validate_recipients: bool = False) -> List[SendMessageRequest]:
+        """
+        Renders one message per (recipients, values) pair, ready for the bulk
+        send queue. Addresses are only checked locally with
+        validate_recipients=True, as EmailStr checks cost many times the
+        rendering; otherwise Graph rejects bad ones per message.
+        """
+        template = self.get(name)
+        messages = []
+        for to, values in recipients:
+            subject, body, content_type = template.render(values)
+            messages.append({"to": [to] if isinstance(to, str) else list(to),
+                             "subject": subject, "body": body, "content_type": content_type})
+        return validate_page(SendMessageRequest, messages, trusted=not validate_recipients)
@@ -1,10 +1,12 @@
 from src.core.graph_client import GraphClient
 from src.models.user import UserProfile
+from src.models.projection import select_query
+from src.models.validation import validate_item
 
 class UserService:
     def __init__(self, client: GraphClient):
         self.client = client
 
     async def get_me(self) -> UserProfile:
-        data = await self.client.get("/me")
-        return UserProfile(**data)
+        data = await self.client.get(f"/me?{select_query(UserProfile)}")
+        return validate_item(UserProfile, data)
@@ -1,6 +1,9 @@
+import asyncio
+import time
 import pytest
+import pytest_asyncio
 from fastapi.testclient import TestClient
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock
 from src.main import app
 from src.api.deps import get_access_token, get_auth_service
 
@@ -8,7 +11,13 @@ from src.api.deps import get_access_token, get_auth_service
 def mock_auth_service():
     mock = MagicMock()
     mock.get_auth_url.return_value = "http://mock-auth-url"
-    mock.acquire_token_by_code.return_value = {"access_token": "mock_token"}
+    mock.acquire_token_by_code_async = AsyncMock(return_value={
+        "access_token": "mock_token",
+        "expires_in": 3600,
+        "id_token_claims": {"oid": "user-oid", "tid": "tenant-id"},
+    })
+    mock.acquire_token_silent_async = AsyncMock(return_value=None)
+    mock.remove_account_async = AsyncMock()
     return mock
 
 @pytest.fixture
@@ -23,3 +32,64 @@ def client(mock_auth_service):
         yield c
     app.dependency_overrides = {}
     print("DEBUG: Overrides cleared")
+
+
+class RedisStandIn:
+    """Minimal RESP server (GET/SET EX/DEL/AUTH/SELECT/PING) for session store tests."""
+
+    def __init__(self):
+        self.data = {}
+        # key -> seconds to wait before answering a GET of it
+        self.delays = {}
+        self.commands = []
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                header = await reader.readline()
+                if not header:
+                    break
+                args = []
+                for _ in range(int(header[1:-2])):
+                    length = int((await reader.readline())[1:-2])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                command = args[0].decode().upper()
+                self.commands.append(command)
+                if command == "SET":
+                    ttl = int(args[4]) if len(args) > 4 else None
+                    self.data[args[1]] = (args[2], time.monotonic() + ttl if ttl else None)
+                    writer.write(b"+OK\r\n")
+                elif command == "GET":
+                    await asyncio.sleep(self.delays.get(args[1], 0))
+                    value, expires = self.data.get(args[1], (None, None))
+                    if value is None or (expires and expires < time.monotonic()):
+                        writer.write(b"$-1\r\n")
+                    else:
+                        writer.write(b"$%d\r\n%s\r\n" % (len(value), value))
+                elif command == "DEL":
+                    writer.write(b":%d\r\n" % int(self.data.pop(args[1], None) is not None))
+                elif command in ("AUTH", "SELECT", "PING"):
+                    writer.write(b"+OK\r\n")
+                else:
+                    writer.write(b"-ERR unknown command\r\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+@pytest_asyncio.fixture
+async def redis_standin():
+    server = RedisStandIn()
+    await server.start()
+    yield server
+    await server.stop()
@@ -23,3 +23,28 @@ def test_get_emails(mock_get_messages, client):
     response = client.get("/api/v1/mail/")
     assert response.status_code == 200
     assert response.json() == []
+
+@patch("src.services.mail_service.MailService.get_messages")
+def test_get_emails_serializes_validated_models(mock_get_messages, client):
+    from src.models.mail import Message
+
+    mock_get_messages.return_value = [
+        Message(**{"id": "1", "subject": "Hi", "from": {"emailAddress": {"address": "a@example.com"}}}),
+    ]
+    with patch("src.models.mail.Message.model_validate") as revalidate:
+        response = client.get("/api/v1/mail/?top=1")
+        revalidate.assert_not_called()
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body[0]["from"]["emailAddress"]["address"] == "a@example.com"
+    assert "from_" not in body[0]
+
+def test_fast_json_helpers():
+    from src.core import fastjson
+    from src.api.responses import FastJSONResponse, models_response
+
+    assert fastjson.loads(b'{"a": [1, 2]}') == {"a": [1, 2]}
+    assert fastjson.dumps({1: "non-str key"}) == b'{"1":"non-str key"}'
+    assert FastJSONResponse({"ok": True}).body == b'{"ok":true}'
+    assert models_response([{"raw": "dict"}]) == [{"raw": "dict"}]
@@ -72,3 +72,722 @@ class TestGraphClient:
             result = await client.post("/endpoint", data={"data": "test"})
             assert result == {"id": "123"}
             mock_client_instance.request.assert_called()
+
+    @pytest.mark.asyncio
+    async def test_uses_shared_http_client(self):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"key": "value"}
+        mock_response.headers = {"Content-Type": "application/json"}
+        mock_response.raise_for_status = Mock()
+
+        shared = MagicMock()
+        shared.request = AsyncMock(return_value=mock_response)
+        client = GraphClient("test_token", http_client=shared)
+
+        with patch("httpx.AsyncClient") as mock_async_client:
+            result = await client.get("/endpoint")
+            mock_async_client.assert_not_called()
+
+        assert result == {"key": "value"}
+        headers = shared.request.call_args.kwargs["headers"]
+        assert headers["Authorization"] == "Bearer test_token"
+
+
+class TestHTTPPool:
+    @pytest.mark.asyncio
+    async def test_lifecycle_and_stats(self):
+        from src.core import http_pool
+
+        assert http_pool.pool_stats()["open"] == 0
+        shared = await http_pool.init_http_client()
+        try:
+            assert http_pool.get_http_client() is shared
+            assert await http_pool.init_http_client() is shared
+            stats = http_pool.pool_stats()
+            assert stats["open"] == 1
+            assert stats["connections"] == 0
+        finally:
+            await http_pool.close_http_client()
+        assert http_pool.get_http_client() is None
+
+    @pytest.mark.asyncio
+    async def test_stats_survive_unknown_pool_internals(self):
+        from src.core import http_pool
+
+        http_pool._http_client = httpx.AsyncClient(transport=httpx.MockTransport(lambda r: None))
+        try:
+            assert http_pool.pool_stats() == {"open": 1, "connections": 0, "idle": 0, "active": 0,
+                                              "http2": 0, "pending_requests": 0}
+        finally:
+            await http_pool.close_http_client()
+
+    @pytest.mark.asyncio
+    async def test_lifespan_closes_pool_when_shutdown_fails(self):
+        from unittest.mock import patch
+        from src.core import http_pool
+        from src.main import app, lifespan
+
+        with patch("src.main.close_session_store", side_effect=RuntimeError("redis down")):
+            with pytest.raises(RuntimeError):
+                async with lifespan(app):
+                    assert http_pool.get_http_client() is not None
+        assert http_pool.get_http_client() is None
+
+    def test_app_lifespan_opens_pool(self, client):
+        from src.core.http_pool import get_http_client
+
+        assert get_http_client() is not None
+
+
+def _mock_http_client(handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+class TestBatching:
+    def test_build_and_parse(self):
+        from src.core.batch import BatchRequest, build_batch_payload, parse_batch_response
+
+        payload = build_batch_payload([
+            BatchRequest("GET", "/me"),
+            BatchRequest("POST", "/me/events", body={"subject": "x"}),
+        ])
+        assert payload["requests"][0] == {"id": "0", "method": "GET", "url": "/me"}
+        assert payload["requests"][1]["headers"]["Content-Type"] == "application/json"
+
+        results = parse_batch_response({"responses": [
+            {"id": "1", "status": 404, "body": {"error": {"message": "gone"}}},
+            {"id": "0", "status": 204},
+        ]}, 3)
+        assert results[0] is None
+        assert isinstance(results[1], GraphAPIException)
+        assert results[1].status_code == 404
+        assert results[2].status_code == 502
+
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_are_coalesced(self):
+        import asyncio
+        import json
+
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            body = json.loads(request.content)
+            responses = []
+            for item in body["requests"]:
+                if item["url"].startswith("/missing"):
+                    responses.append({"id": item["id"], "status": 404,
+                                      "body": {"error": {"message": "not found"}}})
+                else:
+                    responses.append({"id": item["id"], "status": 200,
+                                      "body": {"url": item["url"]}})
+            return httpx.Response(200, json={"responses": responses})
+
+        async with _mock_http_client(handler) as http:
+            client = GraphClient("token", http_client=http, batching=True)
+            results = await asyncio.gather(
+                client.get("/me"),
+                client.get("/me/messages", params={"$top": 5}),
+                client.get("/missing"),
+                return_exceptions=True,
+            )
+
+        assert len(calls) == 1
+        assert calls[0].url.path.endswith("/$batch")
+        assert results[0] == {"url": "/me"}
+        assert results[1] == {"url": "/me/messages?%24top=5"}
+        assert isinstance(results[2], GraphAPIException)
+        assert results[2].status_code == 404
+
+    @pytest.mark.asyncio
+    async def test_single_call_skips_envelope(self):
+        def handler(request):
+            assert request.url.path.endswith("/me")
+            return httpx.Response(200, json={"id": "1"})
+
+        async with _mock_http_client(handler) as http:
+            client = GraphClient("token", http_client=http, batching=True)
+            assert await client.get("/me") == {"id": "1"}
+
+    @pytest.mark.asyncio
+    async def test_batch_splits_into_groups_of_twenty(self):
+        import json
+        from src.core.batch import BatchRequest
+
+        sizes = []
+
+        def handler(request):
+            items = json.loads(request.content)["requests"]
+            sizes.append(len(items))
+            return httpx.Response(200, json={"responses": [
+                {"id": item["id"], "status": 201, "body": {"n": item["url"]}}
+                for item in items
+            ]})
+
+        async with _mock_http_client(handler) as http:
+            client = GraphClient("token", http_client=http)
+            results = await client.batch(
+                [BatchRequest("POST", f"/me/events/{i}", body={}) for i in range(45)]
+            )
+
+        assert sorted(sizes) == [5, 20, 20]
+        assert [r["n"] for r in results] == [f"/me/events/{i}" for i in range(45)]
+
+
+class TestRetry:
+    def test_parse_retry_after(self):
+        from src.core.retry import parse_retry_after
+
+        assert parse_retry_after("3") == 3.0
+        assert parse_retry_after(None) is None
+        assert parse_retry_after("garbage") is None
+        assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+    def test_policy_gives_up_on_attempts_and_budget(self):
+        import time
+        from src.core.retry import RetryPolicy
+
+        policy = RetryPolicy(max_attempts=3, base_delay=1, max_delay=4)
+        deadline = time.monotonic() + 100
+        assert 0 <= policy.next_delay(0, deadline) <= 1
+        assert policy.next_delay(1, deadline, "7") == 7.0
+        assert policy.next_delay(2, deadline) is None
+        assert policy.next_delay(0, time.monotonic() + 1, "5") is None
+
+    @pytest.mark.asyncio
+    async def test_get_honors_retry_after(self):
+        from src.core.metrics import graph_retries
+        from src.core.retry import RetryPolicy
+
+        responses = [
+            httpx.Response(429, headers={"Retry-After": "0"}, json={}),
+            httpx.Response(503, json={}),
+            httpx.Response(200, json={"ok": True}),
+        ]
+
+        def handler(request):
+            return responses.pop(0)
+
+        retries = lambda: [graph_retries.value(("GET", "/me/retry-test", reason)) for reason in ("429", "503")]
+        before = retries()
+        async with _mock_http_client(handler) as http:
+            client = GraphClient("token", http_client=http,
+                                 retry_policy=RetryPolicy(base_delay=0))
+            assert await client.get("/me/retry-test") == {"ok": True}
+        assert [b - a for a, b in zip(before, retries())] == [1, 1]
+
+    @pytest.mark.asyncio
+    async def test_post_does_not_retry_unless_opted_in(self):
+        from src.core.retry import RetryPolicy
+
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            if len(calls) in (1, 2):
+                return httpx.Response(429, headers={"Retry-After": "0"}, json={})
+            return httpx.Response(201, json={"id": "1"})
+
+        async with _mock_http_client(handler) as http:
+            client = GraphClient("token", http_client=http,
+                                 retry_policy=RetryPolicy(base_delay=0))
+            with pytest.raises(GraphAPIException) as excinfo:
+                await client.post("/me/events", data={})
+            assert excinfo.value.status_code == 429
+
+            assert await client.post("/me/events", data={}, retry=True) == {"id": "1"}
+        assert len(calls) == 3
+
+    @pytest.mark.asyncio
+    async def test_network_errors_retry_then_raise(self):
+        from src.core.retry import RetryPolicy
+
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            raise httpx.ConnectError("boom", request=request)
+
+        async with _mock_http_client(handler) as http:
+            client = GraphClient("token", http_client=http,
+                                 retry_policy=RetryPolicy(max_attempts=3, base_delay=0))
+            with pytest.raises(GraphAPIException) as excinfo:
+                await client.delete("/me/events/1")
+        assert excinfo.value.status_code == 503
+        assert len(calls) == 3
+
+
+class TestPagination:
+    @pytest.mark.asyncio
+    async def test_paginate_follows_next_link(self):
+        base = "https://graph.microsoft.com/v1.0"
+        pages = {
+            "/v1.0/me/messages": {"value": [{"id": "1"}, {"id": "2"}],
+                                  "@odata.nextLink": f"{base}/me/messages?$skip=2"},
+            "/v1.0/me/messages?$skip=2": {"value": [{"id": "3"}]},
+        }
+        seen = []
+
+        def handler(request):
+            seen.append(request)
+            key = request.url.raw_path.decode().replace("%24", "$")
+            return httpx.Response(200, json=pages[key])
+
+        async with _mock_http_client(handler) as http:
+            client = GraphClient("token", http_client=http)
+            items = [item["id"] async for item in client.paginate("/me/messages")]
+
+        assert items == ["1", "2", "3"]
+        assert all(r.headers["Authorization"] == "Bearer token" for r in seen)
+
+    @pytest.mark.asyncio
+    async def test_paginate_without_prefetch_stops_early(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json={
+                "value": [{"id": str(len(calls))}],
+                "@odata.nextLink": "https://graph.microsoft.com/v1.0/me/events?page=next",
+            })
+
+        async with _mock_http_client(handler) as http:
+            client = GraphClient("token", http_client=http)
+            pages = client.paginate("/me/events", prefetch=False)
+            assert (await pages.__anext__())["id"] == "1"
+            await pages.aclose()
+
+        assert len(calls) == 1
+
+
+class TestResponseCache:
+    def test_lru_eviction_and_byte_budget(self):
+        from src.core.cache import LRUCache
+
+        cache = LRUCache(max_entries=2, ttl=60, max_bytes=100)
+        cache.set("a", 1, size=10)
+        cache.set("b", 2, size=10)
+        cache.get("a")
+        cache.set("c", 3, size=10)
+        assert cache.get("b") is None
+        assert cache.get("a").value == 1
+        cache.set("d", 4, size=95)
+        assert len(cache) == 1 and cache.bytes == 95
+        assert cache.set("huge", 5, size=101) is None
+        stats = cache.stats()
+        assert stats["evictions"] == 3
+        assert stats["misses"] == 1 and stats["hits"] == 2
+
+    @pytest.fixture
+    def response_cache(self):
+        from src.core.cache import ResponseCache
+
+        cache = ResponseCache(max_entries=10, ttl=60, max_bytes=10_000)
+        with patch("src.core.cache._response_cache", cache):
+            yield cache
+
+    @pytest.mark.asyncio
+    async def test_fresh_hit_then_etag_revalidation(self, response_cache):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            if request.headers.get("If-None-Match") == '"v1"':
+                return httpx.Response(304)
+            return httpx.Response(200, json={"id": "me"}, headers={"ETag": '"v1"'})
+
+        async with _mock_http_client(handler) as http:
+            client = GraphClient("token", http_client=http, cache=True)
+            assert await client.get("/me") == {"id": "me"}
+            assert await client.get("/me") == {"id": "me"}
+            assert len(calls) == 1
+
+            response_cache.touch(("GET", "https://graph.microsoft.com/v1.0/me", client.subject), ttl=-1)
+            assert await client.get("/me") == {"id": "me"}
+
+            other_user = GraphClient("other", http_client=http, cache=True)
+            await other_user.get("/me")
+
+        assert len(calls) == 3
+        assert calls[1].headers["If-None-Match"] == '"v1"'
+        assert response_cache.not_modified == 1
+        assert response_cache.stats()["hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_stale_while_revalidate_and_invalidation(self, response_cache):
+        import asyncio
+
+        response_cache.stale_while_revalidate = 60
+        version = {"n": 1}
+
+        def handler(request):
+            if request.method == "PATCH":
+                return httpx.Response(200, json={})
+            return httpx.Response(200, json={"n": version["n"]},
+                                  headers={"ETag": f'"{version["n"]}"'})
+
+        async with _mock_http_client(handler) as http:
+            client = GraphClient("token", http_client=http, cache=True)
+            assert await client.get("/me/messages/1") == {"n": 1}
+
+            version["n"] = 2
+            key = client._cache_key("/me/messages/1", None)
+            response_cache.touch(key, ttl=-1)
+            assert await client.get("/me/messages/1") == {"n": 1}
+            await asyncio.sleep(0.01)
+            assert await client.get("/me/messages/1") == {"n": 2}
+
+            assert await client.get("/me/messages", params={"$top": 10}) == {"n": 2}
+            assert await client.get("/me/drive/root/children") == {"n": 2}
+            version["n"] = 3
+            await client.request("PATCH", "/me/messages/1", json={"isRead": True})
+            assert await client.get("/me/messages/1") == {"n": 3}
+            # The collection is stale too; other resources stay cached.
+            assert await client.get("/me/messages", params={"$top": 10}) == {"n": 3}
+            assert await client.get("/me/drive/root/children") == {"n": 2}
+            assert await client.get("/me/messages/1", cache=False) == {"n": 3}
+            await client.get("/me/drive/items/1/content")
+
+        assert len(response_cache) == 3
+
+    @pytest.mark.asyncio
+    async def test_cached_values_are_copies(self, response_cache):
+        def handler(request):
+            return httpx.Response(200, json={"value": [{"id": "1"}]})
+
+        async with _mock_http_client(handler) as http:
+            client = GraphClient("token", http_client=http, cache=True, single_flight=False)
+            first = await client.get("/me/messages")
+            first["value"].clear()
+            second = await client.get("/me/messages")
+            second["value"].append({"id": "x"})
+            assert await client.get("/me/messages") == {"value": [{"id": "1"}]}
+
+
+class TestSingleFlight:
+    @pytest.mark.asyncio
+    async def test_identical_gets_share_one_call(self):
+        import asyncio
+
+        calls = []
+        release = asyncio.Event()
+
+        async def handler(request):
+            calls.append(request)
+            await release.wait()
+            if request.url.path.endswith("/broken"):
+                return httpx.Response(500, json={"error": {"message": "boom"}})
+            return httpx.Response(200, json={"path": request.url.path})
+
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            a = GraphClient("token", http_client=http)
+            b = GraphClient("token", http_client=http)
+            other = GraphClient("other-token", http_client=http)
+            tasks = [asyncio.ensure_future(c.get(path)) for c, path in [
+                (a, "/me"), (b, "/me"), (other, "/me"), (a, "/broken"), (b, "/broken"),
+            ]]
+            await asyncio.sleep(0.01)
+            release.set()
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        assert len(calls) == 3
+        assert results[0] == results[1] == results[2] == {"path": "/v1.0/me"}
+        assert isinstance(results[3], GraphAPIException)
+        assert results[3] is results[4]
+
+    @pytest.mark.asyncio
+    async def test_shared_result_is_copied_per_caller(self):
+        import asyncio
+
+        release = asyncio.Event()
+
+        async def handler(request):
+            await release.wait()
+            return httpx.Response(200, json={"value": [{"id": "m1"}]})
+
+        async def get_and_mutate(client):
+            result = await client.get("/me/messages")
+            result["value"].append({"id": "added"})
+            return result
+
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            client = GraphClient("token", http_client=http, cache=False)
+            mutating = asyncio.ensure_future(get_and_mutate(client))
+            reading = asyncio.ensure_future(client.get("/me/messages"))
+            await asyncio.sleep(0.01)
+            release.set()
+            mutated, read = await asyncio.gather(mutating, reading)
+
+        assert mutated["value"] == [{"id": "m1"}, {"id": "added"}]
+        assert read == {"value": [{"id": "m1"}]}
+
+    @pytest.mark.asyncio
+    async def test_cancelled_follower_does_not_cancel_leader(self):
+        import asyncio
+        from src.core.singleflight import SingleFlight
+
+        flights = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return 42
+
+        leader = asyncio.ensure_future(flights.do("k", work))
+        follower = asyncio.ensure_future(flights.do("k", work))
+        await asyncio.sleep(0)
+        follower.cancel()
+        release.set()
+        assert await leader == 42
+        assert flights.stats() == {"in_flight": 0, "leaders": 1, "shared": 1}
+
+
+class TestSessionStore:
+    @pytest.mark.asyncio
+    async def test_memory_store_ttl_and_lru(self):
+        import time
+        from src.core.session_store import MemorySessionStore
+
+        store = MemorySessionStore(ttl=60, max_entries=2)
+        await store.set("a", {"access_token": "1"})
+        await store.set("b", {"access_token": "2"})
+        assert (await store.get("a"))["access_token"] == "1"
+        await store.set("c", {"access_token": "3"})
+        assert await store.get("b") is None
+        assert len(store) == 2
+
+        await store.set("short", {"access_token": "4"}, ttl=1)
+        store._entries["short"] = (time.monotonic() - 1, store._entries["short"][1])
+        assert store.purge_expired() == 1
+        await store.delete("a")
+        assert await store.get("a") is None
+
+    @pytest.mark.asyncio
+    async def test_redis_store_against_standin(self, redis_standin):
+        from src.core.session_store import RedisSessionStore
+
+        url = f"redis://:secret@127.0.0.1:{redis_standin.port}/2"
+        writer = RedisSessionStore(url, ttl=60, local_ttl=0)
+        reader = RedisSessionStore(url, ttl=60, local_ttl=30)
+        try:
+            await writer.set("s1", {"access_token": "tok"})
+            assert await reader.get("s1") == {"access_token": "tok"}
+            gets = redis_standin.commands.count("GET")
+            assert await reader.get("s1") == {"access_token": "tok"}
+            assert redis_standin.commands.count("GET") == gets
+
+            await writer.delete("s1")
+            assert await writer.get("s1") is None
+            assert await reader.get("missing") is None
+            assert {"AUTH", "SELECT"} <= set(redis_standin.commands)
+        finally:
+            await writer.close()
+            await reader.close()
+
+    @pytest.mark.asyncio
+    async def test_redis_store_drops_interrupted_connections(self, redis_standin):
+        import asyncio
+        from src.core.session_store import RedisProtocolError, RedisSessionStore
+
+        url = f"redis://127.0.0.1:{redis_standin.port}"
+        store = RedisSessionStore(url, ttl=60, pool_size=1, local_ttl=0, timeout=0.05)
+        try:
+            await store.set("slow", {"access_token": "someone-else"})
+            await store.set("mine", {"access_token": "mine"})
+            redis_standin.delays[b"session:slow"] = 0.2
+            with pytest.raises(asyncio.TimeoutError):
+                await store.get("slow")
+            task = asyncio.ensure_future(store.get("slow"))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            # The late replies to the interrupted GETs are never read as this one's.
+            assert await store.get("mine") == {"access_token": "mine"}
+
+            with pytest.raises(RedisProtocolError):
+                await store._execute("FLUSHALL")
+            assert len(store._connections) == 1
+            assert await store.get("mine") == {"access_token": "mine"}
+        finally:
+            await store.close()
+
+    def test_backend_selection(self):
+        from src.core.exceptions import ConfigurationException
+        from src.core.session_store import (
+            MemorySessionStore, RedisSessionStore, create_session_store,
+        )
+
+        assert isinstance(create_session_store(), MemorySessionStore)
+        with patch("src.core.session_store.settings.SESSION_BACKEND", "redis"):
+            assert isinstance(create_session_store(), RedisSessionStore)
+        with patch("src.core.session_store.settings.SESSION_BACKEND", "memcached"):
+            with pytest.raises(ConfigurationException):
+                create_session_store()
+        with pytest.raises(ConfigurationException):
+            RedisSessionStore("http://localhost")
+
+
+class TestRateLimit:
+    @pytest.mark.asyncio
+    async def test_token_bucket_waits_for_refill(self):
+        import time
+        from src.core.rate_limit import TokenBucket
+
+        bucket = TokenBucket(rate=100, capacity=5)
+        started = time.monotonic()
+        await bucket.acquire(5)
+        assert time.monotonic() - started < 0.01
+        assert not bucket.try_acquire()
+
+        await bucket.acquire(2)
+        assert time.monotonic() - started >= 0.015
+        with pytest.raises(ValueError):
+            await bucket.acquire(6)
+
+    @pytest.mark.asyncio
+    async def test_pause_holds_back_waiters(self):
+        import time
+        from src.core.rate_limit import TokenBucket
+
+        bucket = TokenBucket(rate=100, capacity=10)
+        bucket.pause(0.05)
+        started = time.monotonic()
+        await bucket.acquire(1)
+        assert time.monotonic() - started >= 0.05
+
+    def test_rate_limiter_keeps_one_bucket_per_key(self):
+        from src.core.rate_limit import RateLimiter
+
+        limiter = RateLimiter(rate=1, capacity=2, max_keys=2)
+        assert limiter.bucket("a") is limiter.bucket("a")
+        assert limiter.bucket("a") is not limiter.bucket("b")
+        limiter.bucket("c")
+        assert len(limiter) == 2
+        assert limiter.bucket("a").try_acquire(2)
+        assert not limiter.bucket("a").try_acquire(1)
+        assert limiter.bucket("b").try_acquire(2)
+
+
+class TestIntervals:
+    def test_merge_sorts_and_joins_overlaps(self):
+        from src.core.intervals import merge
+
+        assert merge([(5, 7), (1, 3), (2, 4), (4, 5), (9, 9), (10, 12)]) == [(1, 7), (10, 12)]
+        assert merge([(1, 10), (2, 3)]) == [(1, 10)]
+        assert merge([]) == []
+
+    def test_subtract_busy_from_windows(self):
+        from src.core.intervals import subtract
+
+        windows = [(0, 10), (20, 30)]
+        busy = [(2, 4), (8, 22), (25, 26)]
+        assert subtract(windows, busy) == [(0, 2), (4, 8), (22, 25), (26, 30)]
+        assert subtract(windows, []) == windows
+        assert subtract([(0, 5)], [(0, 5)]) == []
+
+    def test_slots_are_aligned_to_the_step(self):
+        from datetime import datetime, timedelta
+        from itertools import islice
+        from src.core.intervals import slots
+
+        free = [(datetime(2024, 3, 4, 9, 10), datetime(2024, 3, 4, 11, 0)),
+                (datetime(2024, 3, 4, 14, 0), datetime(2024, 3, 4, 14, 45))]
+        found = list(islice(slots(free, timedelta(minutes=45), timedelta(minutes=30)), 5))
+        assert [start.strftime("%H:%M") for start, _ in found] == ["09:30", "10:00", "14:00"]
+
+class TestQuickXorHash:
+    def _reference(self, data):
+        # Straight port of the published algorithm: byte i is XOR-ed in at
+        # bit (11 * i) % 160, then the length is XOR-ed into the last 8 bytes.
+        import base64
+        state = 0
+        for i, byte in enumerate(data):
+            shifted = byte << (11 * i % 160)
+            state ^= (shifted & ((1 << 160) - 1)) | (shifted >> 160)
+        out = bytearray(state.to_bytes(20, "little"))
+        for i, byte in enumerate(len(data).to_bytes(8, "little")):
+            out[12 + i] ^= byte
+        return base64.b64encode(bytes(out)).decode()
+
+    def test_matches_reference_across_chunk_boundaries(self):
+        import os
+        import random
+        from src.core.quickxor import QuickXorHash
+
+        assert QuickXorHash().b64digest() == "AAAAAAAAAAAAAAAAAAAAAAAAAAA="
+        for size in (1, 159, 160, 161, 4096, 20000):
+            data = os.urandom(size)
+            hasher, position = QuickXorHash(), 0
+            while position < size:
+                step = random.randint(1, 500)
+                hasher.update(data[position:position + step])
+                position += step
+            assert hasher.b64digest() == self._reference(data) == QuickXorHash(data).b64digest()
+
+    def test_file_hashes(self):
+        import hashlib
+        import io
+        from src.core.quickxor import QuickXorHash, file_hashes
+
+        data = b"quarterly report\n" * 1000
+        hashes = file_hashes(io.BytesIO(data), chunk_size=160 * 3)
+        assert hashes == {"quickXorHash": QuickXorHash(data).b64digest(),
+                          "sha1Hash": hashlib.sha1(data).hexdigest().upper()}
+
+
+class TestMetrics:
+    def test_histogram_and_counter_exposition(self):
+        from src.core.metrics import MetricsRegistry
+
+        registry = MetricsRegistry()
+        latency = registry.histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+        errors = registry.counter("errors_total", "Errors.", ("reason",))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            latency.observe(("/a",), value)
+        errors.inc(('say "hi"\n',))
+        registry.add_collector(lambda: [("pool_open", "gauge", "Open.", [({}, 1)])])
+
+        lines = registry.render().splitlines()
+        assert 'latency_seconds_bucket{route="/a",le="0.1"} 2' in lines
+        assert 'latency_seconds_bucket{route="/a",le="1.0"} 3' in lines
+        assert 'latency_seconds_bucket{route="/a",le="+Inf"} 4' in lines
+        assert 'latency_seconds_sum{route="/a"} 3.65' in lines
+        assert 'latency_seconds_count{route="/a"} 4' in lines
+        assert 'errors_total{reason="say \\"hi\\"\\n"} 1' in lines
+        assert "# TYPE pool_open gauge" in lines and "pool_open 1" in lines
+
+        errors.max_series = 1
+        errors.inc(("a",))
+        errors.inc(("b",))
+        assert errors.value(("other",)) == 2
+
+    def test_endpoint_template(self):
+        from src.core.metrics import endpoint_template
+
+        assert endpoint_template("/me/messages/AAMkAGI2TG93AAA=?$select=id") == "/me/messages/{id}"
+        assert endpoint_template("https://graph.microsoft.com/v1.0/me/messages?$skip=10") == "/me/messages"
+        assert endpoint_template("/me/drive/root:/Docs/a b.pdf:/content") == "/me/drive/root:{path}:/content"
+        assert endpoint_template("/me/mailFolders('inbox')/messages/delta") == "/me/mailFolders({key})/messages/delta"
+        assert endpoint_template("/users/ana@contoso.com/calendar/getSchedule") == "/users/{id}/calendar/getSchedule"
+        assert endpoint_template("https://contoso-my.sharepoint.com/up?tempauth=x") == "{external}"
+
+    @pytest.mark.asyncio
+    async def test_graph_client_records_latency_throttling_and_retries(self):
+        from src.core.metrics import graph_request_seconds, graph_retries, graph_throttled
+        from src.core.retry import RetryPolicy
+
+        responses = [httpx.Response(429, headers={"Retry-After": "0"}, json={}),
+                     httpx.Response(200, json={"ok": True})]
+        labels = ("GET", "/me/messages/{id}")
+        before = (graph_request_seconds.count(labels + ("429",)), graph_request_seconds.count(labels + ("200",)),
+                  graph_throttled.value(labels + ("429",)), graph_retries.value(labels + ("429",)))
+
+        async with _mock_http_client(lambda request: responses.pop(0)) as http:
+            client = GraphClient("token", http_client=http, retry_policy=RetryPolicy(base_delay=0))
+            await client.get("https://graph.microsoft.com/v1.0/me/messages/AAMkAD1=")
+
+        after = (graph_request_seconds.count(labels + ("429",)), graph_request_seconds.count(labels + ("200",)),
+                 graph_throttled.value(labels + ("429",)), graph_retries.value(labels + ("429",)))
+        assert [b - a for a, b in zip(before, after)] == [1, 1, 1, 1]
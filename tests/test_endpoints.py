@@ -1,3 +1,4 @@
+import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch
 from src.main import app
@@ -39,3 +40,352 @@ def test_get_user_profile(client):
         response = client.get("/api/v1/users/me")
         assert response.status_code == 200
         assert response.json()["displayName"] == "Test User"
+
+def test_download_streams_with_range(client):
+    import httpx
+    from src.core.graph_client import GraphStream
+
+    upstream = httpx.Response(206, content=b"partial", headers={
+        "Content-Type": "application/pdf",
+        "Content-Range": "bytes 0-6/100",
+        "Content-Length": "7",
+    })
+    with patch("src.services.drive_service.DriveService.open_download", new_callable=AsyncMock) as mock_open:
+        mock_open.return_value = GraphStream(upstream)
+
+        response = client.get("/api/v1/drive/files/abc/download", headers={"Range": "bytes=0-6"})
+
+    assert response.status_code == 206
+    assert response.content == b"partial"
+    assert response.headers["content-type"] == "application/pdf"
+    assert response.headers["content-range"] == "bytes 0-6/100"
+    mock_open.assert_called_with("abc", byte_range="bytes=0-6")
+
+def test_upload_large_file_uses_upload_session(client):
+    item = {"id": "f1", "name": "report.csv"}
+    with patch("src.api.v1.endpoints.drive.settings.DRIVE_SIMPLE_UPLOAD_LIMIT", 4), \
+            patch("src.services.drive_service.DriveService.upload_large_file", new_callable=AsyncMock) as mock_large:
+        mock_large.return_value = item
+
+        response = client.post("/api/v1/drive/files/upload", files={"file": ("report.csv", b"a,b,c\n1,2,3\n")})
+
+    assert response.status_code == 200
+    assert response.json()["id"] == "f1"
+    assert mock_large.call_args.args[0] == "report.csv"
+    assert mock_large.call_args.args[2] == 12
+
+def test_upload_large_file_skip_unchanged(client):
+    item = {"id": "f1", "name": "report.csv"}
+    with patch("src.api.v1.endpoints.drive.settings.DRIVE_SIMPLE_UPLOAD_LIMIT", 4), \
+            patch("src.services.drive_service.DriveService.upload_large_file_if_changed",
+                  new_callable=AsyncMock) as mock_if_changed:
+        mock_if_changed.return_value = (item, False)
+
+        response = client.post("/api/v1/drive/files/upload?skip_unchanged=true",
+                               files={"file": ("report.csv", b"a,b,c\n1,2,3\n")})
+
+    assert response.status_code == 200
+    assert response.json()["id"] == "f1"
+    assert mock_if_changed.call_args.args[2] == 12
+
+def test_stream_emails_ndjson(client):
+    import json
+    from src.models.mail import Message
+
+    async def fake_iter(self, page_size=50, summary=True):
+        for i in range(3):
+            yield Message(id=str(i), subject=f"s{i}")
+
+    with patch("src.services.mail_service.MailService.iter_messages", fake_iter):
+        response = client.get("/api/v1/mail/stream?limit=2")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines] == ["0", "1"]
+
+def test_get_emails_from_local_store(client, tmp_path):
+    from src.api.deps import get_mail_search_index, get_sync_store
+    from src.services.search_service import MailSearchIndex
+    from src.services.sync_service import SyncStore
+
+    store = SyncStore(str(tmp_path / "sync.db"))
+    app.dependency_overrides[get_sync_store] = lambda: store
+    app.dependency_overrides[get_mail_search_index] = lambda: MailSearchIndex(str(tmp_path / "search.db"))
+    delta = {"value": [{"id": "m1", "subject": "cached"}], "@odata.deltaLink": "d1"}
+    with patch("src.core.graph_client.GraphClient.get", new_callable=AsyncMock) as mock_get:
+        mock_get.return_value = delta
+        pending = client.get("/api/v1/mail/?local=true")
+        response = client.get("/api/v1/mail/?local=true")
+        fresh_calls = mock_get.call_count
+        with patch("src.api.v1.endpoints.mail.settings.SYNC_MAX_AGE_SECONDS", 0):
+            stale = client.get("/api/v1/mail/?local=true")
+        stale_calls = mock_get.call_count
+        sync_response = client.post("/api/v1/sync/mail")
+
+    # The first read only schedules the initial sync, which runs after the response.
+    assert pending.status_code == 202
+    assert pending.json() == {"status": "sync pending", "resource": "mail:inbox"}
+    # A fresh store is read without calling Graph; a stale one is still served
+    # from the store and refreshed in the background.
+    assert response.status_code == 200 and fresh_calls == 1
+    assert response.json()[0]["subject"] == "cached"
+    assert stale.json()[0]["subject"] == "cached" and stale_calls == 2
+    assert sync_response.json()["full_resync"] is False
+    assert mock_get.call_args_list[-1].args[0] == "d1"
+    store.close()
+
+def test_session_lifecycle_uses_store(client):
+    from src.api.deps import get_access_token
+    from src.core.session_store import MemorySessionStore, get_session_store
+
+    store = MemorySessionStore(ttl=60)
+    app.dependency_overrides[get_session_store] = lambda: store
+    app.dependency_overrides.pop(get_access_token)
+
+    assert client.get("/api/v1/users/me").status_code == 401
+    client.get("/api/v1/callback?code=123", follow_redirects=False)
+    assert len(store) == 1
+
+    with patch("src.services.user_service.UserService.get_me", new_callable=AsyncMock) as mock_get_me:
+        mock_get_me.return_value = {"id": "123", "displayName": "Test User"}
+        assert client.get("/api/v1/users/me").status_code == 200
+
+    client.get("/api/v1/logout", follow_redirects=False)
+    assert len(store) == 0
+
+def _session_client(client, mock_auth_service, session):
+    from src.api.deps import get_access_token
+    from src.core.session_store import MemorySessionStore, get_session_store
+
+    store = MemorySessionStore(ttl=60)
+    store.set_nowait("sid", session)
+    app.dependency_overrides[get_session_store] = lambda: store
+    app.dependency_overrides.pop(get_access_token)
+    client.cookies.set("session_id", "sid")
+    return store
+
+def test_expiring_token_is_renewed_silently(client, mock_auth_service):
+    import time
+    store = _session_client(client, mock_auth_service, {
+        "access_token": "old", "expires_at": time.time() + 10,
+        "home_account_id": "oid.tid", "account": {"name": "Test"},
+    })
+    mock_auth_service.acquire_token_silent_async.return_value = {"access_token": "new", "expires_in": 3600}
+
+    with patch("src.services.user_service.UserService.get_me", new_callable=AsyncMock) as mock_get_me:
+        mock_get_me.return_value = {"id": "123", "displayName": "Test User"}
+        assert client.get("/api/v1/users/me").status_code == 200
+        assert client.get("/api/v1/users/me").status_code == 200
+
+    mock_auth_service.acquire_token_silent_async.assert_awaited_once_with("oid.tid")
+    session = store.get_nowait("sid")
+    assert session["access_token"] == "new"
+    assert session["account"] == {"name": "Test"}
+
+def test_expired_token_without_renewal_is_rejected(client, mock_auth_service):
+    import time
+    store = _session_client(client, mock_auth_service, {
+        "access_token": "old", "expires_at": time.time() - 1, "home_account_id": "oid.tid",
+    })
+
+    response = client.get("/api/v1/users/me")
+    assert response.status_code == 401
+    assert store.get_nowait("sid") is None
+
+@pytest.mark.asyncio
+async def test_users_me_latency_stays_flat_during_login_burst():
+    import asyncio
+    import time
+    import httpx
+    from src.api.deps import get_access_token, get_auth_service
+    from src.core.session_store import MemorySessionStore, get_session_store
+    from src.services.auth_service import AuthService, token_endpoint_stats
+
+    def slow_token_endpoint(**kwargs):
+        time.sleep(0.2)  # MSAL blocks on its HTTP call to the token endpoint
+        return {"access_token": "tok", "expires_in": 3600}
+
+    with patch("src.services.auth_service.msal.ConfidentialClientApplication") as mock_msal_app, \
+            patch("src.services.user_service.UserService.get_me", new_callable=AsyncMock) as mock_get_me:
+        mock_msal_app.return_value.acquire_token_by_authorization_code.side_effect = slow_token_endpoint
+        mock_get_me.return_value = {"id": "123", "displayName": "Test User"}
+        auth_service = AuthService()
+        app.dependency_overrides[get_auth_service] = lambda: auth_service
+        app.dependency_overrides[get_access_token] = lambda: "mock_token"
+        app.dependency_overrides[get_session_store] = lambda: MemorySessionStore()
+
+        async def probe(client, latencies):
+            for _ in range(10):
+                started = time.perf_counter()
+                assert (await client.get("/api/v1/users/me")).status_code == 200
+                latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(0.02)
+
+        try:
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                latencies = []
+                logins = [client.get(f"/api/v1/callback?code=c{i}") for i in range(8)]
+                started = time.perf_counter()
+                await asyncio.gather(probe(client, latencies), *logins)
+                burst = time.perf_counter() - started
+        finally:
+            app.dependency_overrides = {}
+
+    assert burst >= 0.4  # 8 logins on 4 threads
+    assert max(latencies) < 0.1
+    assert token_endpoint_stats()["authorization_code"]["calls"] >= 8
+
+def test_bulk_send_job(client):
+    import time
+    messages = [{"to": [f"user{i}@example.com"], "subject": "Hi", "body": "b"} for i in range(3)]
+    with patch("src.core.graph_client.GraphClient.send_batch", new_callable=AsyncMock) as mock_batch:
+        mock_batch.return_value = [None, None, None]
+        response = client.post("/api/v1/mail/send/bulk", json={"messages": messages})
+        assert response.status_code == 202
+        job_id = response.json()["id"]
+
+        for _ in range(50):
+            job = client.get(f"/api/v1/mail/send/bulk/{job_id}").json()
+            if job["status"] == "completed":
+                break
+            time.sleep(0.01)
+
+    assert job["sent"] == 3
+    assert [item["status"] for item in job["items"]] == ["sent"] * 3
+    assert client.get("/api/v1/mail/send/bulk/unknown").status_code == 404
+    assert client.post("/api/v1/mail/send/bulk", json={"messages": []}).status_code == 422
+
+def test_find_meeting_slots(client):
+    reply = {"value": [{"scheduleId": "ana@example.com", "scheduleItems": [
+        {"status": "busy", "start": {"dateTime": "2024-03-04T09:00:00.0000000"},
+         "end": {"dateTime": "2024-03-04T11:00:00.0000000"}}]}]}
+    with patch("src.core.graph_client.GraphClient.request", new_callable=AsyncMock) as mock_request:
+        mock_request.return_value = reply
+        response = client.post("/api/v1/calendar/slots", json={
+            "attendees": ["ana@example.com"], "start": "2024-03-04T00:00:00",
+            "end": "2024-03-05T00:00:00", "duration_minutes": 30, "max_results": 2})
+
+    assert response.status_code == 200
+    assert [slot["start"] for slot in response.json()] == ["2024-03-04T11:00:00Z", "2024-03-04T11:30:00Z"]
+    assert client.post("/api/v1/calendar/slots", json={
+        "attendees": ["ana@example.com"], "start": "2024-03-05T00:00:00",
+        "end": "2024-03-04T00:00:00"}).status_code == 422
+
+def test_calendar_view_range(client):
+    events = [{"id": "e1", "subject": "Standup",
+               "start": {"dateTime": "2024-03-04T09:00:00.0000000", "timeZone": "UTC"},
+               "end": {"dateTime": "2024-03-04T09:15:00.0000000", "timeZone": "UTC"}}]
+    with patch("src.core.graph_client.GraphClient.get", new_callable=AsyncMock) as mock_get:
+        mock_get.return_value = {"value": events}
+        response = client.get("/api/v1/calendar/view?start=2024-03-04T00:00:00&end=2024-03-11T00:00:00")
+
+    assert response.status_code == 200
+    assert response.json()[0]["id"] == "e1"
+    assert "/me/calendarView?startDateTime=2024-03-04T00:00:00Z" in mock_get.call_args.args[0]
+    assert client.get("/api/v1/calendar/view?start=2024-03-04T00:00:00&end=2024-03-01T00:00:00").status_code == 422
+
+def test_bulk_create_events(client):
+    from src.core.exceptions import GraphAPIException
+
+    event = {"id": "e1", "start": {"dateTime": "2024-03-04T12:00:00"}, "end": {"dateTime": "2024-03-04T13:00:00"}}
+    fields = {"start_time": "2024-03-04T12:00:00", "end_time": "2024-03-04T13:00:00"}
+    with patch("src.core.graph_client.GraphClient.send_batch", new_callable=AsyncMock) as mock_batch:
+        mock_batch.return_value = [event, GraphAPIException(400, "Invalid")]
+        response = client.post("/api/v1/calendar/bulk", json={
+            "events": [{"subject": "a", **fields}, {"subject": "b", **fields}]})
+
+    assert response.status_code == 200
+    assert response.json()["failed_indexes"] == [1]
+    assert response.json()["items"][0]["event"]["id"] == "e1"
+    assert client.post("/api/v1/calendar/bulk", json={"events": []}).status_code == 422
+
+def test_crawl_files_streams_ndjson(client):
+    import json
+    from src.models.drive import FileItem
+
+    async def crawl(self, folder_path="root", concurrency=None, page_size=None, batch=None, max_depth=None):
+        assert (folder_path, concurrency, batch) == ("Docs", 2, True)
+        for name in ("a.pdf", "b.pdf"):
+            yield FileItem(id=name, name=name)
+
+    with patch("src.services.drive_service.DriveService.crawl", crawl):
+        response = client.get("/api/v1/drive/files/crawl?folder=Docs&concurrency=2&batch=true")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == ["a.pdf", "b.pdf"]
+
+def test_search_emails_from_local_index(client, tmp_path):
+    from src.api.deps import get_mail_search_index, get_sync_store
+    from src.services.search_service import MailSearchIndex
+    from src.services.sync_service import SyncStore
+
+    index = MailSearchIndex(str(tmp_path / "search.db"))
+    app.dependency_overrides[get_sync_store] = lambda: SyncStore(str(tmp_path / "sync.db"))
+    app.dependency_overrides[get_mail_search_index] = lambda: index
+    delta = {"value": [
+        {"id": "m1", "subject": "Factura de marzo", "receivedDateTime": "2024-03-01T10:00:00Z",
+         "from": {"emailAddress": {"address": "billing@contoso.com"}}},
+        {"id": "m2", "subject": "Comida", "receivedDateTime": "2024-03-02T10:00:00Z"},
+    ], "@odata.deltaLink": "d1"}
+    with patch("src.core.graph_client.GraphClient.get", new_callable=AsyncMock) as mock_get:
+        mock_get.return_value = delta
+        response = client.get("/api/v1/mail/search?q=factura&refresh=true")
+        assert mock_get.await_count == 1
+        filtered = client.get("/api/v1/mail/search?q=factura&sender=someone@example.com")
+        assert mock_get.await_count == 1
+
+    assert response.status_code == 200
+    assert [hit["message"]["id"] for hit in response.json()] == ["m1"]
+    assert filtered.json() == []
+    assert client.get("/api/v1/mail/search?top=0").status_code == 422
+    index.close()
+
+def test_subscription_webhook_handshake_and_payloads(client, tmp_path):
+    from src.api.deps import get_subscription_manager
+    from src.services.subscription_service import NotificationHub, SubscriptionManager, SubscriptionStore
+    manager = SubscriptionManager(NotificationHub(), SubscriptionStore(str(tmp_path / "subscriptions.db")),
+                                  notification_url=None)
+    app.dependency_overrides[get_subscription_manager] = lambda: manager
+
+    response = client.post("/api/v1/subscriptions/notifications?validationToken=a%20b%3Cc%3E")
+    assert response.status_code == 200
+    assert response.text == "a b<c>" and response.headers["content-type"].startswith("text/plain")
+
+    response = client.post("/api/v1/subscriptions/notifications",
+                           json={"value": [{"subscriptionId": "x", "clientState": "y"}]})
+    assert response.status_code == 202 and manager.rejected == 1
+    assert client.post("/api/v1/subscriptions/notifications", json=[1]).status_code == 400
+
+    # Without a public notification URL nothing can be subscribed.
+    response = client.post("/api/v1/subscriptions/", json={"resource": "mail"})
+    assert response.status_code == 503
+    assert client.get("/api/v1/subscriptions/").json() == []
+    assert client.delete("/api/v1/subscriptions/missing").status_code == 404
+    assert client.post("/api/v1/subscriptions/missing/renew").status_code == 404
+    manager.store.close()
+
+def test_metrics_endpoint_reports_routes_and_pool(client, tmp_path):
+    from src.api.deps import get_subscription_manager
+    from src.services.subscription_service import NotificationHub, SubscriptionManager, SubscriptionStore
+    store = SubscriptionStore(str(tmp_path / "subscriptions.db"))
+    app.dependency_overrides[get_subscription_manager] = lambda: SubscriptionManager(
+        NotificationHub(), store, notification_url=None)
+    with patch("src.services.user_service.UserService.get_me", new_callable=AsyncMock) as mock_get_me:
+        mock_get_me.return_value = {"displayName": "Test User", "mail": "test@example.com", "id": "123"}
+        assert client.get("/api/v1/users/me").status_code == 200
+    client.get("/api/v1/no-such-route")
+    client.delete("/api/v1/subscriptions/missing")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/v1/users/me",status="200"}' in body
+    assert 'route="{unmatched}",status="404"' in body
+    assert 'method="DELETE",route="/api/v1/subscriptions/{subscription_id}",status="404"' in body
+    assert "# TYPE graph_request_duration_seconds histogram" in body
+    assert "graph_pool_open 1" in body
+    store.close()
@@ -0,0 +1,65 @@
+from typing import ClassVar, Tuple
+from src.models.calendar import Event
+from src.models.drive import FileItem
+from src.models.mail import Message
+from src.models.projection import graph_fields, select_query
+
+
+class TestProjection:
+    def test_select_uses_graph_aliases(self):
+        fields = graph_fields(Message)
+        assert "from" in fields and "from_" not in fields
+        assert select_query(Event) == "$select=id,subject,start,end,location,attendees"
+
+    def test_summary_mode_drops_heavy_fields(self):
+        assert ",body," in select_query(Message) + ","
+        summary = select_query(Message, summary=True)
+        assert ",body," not in summary + "," and "bodyPreview" in summary
+        assert select_query(FileItem, summary=True) == select_query(FileItem)
+
+    def test_expand_clause(self):
+        class WithAttachments(Message):
+            graph_expand: ClassVar[Tuple[str, ...]] = ("attachments",)
+
+        assert select_query(WithAttachments).endswith("&$expand=attachments")
+
+
+class TestValidation:
+    PAGE = [
+        {"id": "1", "from": {"emailAddress": {"address": "a@example.com"}},
+         "toRecipients": [{"emailAddress": {"address": "b@example.com", "name": "B"}}]},
+        {"id": "2", "receivedDateTime": "2024-01-01T10:00:00Z"},
+    ]
+
+    def test_validate_page_matches_per_item_construction(self):
+        from src.models.validation import validate_page
+
+        assert validate_page(Message, self.PAGE, trusted=False) == [Message(**m) for m in self.PAGE]
+
+    def test_trusted_models_skip_email_validation(self):
+        import pytest
+        from pydantic import ValidationError
+        from src.models.mail import Recipient
+        from src.models.user import UserProfile
+        from src.models.validation import trusted_model, validate_item, validate_page
+
+        odd = [{"id": "3", "toRecipients": [{"emailAddress": {"address": "legacy-x500-address"}}]}]
+        with pytest.raises(ValidationError):
+            validate_page(Message, odd, trusted=False)
+
+        trusted = validate_page(Message, self.PAGE + odd, trusted=True)
+        assert all(isinstance(m, Message) for m in trusted)
+        assert isinstance(trusted[0].from_, Recipient)
+        assert trusted[2].toRecipients[0].emailAddress.address == "legacy-x500-address"
+        assert trusted[0].model_dump(by_alias=True) == Message(**self.PAGE[0]).model_dump(by_alias=True)
+        assert trusted_model(FileItem) is FileItem
+        assert validate_item(UserProfile, {"id": "u", "mail": "not-checked"}, trusted=True).mail == "not-checked"
+
+    def test_trusted_mode_follows_settings(self):
+        from unittest.mock import patch
+        from src.models.validation import trusted_model, validate_item
+
+        event = {"id": "e", "start": {"dateTime": "x"}, "end": {"dateTime": "y"}}
+        assert type(validate_item(Event, event)) is trusted_model(Event)
+        with patch("src.models.validation.settings.GRAPH_TRUSTED_MODELS", False):
+            assert type(validate_item(Event, event)) is Event
@@ -37,6 +37,102 @@ class TestAuthService:
         
         assert "Authentication failed" in str(excinfo.value)
 
+    @patch("src.services.auth_service.msal.ConfidentialClientApplication")
+    def test_acquire_token_silent_uses_cached_account(self, mock_msal_app):
+        mock_instance = mock_msal_app.return_value
+        account = {"home_account_id": "oid.tid", "username": "user@example.com"}
+        mock_instance.get_accounts.return_value = [account]
+        mock_instance.acquire_token_silent.return_value = {"access_token": "renewed", "expires_in": 3600}
+
+        service = AuthService()
+        cache = Mock()
+        assert service.acquire_token_silent("oid.tid", cache)["access_token"] == "renewed"
+        assert mock_msal_app.call_args.kwargs["token_cache"] is cache
+        mock_instance.acquire_token_silent.assert_called_once_with(service.scopes, account=account)
+
+        assert service.acquire_token_silent("other.tid", cache) is None
+        mock_instance.acquire_token_silent.return_value = {"error": "invalid_grant"}
+        assert service.acquire_token_silent("oid.tid", cache) is None
+
+    @patch("src.services.auth_service.requests.Session")
+    @patch("src.services.auth_service.msal.ConfidentialClientApplication")
+    def test_token_calls_share_one_http_session(self, mock_msal_app, mock_session):
+        mock_instance = mock_msal_app.return_value
+        mock_instance.get_accounts.return_value = [{"home_account_id": "oid.tid"}]
+        mock_instance.acquire_token_silent.return_value = {"access_token": "renewed"}
+
+        service = AuthService()
+        for _ in range(5):
+            assert service.acquire_token_silent("oid.tid", Mock())["access_token"] == "renewed"
+        service.acquire_token_by_code("code", Mock())
+
+        mock_session.assert_called_once()
+        assert {id(call.kwargs["http_client"]) for call in mock_msal_app.call_args_list} == {
+            id(mock_session.return_value)}
+        service.close()
+        mock_session.return_value.close.assert_called_once()
+
+    @pytest.mark.asyncio
+    @patch("src.services.auth_service.msal.ConfidentialClientApplication")
+    async def test_any_worker_renews_from_the_shared_store(self, mock_msal_app):
+        from src.core.session_store import MemorySessionStore
+
+        def redeem(**kwargs):
+            # MSAL writes the new account's tokens into the app's cache.
+            cache = mock_msal_app.call_args.kwargs["token_cache"]
+            cache.has_state_changed = True
+            return {"access_token": "first", "client_info": "eyJ1aWQiOiJvaWQiLCJ1dGlkIjoidGlkIn0"}
+
+        mock_instance = mock_msal_app.return_value
+        mock_instance.acquire_token_by_authorization_code.side_effect = redeem
+        mock_instance.get_accounts.return_value = [{"home_account_id": "oid.tid"}]
+        mock_instance.acquire_token_silent.return_value = {"access_token": "renewed"}
+        shared = MemorySessionStore()
+        login_worker, other_worker = AuthService(account_store=shared), AuthService(account_store=shared)
+
+        assert await other_worker.acquire_token_silent_async("oid.tid") is None
+        await login_worker.acquire_token_by_code_async("code")
+        assert shared.get_nowait("account:oid.tid") is not None
+        assert (await other_worker.acquire_token_silent_async("oid.tid"))["access_token"] == "renewed"
+
+        await other_worker.remove_account_async("oid.tid")
+        assert await login_worker.acquire_token_silent_async("oid.tid") is None
+
+    @pytest.mark.asyncio
+    @patch("src.services.auth_service.msal.ConfidentialClientApplication")
+    async def test_token_cache_file_is_private(self, mock_msal_app, tmp_path):
+        import json
+        import os
+        import stat
+        from src.core.session_store import MemorySessionStore
+
+        path = tmp_path / "cache.json"
+        service = AuthService(token_cache_path=str(path), account_store=MemorySessionStore())
+        await service._save_account_cache("oid.tid", "{}")
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+        assert json.loads(path.read_text()) == {"oid.tid": "{}"}
+
+        # After a restart the in-memory store is empty; the file still has the account.
+        restarted = AuthService(token_cache_path=str(path), account_store=MemorySessionStore())
+        assert await restarted._load_account_cache("oid.tid") == "{}"
+        await restarted.remove_account_async("oid.tid")
+        assert json.loads(path.read_text()) == {}
+
+    def test_session_from_token(self):
+        import base64, json, time
+        from src.services.auth_service import home_account_id, session_from_token
+
+        client_info = base64.urlsafe_b64encode(
+            json.dumps({"uid": "u1", "utid": "t1"}).encode()).decode().rstrip("=")
+        assert home_account_id({"client_info": client_info}) == "u1.t1"
+        assert home_account_id({"id_token_claims": {"oid": "o", "tid": "t"}}) == "o.t"
+        assert home_account_id({}) is None
+
+        session = session_from_token({"access_token": "a", "expires_in": 60}, "u1.t1")
+        assert session["home_account_id"] == "u1.t1"
+        assert 50 < session["expires_at"] - time.time() <= 60
+        assert "account" not in session
+
 class TestUserService:
     @pytest.mark.asyncio
     async def test_get_me(self):
@@ -48,4 +144,1263 @@ class TestUserService:
         result = await service.get_me()
         
         assert result.displayName == "Test User"
-        mock_client.get.assert_called_with("/me")
+        mock_client.get.assert_called_with(
+            "/me?$select=id,displayName,mail,userPrincipalName,jobTitle,mobilePhone,officeLocation")
+
+
+class TestDriveService:
+    @pytest.mark.asyncio
+    async def test_open_download_follows_redirect_with_range(self):
+        import httpx
+        from src.core.graph_client import GraphClient
+        from src.services.drive_service import DriveService
+
+        seen = []
+
+        def handler(request):
+            seen.append(request)
+            if request.url.host == "graph.microsoft.com":
+                return httpx.Response(302, headers={"Location": "https://dl.example.com/f"})
+            return httpx.Response(206, content=b"world", headers={
+                "Content-Type": "text/plain",
+                "Content-Range": "bytes 6-10/11",
+                "Content-Length": "5",
+            })
+
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            service = DriveService(GraphClient("token", http_client=http))
+            stream = await service.open_download("item-1", byte_range="bytes=6-")
+            chunks = [chunk async for chunk in stream.aiter_bytes(2)]
+            await stream.aclose()
+
+        assert b"".join(chunks) == b"world"
+        assert max(len(chunk) for chunk in chunks) == 2
+        assert stream.status_code == 206
+        assert stream.passthrough_headers()["Content-Range"] == "bytes 6-10/11"
+        assert seen[1].headers["Range"] == "bytes=6-"
+        assert "Authorization" not in seen[1].headers
+
+    @pytest.mark.asyncio
+    async def test_open_download_raises_on_error(self):
+        import httpx
+        from src.core.exceptions import GraphAPIException
+        from src.core.graph_client import GraphClient
+        from src.services.drive_service import DriveService
+
+        def handler(request):
+            return httpx.Response(404, json={"error": {"code": "itemNotFound"}})
+
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            service = DriveService(GraphClient("token", http_client=http))
+            with pytest.raises(GraphAPIException) as excinfo:
+                await service.open_download("missing")
+        assert excinfo.value.status_code == 404
+
+    @pytest.mark.asyncio
+    async def test_upload_large_file_resumes_after_failure(self):
+        import io
+        import httpx
+        from src.core.graph_client import GraphClient
+        from src.core.retry import RetryPolicy
+        from src.services.drive_service import DriveService
+
+        chunk = 320 * 1024
+        payload = bytes(range(256)) * (chunk * 3 // 256 + 10)
+        received = bytearray()
+        attempts = {"puts": 0}
+
+        class Source:
+            def __init__(self, data):
+                self.buffer = io.BytesIO(data)
+
+            async def read(self, size):
+                return self.buffer.read(size)
+
+            async def seek(self, offset):
+                self.buffer.seek(offset)
+
+        def handler(request):
+            if request.url.path.endswith("createUploadSession"):
+                return httpx.Response(200, json={"uploadUrl": "https://up.example.com/s1"})
+            assert "Authorization" not in request.headers
+            if request.method == "GET":
+                return httpx.Response(200, json={"nextExpectedRanges": [f"{len(received)}-"]})
+            attempts["puts"] += 1
+            if attempts["puts"] == 2:
+                return httpx.Response(500, json={"error": {"code": "generalException"}})
+            start, end = request.headers["Content-Range"][6:].split("/")[0].split("-")
+            assert int(start) == len(received)
+            received.extend(request.content)
+            if len(received) == len(payload):
+                return httpx.Response(201, json={"id": "f1", "name": "big.bin", "size": len(payload)})
+            return httpx.Response(202, json={"nextExpectedRanges": [f"{len(received)}-"]})
+
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            # Batching on: the session URL status query must still go out directly.
+            client = GraphClient("token", http_client=http, batching=True,
+                                 retry_policy=RetryPolicy(base_delay=0))
+            service = DriveService(client)
+            item = await service.upload_large_file(
+                "big.bin", Source(payload), len(payload), chunk_size=chunk)
+
+        assert item.id == "f1"
+        assert bytes(received) == payload
+        assert attempts["puts"] == 5
+
+    @pytest.mark.asyncio
+    async def test_upload_large_file_if_changed_skips_same_content(self):
+        import io
+        from src.core.quickxor import QuickXorHash
+        from src.models.drive import FileItem
+        from src.services.drive_service import DriveService
+
+        payload = b"x" * 5000
+
+        class Source:
+            def __init__(self, data):
+                self.buffer = io.BytesIO(data)
+
+            async def read(self, size):
+                return self.buffer.read(size)
+
+            async def seek(self, offset):
+                self.buffer.seek(offset)
+
+        existing = FileItem(id="f1", name="big.bin", size=len(payload),
+                            file={"hashes": {"quickXorHash": QuickXorHash(payload).b64digest()}})
+        service = DriveService(Mock())
+        service.get_item = AsyncMock(return_value=existing)
+        service.upload_large_file = AsyncMock()
+
+        item, uploaded = await service.upload_large_file_if_changed("big.bin", Source(payload), len(payload))
+        assert (item, uploaded) == (existing, False)
+        service.upload_large_file.assert_not_called()
+
+        changed = Source(b"y" * 5000)
+        service.upload_large_file.return_value = existing
+        _, uploaded = await service.upload_large_file_if_changed("big.bin", changed, 5000)
+        assert uploaded
+        service.upload_large_file.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_upload_large_file_rejects_bad_chunk_size(self):
+        from src.services.drive_service import DriveService
+
+        with pytest.raises(ValueError):
+            await DriveService(Mock()).upload_large_file("f", Mock(), 10, chunk_size=1000)
+
+
+class TestMailService:
+    @pytest.mark.asyncio
+    async def test_iter_messages_pages_through_client(self):
+        from src.services.mail_service import MailService
+
+        async def paginate(endpoint):
+            assert endpoint.startswith("/me/messages?$top=25")
+            assert "body," not in endpoint and "bodyPreview" in endpoint
+            for i in range(3):
+                yield {"id": str(i), "subject": "hi"}
+
+        mock_client = Mock()
+        mock_client.paginate = paginate
+
+        messages = [m async for m in MailService(mock_client).iter_messages(page_size=25, summary=True)]
+        assert [m.id for m in messages] == ["0", "1", "2"]
+
+
+class TestSyncService:
+    @pytest.mark.asyncio
+    async def test_delta_rounds_update_local_store(self, tmp_path):
+        from src.services.sync_service import SyncService, SyncStore
+
+        store = SyncStore(str(tmp_path / "sync.db"))
+        responses = {
+            "/me/mailFolders/inbox/messages/delta?$select=id,subject,bodyPreview,body,sender,from,"
+            "toRecipients,receivedDateTime,isRead": {
+                "value": [{"id": "a", "subject": "first", "receivedDateTime": "2024-01-01T00:00:00Z"}],
+                "@odata.nextLink": "page2",
+            },
+            "page2": {
+                "value": [{"id": "b", "subject": "second", "receivedDateTime": "2024-01-02T00:00:00Z"}],
+                "@odata.deltaLink": "delta1",
+            },
+            "delta1": {
+                "value": [{"id": "a", "isRead": True}, {"id": "b", "@removed": {"reason": "deleted"}}],
+                "@odata.deltaLink": "delta2",
+            },
+        }
+        mock_client = Mock()
+        mock_client.access_token = "token"
+        mock_client.get = AsyncMock(side_effect=lambda endpoint: responses[endpoint])
+        service = SyncService(mock_client, store)
+
+        first = await service.sync_mail()
+        assert (first.upserted, first.removed, first.full_resync) == (2, 0, True)
+        assert [m.id for m in await service.get_messages()] == ["b", "a"]
+
+        second = await service.sync_mail()
+        assert (second.upserted, second.removed, second.full_resync) == (1, 1, False)
+        messages = await service.get_messages()
+        assert [m.id for m in messages] == ["a"]
+        assert messages[0].subject == "first" and messages[0].isRead is True
+        assert store.get_delta_link(service.owner, "mail:inbox") == "delta2"
+        store.close()
+
+    @pytest.mark.asyncio
+    async def test_expired_delta_token_triggers_full_resync(self, tmp_path):
+        from src.core.exceptions import GraphAPIException
+        from src.services.sync_service import SyncService, SyncStore, calendar_window
+
+        store = SyncStore(str(tmp_path / "sync.db"))
+        store.apply_round("owner", "calendar", [{"id": "old", "start": {"dateTime": "1"}}],
+                          [], "stale", "start.dateTime", bounds="/".join(calendar_window()))
+
+        async def get(endpoint):
+            if endpoint == "stale":
+                raise GraphAPIException(410, "Gone")
+            assert endpoint.startswith("/me/calendarView/delta?startDateTime=")
+            return {"value": [{"id": "new", "start": {"dateTime": "2024-05-01T10:00:00", "timeZone": "UTC"},
+                               "end": {"dateTime": "2024-05-01T11:00:00", "timeZone": "UTC"}}],
+                    "@odata.deltaLink": "fresh"}
+
+        mock_client = Mock()
+        mock_client.access_token = "token"
+        mock_client.get = get
+        service = SyncService(mock_client, store)
+        service.owner = "owner"
+
+        result = await service.sync_calendar()
+        assert result.full_resync is True
+        assert [e.id for e in await service.get_events()] == ["new"]
+        store.close()
+
+    @pytest.mark.asyncio
+    async def test_calendar_window_moves_with_a_full_round(self, tmp_path):
+        from datetime import datetime, timedelta, timezone
+        from src.services.sync_service import SyncService, SyncStore, calendar_window
+
+        store = SyncStore(str(tmp_path / "sync.db"))
+        yesterday = calendar_window(datetime.now(timezone.utc) - timedelta(days=1))
+        store.apply_round("owner", "calendar", [{"id": "old", "start": {"dateTime": "1"}}],
+                          [], "yesterday-link", "start.dateTime", bounds="/".join(yesterday))
+        start, end = calendar_window()
+        requested = []
+
+        async def get(endpoint):
+            requested.append(endpoint)
+            return {"value": [], "@odata.deltaLink": f"link-{len(requested)}"}
+
+        mock_client = Mock()
+        mock_client.access_token = "token"
+        mock_client.get = get
+        service = SyncService(mock_client, store)
+        service.owner = "owner"
+
+        moved = await service.sync_calendar()
+        assert moved.full_resync is True
+        assert requested == [f"/me/calendarView/delta?startDateTime={start}&endDateTime={end}"]
+        assert await service.get_events() == []
+
+        same_day = await service.sync_calendar()
+        assert same_day.full_resync is False
+        assert requested[-1] == "link-1"
+        store.close()
+
+    def test_token_subject_prefers_oid_claim(self):
+        import base64
+        import json
+        from src.core.tokens import token_subject
+
+        claims = base64.urlsafe_b64encode(json.dumps({"oid": "user-1"}).encode()).decode().rstrip("=")
+        assert token_subject(f"header.{claims}.sig") == "user-1"
+        assert token_subject("opaque") == token_subject("opaque") != "opaque"
+
+class TestBulkMailSender:
+    def _sender(self, rate=1000, capacity=20):
+        from src.core.rate_limit import RateLimiter
+        from src.core.retry import RetryPolicy
+        from src.core.session_store import MemorySessionStore
+        from src.services.bulk_mail_service import BulkMailSender
+
+        return BulkMailSender(RateLimiter(rate=rate, capacity=capacity), concurrency=2,
+                              retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01),
+                              job_store=MemorySessionStore())
+
+    def _messages(self, count):
+        from src.models.mail import SendMessageRequest
+        return [SendMessageRequest(to=[f"user{i}@example.com"], subject=f"s{i}", body="b")
+                for i in range(count)]
+
+    @pytest.mark.asyncio
+    async def test_sends_in_batches_and_retries_throttled_items(self):
+        from src.core.exceptions import GraphAPIException
+
+        throttled = GraphAPIException(429, "throttled", headers={"Retry-After": "0"})
+        rejected = GraphAPIException(400, "bad recipient")
+        client = Mock()
+        client.send_batch = AsyncMock(side_effect=[
+            [None] * 20,
+            [None, throttled, rejected],
+            [None],
+        ])
+        sender = self._sender()
+        try:
+            job = await sender.submit("owner", AsyncMock(return_value=client), self._messages(23))
+            await sender.join()
+        finally:
+            await sender.close()
+
+        assert client.send_batch.await_count == 3
+        first = client.send_batch.await_args_list[0].args[0]
+        assert len(first) == 20 and first[0].url == "/me/sendMail"
+        assert first[0].body["message"]["toRecipients"][0]["emailAddress"]["address"] == "user0@example.com"
+        assert job.status == "completed"
+        assert (job.sent, job.failed) == (22, 1)
+        assert job.items[21].attempts == 2 and job.items[21].status == "sent"
+        assert job.items[22].status_code == 400
+        assert await sender.get_job(job.id, "owner") == job
+        assert await sender.get_job(job.id, "someone-else") is None
+
+    @pytest.mark.asyncio
+    async def test_job_status_is_shared_and_mailbox_locks_are_bounded(self):
+        from src.core.rate_limit import RateLimiter
+        from src.services.bulk_mail_service import BulkMailSender
+
+        client = Mock()
+        client.send_batch = AsyncMock(side_effect=lambda requests: [None] * len(requests))
+        sender = self._sender()
+        sender.limiter.max_keys = 2
+        # Another worker sharing the session store, with nothing in memory.
+        other = BulkMailSender(RateLimiter(rate=1, capacity=1), job_store=sender.job_store)
+        try:
+            job = await sender.submit("owner", AsyncMock(return_value=client), self._messages(3))
+            assert (await other.get_job(job.id, "owner")).status == "queued"
+            await sender.join()
+            for owner in ("a", "b", "c"):
+                await sender.submit(owner, AsyncMock(return_value=client), self._messages(1))
+            await sender.join()
+        finally:
+            await sender.close()
+
+        shared = await other.get_job(job.id, "owner")
+        assert shared.status == "completed" and shared.sent == 3
+        assert list(sender._mailboxes) == ["b", "c"]
+
+    @pytest.mark.asyncio
+    async def test_gives_up_after_max_attempts_and_on_envelope_errors(self):
+        from src.core.exceptions import GraphAPIException
+
+        client = Mock()
+        client.send_batch = AsyncMock(side_effect=GraphAPIException(429, "throttled"))
+        sender = self._sender()
+        try:
+            job = await sender.submit("owner", AsyncMock(return_value=client), self._messages(2))
+            await sender.join()
+            assert client.send_batch.await_count == 3
+            assert job.failed == 2 and job.items[0].status_code == 429
+
+            client.send_batch = AsyncMock(side_effect=GraphAPIException(502, "bad gateway"))
+            job = await sender.submit("owner", AsyncMock(return_value=client), self._messages(1))
+            await sender.join()
+            assert client.send_batch.await_count == 1
+            assert job.items[0].status == "failed" and job.items[0].status_code == 502
+        finally:
+            await sender.close()
+
+    @pytest.mark.asyncio
+    async def test_groups_respect_the_mailbox_rate(self):
+        import time
+
+        client = Mock()
+        client.send_batch = AsyncMock(side_effect=lambda requests: [None] * len(requests))
+        sender = self._sender(rate=200, capacity=5)
+        started = time.monotonic()
+        try:
+            job = await sender.submit("owner", AsyncMock(return_value=client), self._messages(15))
+            await sender.join()
+        finally:
+            await sender.close()
+
+        assert [len(call.args[0]) for call in client.send_batch.await_args_list] == [5, 5, 5]
+        assert time.monotonic() - started >= 0.045
+        assert job.sent == 15
+
+    @pytest.mark.asyncio
+    async def test_mailbox_runs_four_sends_at_a_time(self):
+        import asyncio
+        from src.core.batch import build_batch_payload
+        from src.core.exceptions import GraphAPIException
+
+        in_flight = {"now": 0, "max": 0}
+        payloads = []
+
+        async def send_batch(requests):
+            payloads.append(build_batch_payload(requests))
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+            await asyncio.sleep(0.01)
+            in_flight["now"] -= 1
+            if len(payloads) == 1:
+                # Item 1 throttled; item 5, chained after it, never ran.
+                results = [None] * len(requests)
+                results[1] = GraphAPIException(429, "throttled", headers={"Retry-After": "0"})
+                results[5] = GraphAPIException(424, "failed dependency")
+                return results
+            return [None] * len(requests)
+
+        client = Mock()
+        client.send_batch = send_batch
+        sender = self._sender()
+        try:
+            job = await sender.submit("owner", AsyncMock(return_value=client), self._messages(30))
+            await sender.join()
+        finally:
+            await sender.close()
+
+        # Two workers, but one group in flight per mailbox.
+        assert in_flight["max"] == 1
+        items = payloads[0]["requests"]
+        assert [item.get("dependsOn") for item in items[:5]] == [None, None, None, None, ["0"]]
+        assert items[19]["dependsOn"] == ["15"]
+        assert job.sent == 30
+        assert job.items[1].attempts == 2 and job.items[5].attempts == 1
+
+class TestTemplateService:
+    def _registry(self, cache_size=16):
+        from src.services.template_service import TemplateRegistry
+
+        registry = TemplateRegistry(cache_size=cache_size)
+        registry.register(
+            "pago",
+            subject="Pago de {nombre}",
+            body="<p>Hola {nombre}, recibimos ${monto:.2f} ({factura})</p>",
+            params={"nombre": str, "monto": float, "factura": str},
+            defaults={"factura": "N/A"},
+        )
+        return registry
+
+    def test_render_coerces_escapes_and_defaults(self):
+        rendered = self._registry().render("pago", {"nombre": "<Ana>", "monto": "15"})
+        assert rendered.subject == "Pago de <Ana>"
+        assert rendered.body == "<p>Hola &lt;Ana&gt;, recibimos $15.00 (N/A)</p>"
+        assert rendered.content_type == "HTML"
+
+    def test_untyped_params_keep_their_format_spec(self):
+        from datetime import date
+        from src.services.template_service import TemplateRegistry
+
+        registry = TemplateRegistry()
+        registry.register("aviso", subject="{fecha:%d/%m} {{literal}}", body="<b>{fecha:%Y} {nota}</b>")
+        rendered = registry.render("aviso", {"fecha": date(2024, 3, 1), "nota": ["a&b"]})
+        assert rendered.subject == "01/03 {literal}"
+        assert rendered.body == "<b>2024 [&#x27;a&amp;b&#x27;]</b>"
+
+    def test_errors_are_reported_as_template_exceptions(self):
+        from src.core.exceptions import TemplateException
+
+        registry = self._registry()
+        with pytest.raises(TemplateException):
+            registry.render("pago", {"monto": 1})
+        with pytest.raises(TemplateException):
+            registry.render("pago", {"nombre": "Ana", "monto": "many"})
+        with pytest.raises(TemplateException):
+            registry.render("missing", {})
+        with pytest.raises(TemplateException):
+            registry.register("bad", subject="{a}", body="{b}", params={"a": str})
+        with pytest.raises(TemplateException):
+            registry.register("bad", subject="{a.b}", body="")
+        with pytest.raises(TemplateException):
+            registry.register("bad", subject="{a:{b}}", body="")
+        with pytest.raises(TemplateException):
+            registry.register("bad", subject="{a", body="")
+
+    def test_render_cache(self):
+        registry = self._registry()
+        template = registry.get("pago")
+        first = template.render({"nombre": "Ana", "monto": 1.0})
+        assert template.render({"nombre": "Ana", "monto": 1.0}) is first
+        assert template.cache_stats()["hits"] == 1
+        assert template.render({"nombre": ["unhashable"], "monto": 1.0}).subject == "Pago de ['unhashable']"
+
+        # Equal but differently typed values of an untyped param get their own entries.
+        from src.services.template_service import TemplateRegistry
+        untyped = TemplateRegistry().register("flag", subject="{valor}", body="")
+        assert [untyped.render({"valor": v}).subject for v in (True, 1, 1.0)] == ["True", "1", "1.0"]
+
+        uncached = self._registry(cache_size=0).get("pago")
+        assert uncached.render({"nombre": "Ana", "monto": 1.0}) == first
+        assert uncached.cache_stats() == {}
+
+    def test_render_batch_builds_send_requests(self):
+        requests = self._registry().render_batch("pago", [
+            ("ana@example.com", {"nombre": "Ana", "monto": 10}),
+            (["luis@example.com", "cc@example.com"], {"nombre": "Luis", "monto": 20}),
+        ])
+        assert [r.to for r in requests] == [["ana@example.com"], ["luis@example.com", "cc@example.com"]]
+        assert requests[1].body == "<p>Hola Luis, recibimos $20.00 (N/A)</p>"
+
+        from pydantic import ValidationError
+        from src.models.mail import SendMessageRequest
+        with pytest.raises(ValidationError):
+            self._registry().render_batch("pago", [("not-an-address", {"nombre": "X", "monto": 1})],
+                                          validate_recipients=True)
+        unchecked = self._registry().render_batch(
+            "pago", [("not-an-address", {"nombre": "X", "monto": 1})])
+        assert isinstance(unchecked[0], SendMessageRequest) and unchecked[0].to == ["not-an-address"]
+
+class TestCalendarSlots:
+    def _schedule(self, address, *items):
+        return {
+            "scheduleId": address,
+            "scheduleItems": [
+                {"status": status,
+                 "start": {"dateTime": f"2024-03-04T{start}:00.0000000", "timeZone": "UTC"},
+                 "end": {"dateTime": f"2024-03-04T{end}:00.0000000", "timeZone": "UTC"}}
+                for status, start, end in items
+            ],
+        }
+
+    def _service(self, reply):
+        from src.core.cache import LRUCache
+        from src.services.calendar_service import CalendarService
+
+        client = Mock()
+        client.subject = "owner"
+        client.request = AsyncMock(return_value=reply)
+        return CalendarService(client, schedule_cache=LRUCache(ttl=60)), client
+
+    def _request(self, **overrides):
+        from datetime import datetime
+        from src.models.calendar import SlotSearchRequest
+
+        fields = dict(attendees=["ana@example.com", "Luis@example.com"],
+                      start=datetime(2024, 3, 4, 0, 0), end=datetime(2024, 3, 5, 0, 0),
+                      duration_minutes=60, max_results=3)
+        fields.update(overrides)
+        return SlotSearchRequest(**fields)
+
+    @pytest.mark.asyncio
+    async def test_finds_common_free_slots_and_caches_busy_blocks(self):
+        service, client = self._service({"value": [
+            self._schedule("ana@example.com", ("busy", "09:00", "10:30"), ("tentative", "13:00", "14:00")),
+            self._schedule("luis@example.com", ("oof", "10:00", "12:00"), ("free", "12:00", "13:00")),
+        ]})
+
+        slots = await service.find_meeting_slots(self._request())
+        assert [slot.start.strftime("%H:%M") for slot in slots] == ["12:00", "14:00", "14:30"]
+
+        relaxed = await service.find_meeting_slots(self._request(allow_tentative=True))
+        assert [slot.start.strftime("%H:%M") for slot in relaxed] == ["12:00", "12:30", "13:00"]
+        assert client.request.await_count == 1
+
+        body = client.request.await_args.kwargs["json"]
+        assert body["schedules"] == ["ana@example.com", "luis@example.com"]
+        assert body["startTime"] == {"dateTime": "2024-03-04T00:00:00", "timeZone": "UTC"}
+        assert client.request.await_args.kwargs["retry"] is True
+
+    @pytest.mark.asyncio
+    async def test_working_hours_follow_the_time_zone(self):
+        service, _ = self._service({"value": [self._schedule("ana@example.com")]})
+        slots = await service.find_meeting_slots(self._request(
+            attendees=["ana@example.com"], time_zone="America/Mexico_City", max_results=1))
+        assert slots[0].start.isoformat() == "2024-03-04T09:00:00-06:00"
+
+    @pytest.mark.asyncio
+    async def test_schedules_are_fetched_in_chunks_and_errors_are_not_cached(self):
+        from datetime import datetime, timezone
+
+        attendees = [f"user{i}@example.com" for i in range(25)]
+        reply = {"value": [{"scheduleId": "user0@example.com", "error": {"message": "not found"}}]}
+        service, client = self._service(reply)
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        end = datetime(2024, 4, 1, tzinfo=timezone.utc)
+
+        blocks = await service.get_busy_blocks(attendees, start, end)
+        # 2 attendee chunks x 2 date windows (91 days > 62)
+        assert client.request.await_count == 4
+        assert blocks == {}
+        assert len(service.schedule_cache) == 0
+
+    @pytest.mark.asyncio
+    async def test_creating_an_event_forgets_attendee_schedules(self):
+        from datetime import datetime
+        from src.models.calendar import CreateEventRequest
+
+        service, client = self._service({"value": [self._schedule("ana@example.com")]})
+        await service.find_meeting_slots(self._request(attendees=["ana@example.com"]))
+        assert len(service.schedule_cache) == 1
+
+        client.post = AsyncMock(return_value={
+            "id": "1", "start": {"dateTime": "2024-03-04T12:00:00"}, "end": {"dateTime": "2024-03-04T13:00:00"}})
+        await service.create_event(CreateEventRequest(
+            subject="Sync", start_time=datetime(2024, 3, 4, 12), end_time=datetime(2024, 3, 4, 13),
+            attendees=["ana@example.com"]))
+        assert len(service.schedule_cache) == 0
+
+class TestCalendarRange:
+    def _event(self, event_id, start, end):
+        return {"id": event_id, "subject": event_id,
+                "start": {"dateTime": f"{start}.0000000", "timeZone": "UTC"},
+                "end": {"dateTime": f"{end}.0000000", "timeZone": "UTC"}}
+
+    def _service(self, events):
+        from src.core.cache import LRUCache
+        from src.services.calendar_service import CalendarService, parse_graph_datetime
+
+        fetched = []
+
+        async def paginate(endpoint):
+            fetched.append(endpoint)
+            params = dict(part.split("=", 1) for part in endpoint.split("?", 1)[1].split("&"))
+            start = parse_graph_datetime(params["startDateTime"].rstrip("Z"))
+            end = parse_graph_datetime(params["endDateTime"].rstrip("Z"))
+            for event in events:
+                if (parse_graph_datetime(event["start"]["dateTime"]) < end
+                        and parse_graph_datetime(event["end"]["dateTime"]) > start):
+                    yield event
+
+        client = Mock()
+        client.subject = "owner"
+        client.paginate = paginate
+        return CalendarService(client, range_indexes=LRUCache(ttl=float("inf"))), fetched
+
+    @pytest.mark.asyncio
+    async def test_only_missing_gaps_are_fetched(self):
+        from datetime import datetime
+
+        events = [
+            self._event("a", "2024-03-04T09:00:00", "2024-03-04T10:00:00"),
+            self._event("long", "2024-03-01T00:00:00", "2024-03-20T00:00:00"),
+            self._event("b", "2024-03-12T09:00:00", "2024-03-12T10:00:00"),
+        ]
+        service, fetched = self._service(events)
+
+        week1 = await service.get_events_in_range(datetime(2024, 3, 4), datetime(2024, 3, 11))
+        assert [e.id for e in week1] == ["long", "a"]
+        assert await service.get_events_in_range(datetime(2024, 3, 5), datetime(2024, 3, 6))
+        assert len(fetched) == 1
+
+        both = await service.get_events_in_range(datetime(2024, 3, 4), datetime(2024, 3, 18))
+        assert [e.id for e in both] == ["long", "a", "b"]
+        assert len(fetched) == 2
+        assert "startDateTime=2024-03-11T00:00:00Z&endDateTime=2024-03-18T00:00:00Z" in fetched[1]
+        assert "$select=" in fetched[1]
+
+    @pytest.mark.asyncio
+    async def test_refetched_windows_replace_their_events(self):
+        from datetime import datetime, timezone
+        from src.services.calendar_service import EventRangeIndex
+
+        index = EventRangeIndex(ttl=0)
+        start, end = datetime(2024, 3, 4, tzinfo=timezone.utc), datetime(2024, 3, 5, tzinfo=timezone.utc)
+        index.add(start, end, [self._event("gone", "2024-03-04T09:00:00", "2024-03-04T10:00:00")])
+        assert index.missing(start, end) == [(start, end)]  # expired straight away
+
+        index.add(start, end, [self._event("new", "2024-03-04T11:00:00", "2024-03-04T12:00:00")])
+        assert [e["id"] for e in index.query(start, end)] == ["new"]
+        assert len(index) == 1
+
+    @pytest.mark.asyncio
+    async def test_creating_an_event_drops_the_range_index(self):
+        from datetime import datetime
+        from src.models.calendar import CreateEventRequest
+
+        service, fetched = self._service([])
+        await service.get_events_in_range(datetime(2024, 3, 4), datetime(2024, 3, 11))
+        service.client.post = AsyncMock(return_value=self._event("x", "2024-03-04T12:00:00", "2024-03-04T13:00:00"))
+        await service.create_event(CreateEventRequest(
+            subject="x", start_time=datetime(2024, 3, 4, 12), end_time=datetime(2024, 3, 4, 13)))
+        await service.get_events_in_range(datetime(2024, 3, 4), datetime(2024, 3, 11))
+        assert len(fetched) == 2
+
+class TestCalendarBulkCreate:
+    def _event(self, event_id):
+        return {"id": event_id, "subject": event_id,
+                "start": {"dateTime": "2024-03-04T12:00:00"}, "end": {"dateTime": "2024-03-04T13:00:00"}}
+
+    def _requests(self, count):
+        from datetime import datetime
+        from src.models.calendar import CreateEventRequest
+
+        return [CreateEventRequest(subject=f"e{i}", start_time=datetime(2024, 3, 4, 12),
+                                   end_time=datetime(2024, 3, 4, 13), attendees=["ana@example.com"])
+                for i in range(count)]
+
+    def _service(self, *rounds):
+        from src.core.cache import LRUCache
+        from src.core.retry import RetryPolicy
+        from src.services.calendar_service import CalendarService
+
+        client = Mock()
+        client.subject = "owner"
+        client.retry_policy = RetryPolicy(max_attempts=3, base_delay=0)
+        client.send_batch = AsyncMock(side_effect=list(rounds))
+        return CalendarService(client, schedule_cache=LRUCache(ttl=60),
+                               range_indexes=LRUCache(ttl=float("inf"))), client
+
+    @pytest.mark.asyncio
+    async def test_reports_failures_and_retries_only_throttled_items(self):
+        from src.core.exceptions import GraphAPIException
+
+        throttled = GraphAPIException(429, "Too many requests", headers={"Retry-After": "0"})
+        service, client = self._service(
+            [self._event("a"), GraphAPIException(400, "Bad attendee"), throttled],
+            [self._event("c")],
+        )
+        service.range_indexes.set("owner", object())
+        service.schedule_cache.set(("owner", "ana@example.com", None), [])
+
+        result = await service.create_events(self._requests(3))
+
+        assert (result.created, result.failed, result.failed_indexes) == (2, 1, [1])
+        assert [item.status for item in result.items] == ["created", "failed", "created"]
+        assert result.items[1].status_code == 400 and result.items[2].event.id == "c"
+        first, second = [call.args[0] for call in client.send_batch.await_args_list]
+        assert [r.body["subject"] for r in first] == ["e0", "e1", "e2"]
+        assert [r.body["subject"] for r in second] == ["e2"]
+        assert first[0].method == "POST" and first[0].url == "/me/events" and not first[0].retry
+        assert len(service.range_indexes) == 0 and len(service.schedule_cache) == 0
+
+    @pytest.mark.asyncio
+    async def test_gives_up_on_items_still_throttled(self):
+        from src.core.exceptions import GraphAPIException
+
+        throttled = GraphAPIException(503, "Unavailable")
+        service, client = self._service(*([[throttled]] * 3))
+
+        result = await service.create_events(self._requests(1))
+        assert result.failed_indexes == [0] and result.items[0].status_code == 503
+        assert client.send_batch.await_count == 3
+
+    @pytest.mark.asyncio
+    async def test_lost_batch_reply_is_not_resent(self):
+        from src.core.exceptions import GraphAPIException
+
+        # What GraphClient raises when the connection drops before the reply.
+        lost = GraphAPIException(503, "Graph API unreachable")
+        service, client = self._service(lost)
+        client.send_batch.side_effect = [[self._event("x")] * 20, lost]
+
+        result = await service.create_events(self._requests(25))
+        assert client.send_batch.await_count == 2
+        assert result.created == 20 and result.failed == 5
+        assert {item.status_code for item in result.items if item.status == "failed"} == {503}
+
+        service, client = self._service(GraphAPIException(429, "Too many requests",
+                                                          headers={"Retry-After": "0"}),
+                                        [self._event("y")])
+        result = await service.create_events(self._requests(1))
+        assert client.send_batch.await_count == 2 and result.created == 1
+
+    def test_event_payload(self):
+        from src.services.calendar_service import CalendarService
+
+        payload = CalendarService.event_payload(self._requests(1)[0])
+        assert payload["start"] == {"dateTime": "2024-03-04T12:00:00", "timeZone": "UTC"}
+        assert payload["attendees"][0]["emailAddress"] == {"address": "ana@example.com"}
+
+class TestDriveCrawl:
+    # folder id -> children; "locked" cannot be listed
+    TREE = {
+        "root": [("docs", 2), ("empty", 0), ("locked", 1), ("readme.md", None)],
+        "docs": [("2024", 1), ("a.pdf", None)],
+        "2024": [("b.pdf", None)],
+    }
+
+    def _service(self, page_limit=2, delay=0.0, failures=None):
+        import asyncio
+        import json
+        import httpx
+        from src.core.graph_client import GraphClient
+        from src.core.retry import RetryPolicy
+        from src.services.drive_service import DriveService
+
+        stats = {"listed": [], "batches": 0, "in_flight": 0, "peak": 0}
+
+        def page(folder, skip):
+            # folder -> statuses answered before its real listing
+            if (failures or {}).get(folder):
+                return failures[folder].pop(0), {"error": {"code": "busy", "message": "Busy"}}
+            if folder not in self.TREE:
+                return 403, {"error": {"code": "accessDenied", "message": "Access denied"}}
+            children = self.TREE[folder]
+            items = [{"id": name, "name": name,
+                      **({"folder": {"childCount": count}} if count is not None else {"file": {}})}
+                     for name, count in children[skip:skip + page_limit]]
+            body = {"value": items}
+            if skip + page_limit < len(children):
+                body["@odata.nextLink"] = (f"https://graph.microsoft.com/v1.0/me/drive/items/"
+                                           f"{folder}/children?skip={skip + page_limit}")
+            return 200, body
+
+        def listing(url):
+            path, _, query = url.partition("?")
+            folder = "root" if path.endswith("/root/children") else path.split("/")[-2]
+            params = dict(part.split("=", 1) for part in query.split("&") if "=" in part)
+            stats["listed"].append(folder)
+            return page(folder, int(params.get("skip", 0)))
+
+        async def handler(request):
+            stats["in_flight"] += 1
+            stats["peak"] = max(stats["peak"], stats["in_flight"])
+            try:
+                await asyncio.sleep(delay)
+                if request.url.path.endswith("/$batch"):
+                    stats["batches"] += 1
+                    responses = []
+                    for item in json.loads(request.content)["requests"]:
+                        status, body = listing(item["url"])
+                        responses.append({"id": item["id"], "status": status, "body": body,
+                                          "headers": {"Retry-After": "0"}})
+                    return httpx.Response(200, json={"responses": responses})
+                status, body = listing(str(request.url))
+                return httpx.Response(status, json=body)
+            finally:
+                stats["in_flight"] -= 1
+
+        http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        client = GraphClient("token", http_client=http, cache=False, single_flight=False,
+                             retry_policy=RetryPolicy(max_attempts=1))
+        return DriveService(client), stats
+
+    @pytest.mark.asyncio
+    async def test_walks_every_folder_and_page(self):
+        service, stats = self._service()
+        names = [item.name async for item in service.crawl(concurrency=1)]
+
+        assert names == ["docs", "empty", "locked", "readme.md", "2024", "a.pdf", "b.pdf"]
+        # Empty folders are never listed; the locked one is skipped.
+        assert sorted(set(stats["listed"])) == ["2024", "docs", "locked", "root"]
+
+    @pytest.mark.asyncio
+    async def test_lists_folders_concurrently_and_in_batches(self):
+        service, stats = self._service(page_limit=10, delay=0.01)
+        names = {item.name async for item in service.crawl(concurrency=4)}
+        assert len(names) == 7 and stats["peak"] >= 2
+
+        service, stats = self._service(page_limit=10)
+        names = {item.name async for item in service.crawl(concurrency=1, batch=True)}
+        assert len(names) == 7
+        # docs and locked share one $batch; 2024 is alone and sent directly.
+        assert stats["batches"] == 1
+
+    @pytest.mark.asyncio
+    async def test_throttled_batch_folders_are_listed_again(self):
+        from src.core.exceptions import GraphAPIException
+        from src.core.retry import RetryPolicy
+
+        service, stats = self._service(page_limit=10, failures={"docs": [429, 503]})
+        service.client.retry_policy = RetryPolicy(max_attempts=3, base_delay=0)
+        names = {item.name async for item in service.crawl(concurrency=1, batch=True)}
+        # Nothing below docs goes missing; only docs was asked for again.
+        assert len(names) == 7
+        assert stats["batches"] == 3 and stats["listed"].count("docs") == 3
+
+        service, stats = self._service(page_limit=10, failures={"docs": [503] * 3})
+        with pytest.raises(GraphAPIException) as excinfo:
+            [item async for item in service.crawl(concurrency=1, batch=True)]
+        assert excinfo.value.status_code == 503
+
+    @pytest.mark.asyncio
+    async def test_max_depth_and_early_exit(self):
+        service, stats = self._service(page_limit=10)
+        names = [item.name async for item in service.crawl(max_depth=0)]
+        assert names == ["docs", "empty", "locked", "readme.md"]
+        assert stats["listed"] == ["root"]
+
+        crawl = service.crawl(concurrency=2)
+        assert (await crawl.__anext__()).name == "docs"
+        await crawl.aclose()
+
+class TestDriveMirror:
+    def _item(self, path, content, item_id=None):
+        from src.core.quickxor import QuickXorHash
+        from src.models.drive import FileItem
+
+        folder, _, name = path.rpartition("/")
+        return FileItem(id=item_id or path, name=name, size=len(content),
+                        file={"hashes": {"quickXorHash": QuickXorHash(content).b64digest()}},
+                        parentReference={"path": "/drive/root:/Backups" + (f"/{folder}" if folder else "")})
+
+    def _drive(self, remote, folder="Backups"):
+        drive = Mock()
+
+        async def crawl(folder_path="root"):
+            assert folder_path == folder
+            for item in remote:
+                yield item
+
+        drive.crawl = crawl
+        drive.upload_file = AsyncMock()
+        return drive
+
+    @pytest.mark.asyncio
+    async def test_push_uploads_only_changed_files_and_reuses_manifest(self, tmp_path):
+        from src.services.mirror_service import DriveMirror
+
+        (tmp_path / "2024").mkdir()
+        (tmp_path / "2024" / "enero.csv").write_bytes(b"a,b\n1,2\n")
+        (tmp_path / "2024" / "febrero.csv").write_bytes(b"a,b\n3,4\n")
+        (tmp_path / "notes.txt").write_bytes(b"new")
+        drive = self._drive([self._item("2024/enero.csv", b"a,b\n1,2\n"),
+                             self._item("2024/febrero.csv", b"old")])
+
+        result = await DriveMirror(drive, str(tmp_path), "/Backups/", concurrency=2).push()
+        assert sorted(result.uploaded) == ["2024/febrero.csv", "notes.txt"]
+        assert result.unchanged == 1 and result.bytes_transferred == 11
+        uploaded = {call.args[0]: call.args[1] for call in drive.upload_file.await_args_list}
+        assert uploaded["Backups/2024/febrero.csv"] == b"a,b\n3,4\n"
+
+        with patch("src.services.mirror_service.file_hashes") as rehash:
+            mirror = DriveMirror(drive, str(tmp_path), "Backups")
+            assert len(mirror.manifest) == 3
+            mirror.scan_local()
+        rehash.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_pull_downloads_and_verifies_content(self, tmp_path):
+        from src.services.mirror_service import DriveMirror
+
+        contents = {"a": b"fresh report", "b": b"expected", "c": None}
+
+        async def open_download(item_id):
+            stream = Mock()
+
+            async def aiter_bytes(chunk_size):
+                yield (contents[item_id] or b"cut off")[:5]
+                if contents[item_id] is None:
+                    raise OSError("Connection reset")
+                yield contents[item_id][5:]
+
+            stream.aiter_bytes = aiter_bytes
+            stream.aclose = AsyncMock()
+            return stream
+
+        drive = self._drive([self._item("2024/enero.csv", b"fresh report", "a"),
+                             self._item("corrupt.bin", b"something else", "b"),
+                             self._item("cut.bin", b"cut off", "c")])
+        drive.open_download = open_download
+
+        result = await DriveMirror(drive, str(tmp_path), "Backups").pull()
+        assert result.downloaded == ["2024/enero.csv"]
+        assert sorted(result.failed) == ["corrupt.bin", "cut.bin"]
+        assert (tmp_path / "2024" / "enero.csv").read_bytes() == b"fresh report"
+        assert [path.name for path in tmp_path.iterdir() if path.suffix != ".json"] == ["2024"]
+
+        again = await DriveMirror(drive, str(tmp_path), "Backups").pull()
+        assert again.downloaded == [] and again.unchanged == 1
+
+    @pytest.mark.asyncio
+    async def test_remote_root_is_quoted_in_the_crawl_path(self, tmp_path):
+        from src.services.mirror_service import DriveMirror
+
+        drive = self._drive([], folder="Copias%20de%20seguridad/2024%23")
+        result = await DriveMirror(drive, str(tmp_path), "/Copias de seguridad/2024#").pull()
+        assert result.downloaded == [] and result.unchanged == 0
+
+    @pytest.mark.asyncio
+    async def test_upload_skipped_when_content_is_unchanged(self):
+        from src.core.quickxor import QuickXorHash
+        from src.services.drive_service import DriveService
+
+        content = b"mes,total\nenero,10\n"
+        client = Mock()
+        client.get = AsyncMock(return_value={
+            "id": "1", "name": "r.csv", "size": len(content),
+            "file": {"hashes": {"quickXorHash": QuickXorHash(content).b64digest()}}})
+        client.put = AsyncMock(return_value={"id": "1", "name": "r.csv"})
+        service = DriveService(client)
+
+        item, uploaded = await service.upload_file_if_changed("reportes/r.csv", content)
+        assert (item.id, uploaded) == ("1", False)
+        client.put.assert_not_called()
+
+        _, uploaded = await service.upload_file_if_changed("reportes/r.csv", content + b"febrero,7\n")
+        assert uploaded and client.put.await_count == 1
+
+class TestMailSearchIndex:
+    def _message(self, message_id, subject, received, sender="ana@contoso.com", body=None, **extra):
+        message = {"id": message_id, "subject": subject, "receivedDateTime": received,
+                   "from": {"emailAddress": {"name": "Ana", "address": sender}}, **extra}
+        if body is not None:
+            message["body"] = {"contentType": "html", "content": body}
+        return message
+
+    def _index(self, tmp_path):
+        from src.services.search_service import MailSearchIndex
+
+        index = MailSearchIndex(str(tmp_path / "search.db"))
+        index.apply_round("owner", "inbox", [
+            self._message("1", "Factura de marzo", "2024-03-01T10:00:00Z",
+                          body="<style>p {color: red}</style><p>Adjunto la factura &amp; el recibo</p>"),
+            self._message("2", "Reunión de presupuesto", "2024-03-05T09:00:00Z", sender="luis@contoso.com",
+                          body="<p>Revisamos la factura pendiente</p>"),
+            self._message("3", "Almuerzo", "2024-03-07T12:00:00Z", bodyPreview="nos vemos"),
+        ])
+        index.apply_round("other", "inbox", [self._message("9", "Factura ajena", "2024-03-01T00:00:00Z")])
+        return index
+
+    def test_ranks_matches_and_applies_filters(self, tmp_path):
+        from datetime import datetime, timezone
+
+        index = self._index(tmp_path)
+        hits = index.search("owner", "factura")
+        # A subject hit outranks a body hit; other owners never show up.
+        assert [hit.message.id for hit in hits] == ["1", "2"]
+        assert hits[0].score > hits[1].score
+        assert "[factura]" in hits[1].snippet
+
+        assert [h.message.id for h in index.search("owner", "reunion")] == ["2"]  # diacritics folded
+        assert index.search("owner", "presu") == []
+        assert [h.message.id for h in index.search("owner", "presu*")] == ["2"]
+        assert index.search("owner", "color") == []  # <style> content is not indexed
+        assert [h.message.id for h in index.search("owner", "factura", sender="LUIS@contoso.com")] == ["2"]
+        assert [h.message.id for h in index.search(
+            "owner", "factura", since=datetime(2024, 3, 2, tzinfo=timezone.utc))] == ["2"]
+        assert [h.message.id for h in index.search("owner", "", until=datetime(2024, 3, 6))] == ["2", "1"]
+        # FTS5 operators in the input are plain words, never syntax errors.
+        assert index.search("owner", 'factura" OR NEAR(') == []
+        assert len(index.search("owner", '"factura')) == 2
+        index.close()
+
+    def test_incremental_updates_and_removals(self, tmp_path):
+        index = self._index(tmp_path)
+        index.apply_round("owner", "inbox", [{"id": "1", "isRead": True},
+                                             {"id": "3", "subject": "Factura urgente"}], ["2"])
+        hits = index.search("owner", "factura")
+        assert [hit.message.id for hit in hits] == ["3", "1"]
+        assert hits[1].message.isRead is True and hits[1].message.subject == "Factura de marzo"
+
+        index.apply_round("owner", "inbox", [self._message("4", "Nuevo", "2024-04-01T00:00:00Z")], reset=True)
+        assert index.count("owner") == 1 and index.count("other") == 1
+        assert index.search("owner", "factura") == []
+        index.close()
+
+    def test_rank_window_keeps_the_most_recently_received(self, tmp_path):
+        from src.services.search_service import MailSearchIndex
+
+        index = MailSearchIndex(str(tmp_path / "search.db"), rank_window=2)
+        # Indexed newest first, as delta rounds often deliver them.
+        index.apply_round("owner", "inbox", [
+            self._message("new", "Factura", "2024-05-01T10:00:00Z"),
+            self._message("twin", "Factura", "2024-05-01T10:00:00Z"),
+            self._message("old", "Factura factura", "2024-01-01T10:00:00Z", sender="luis@contoso.com"),
+        ])
+        assert {h.message.id for h in index.search("owner", "factura")} == {"new", "twin"}
+        assert [h.message.id for h in index.search("owner", "factura", sender="luis@contoso.com")] == ["old"]
+
+        # A message whose received time changes moves to its new place in the window.
+        index.apply_round("owner", "inbox", [{"id": "old", "receivedDateTime": "2024-06-01T00:00:00Z"}])
+        assert [h.message.id for h in index.search("owner", "factura")][0] == "old"
+        assert index.count("owner") == 3
+        index.close()
+
+    def test_fts_query_escapes_user_input(self):
+        from src.services.search_service import fts_query
+
+        assert fts_query('"estado de cuenta" marzo fac*') == '"estado de cuenta" "marzo" "fac"*'
+        assert fts_query('informe "final" OR') == '"informe" "final" "OR"'
+        assert fts_query('-*() ""') is None
+
+
+class TestSubscriptions:
+    WEBHOOK = "http://testserver/api/v1/subscriptions/notifications"
+
+    def _graph(self, sender, calls, gone=()):
+        """Fake Graph /subscriptions that runs the validation handshake like Graph does."""
+        import json
+        import httpx
+        from src.core.graph_client import GraphClient
+        from src.core.retry import RetryPolicy
+
+        async def handler(request):
+            calls.append(request.method)
+            subscription_id = request.url.path.rsplit("/", 1)[-1]
+            if request.method == "POST":
+                if not await sender.validate():
+                    return httpx.Response(400, json={"error": {"message": "Validation failed"}})
+                body = json.loads(request.content)
+                return httpx.Response(201, json={"id": f"sub-{len(calls)}", **body})
+            if subscription_id in gone:
+                return httpx.Response(404, json={"error": {"message": "Not found"}})
+            if request.method == "PATCH":
+                body = json.loads(request.content)
+                return httpx.Response(200, json={"id": subscription_id, "resource": "me/events",
+                                                 "changeType": "created", **body})
+            return httpx.Response(204)
+
+        http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        async def factory():
+            return GraphClient("token", http_client=http, cache=False, single_flight=False,
+                               retry_policy=RetryPolicy(max_attempts=1))
+
+        return factory
+
+    def _setup(self, tmp_path, gone=()):
+        import httpx
+        from src.api.deps import get_subscription_manager
+        from src.main import app
+        from src.services.subscription_service import (LocalNotificationSender, NotificationHub,
+                                                       SubscriptionManager, SubscriptionStore)
+
+        store = SubscriptionStore(str(tmp_path / "subscriptions.db"))
+        manager = SubscriptionManager(NotificationHub(queue_size=2), store, self.WEBHOOK)
+        app.dependency_overrides[get_subscription_manager] = lambda: manager
+        webhook = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://testserver")
+        sender = LocalNotificationSender(webhook, self.WEBHOOK)
+        calls = []
+        return manager, sender, self._graph(sender, calls, gone), calls
+
+    def teardown_method(self):
+        from src.main import app
+        app.dependency_overrides = {}
+
+    @pytest.mark.asyncio
+    async def test_validated_notifications_reach_every_consumer(self, tmp_path):
+        manager, sender, factory, calls = self._setup(tmp_path)
+        received, audited = [], []
+
+        async def on_change(notification):
+            received.append(notification.resource)
+
+        async def audit(notification):
+            audited.append(notification.changeType)
+
+        manager.hub.add_consumer(on_change)
+        manager.hub.add_consumer(audit)
+        subscription = await manager.create("owner", factory, "mail")
+        client_state = (await manager.lookup(subscription.id)).client_state
+        assert subscription.resource == "me/mailFolders('inbox')/messages"
+        assert subscription.lifecycleNotificationUrl == self.WEBHOOK
+
+        response = await sender.send([
+            sender.notification(subscription, client_state, resource_id="m1"),
+            sender.notification(subscription, "forged", resource_id="m2"),
+            sender.notification(subscription.model_copy(update={"id": "unknown"}), client_state),
+        ])
+        await manager.hub.join()
+
+        assert response.status_code == 202
+        assert received == ["me/mailFolders('inbox')/messages/m1"] and audited == ["created"]
+        assert manager.rejected == 2
+        await manager.close()
+
+    @pytest.mark.asyncio
+    async def test_full_consumer_queue_drops_without_blocking(self, tmp_path):
+        import asyncio
+        manager, sender, factory, _ = self._setup(tmp_path)
+        release = asyncio.Event()
+        handled = []
+
+        async def slow(notification):
+            await release.wait()
+            handled.append(notification.resource)
+
+        async def failing(notification):
+            raise RuntimeError("boom")
+
+        manager.hub.add_consumer(slow)
+        manager.hub.add_consumer(failing)
+        subscription = await manager.create("owner", factory, "events")
+        client_state = (await manager.lookup(subscription.id)).client_state
+        burst = [sender.notification(subscription, client_state, resource_id=f"e{i}") for i in range(4)]
+        assert (await sender.send(burst)).status_code == 202
+
+        release.set()
+        await manager.hub.join()
+        # Each consumer's queue holds 2, so both drop the rest of the burst;
+        # the failing consumer keeps going after each error.
+        assert handled == ["me/events/e0", "me/events/e1"]
+        assert manager.hub.dropped == 4
+        await manager.close()
+
+    @pytest.mark.asyncio
+    async def test_renews_before_expiry_and_on_reauthorization(self, tmp_path):
+        import asyncio
+        from datetime import datetime, timedelta, timezone
+        manager, sender, factory, calls = self._setup(tmp_path, gone=("sub-2",))
+        accounts = []
+
+        async def account_client(account_id):
+            accounts.append(account_id)
+            return await factory()
+
+        manager.account_client = account_client
+        first = await manager.create("owner", factory, "drive", account_id="account-1")
+        second = await manager.create("owner", factory, "events", account_id="account-1")
+        assert first.changeType == "updated" and first.lifecycleNotificationUrl is None
+
+        assert await manager.renew_due() == 0
+        later = datetime.now(timezone.utc) + timedelta(minutes=manager.lifetime_minutes)
+        # sub-2 was removed in Graph, so its renewal drops it.
+        assert await manager.renew_due(now=later) == 1
+        assert [s.id for s in await manager.subscriptions("owner")] == [first.id]
+        assert await manager.subscriptions("other") == []
+
+        state = (await manager.lookup(first.id)).client_state
+        await sender.send([sender.notification(first, state, lifecycle_event="reauthorizationRequired")])
+        await asyncio.gather(*manager._pending)
+        assert calls.count("PATCH") == 3
+        # Background renewals never use the session that created the subscription.
+        assert accounts == ["account-1"] * 3
+
+        assert await manager.delete("other", first.id) is False
+        assert await manager.delete("owner", first.id) is True
+        assert await manager.subscriptions("owner") == [] and second.id == "sub-2"
+        await manager.close()
+
+    @pytest.mark.asyncio
+    async def test_subscriptions_survive_restart_and_drive_delta_sync(self, tmp_path):
+        import httpx
+        from src.core.graph_client import GraphClient
+        from src.core.retry import RetryPolicy
+        from src.core.tokens import token_subject
+        from src.services.search_service import MailSearchIndex
+        from src.services.subscription_service import (DeltaSyncConsumer, NotificationHub,
+                                                       SubscriptionManager, SubscriptionStore)
+        from src.services.sync_service import SyncStore
+        manager, sender, factory, calls = self._setup(tmp_path)
+        subscription = await manager.create("owner", factory, "mail", folder="archive",
+                                            account_id="account-1")
+        unsynced = await manager.create("owner", factory, "events", account_id="account-1")
+        client_state = (await manager.lookup(subscription.id)).client_state
+        await manager.close()
+
+        rounds = []
+
+        def graph(request):
+            rounds.append(request.url.path)
+            return httpx.Response(200, json={"value": [{"id": "m2", "receivedDateTime": "2024-01-02"}],
+                                             "@odata.deltaLink": "https://graph/delta?token=2"})
+
+        http = httpx.AsyncClient(transport=httpx.MockTransport(graph))
+
+        async def account_client(account_id):
+            return GraphClient("token", http_client=http, cache=False, single_flight=False,
+                               retry_policy=RetryPolicy(max_attempts=1))
+
+        sync_store = SyncStore(str(tmp_path / "sync.db"))
+        index = MailSearchIndex(str(tmp_path / "search.db"))
+        owner = token_subject("token")
+        sync_store.apply_round(owner, "mail:archive", [{"id": "m1"}], [], "https://graph/delta?token=1",
+                               "receivedDateTime")
+
+        # A fresh process: same database, no state in memory.
+        restarted = SubscriptionManager(NotificationHub(), SubscriptionStore(manager.store.path),
+                                        self.WEBHOOK, account_client=account_client)
+        restarted.hub.add_consumer(DeltaSyncConsumer(restarted, sync_store, index, delay=0.01))
+        accepted = await restarted.accept({"value": [
+            *(sender.notification(subscription, client_state, resource_id=f"m{n}") for n in (2, 3, 4)),
+            sender.notification(unsynced, (await restarted.lookup(unsynced.id)).client_state),
+        ]})
+        await restarted.hub.join()
+
+        assert accepted == (4, 0)
+        # A burst for the folder synced before gets one delta round; the
+        # calendar was never synced.
+        assert rounds == ["/delta"]
+        assert [item["id"] for item in sync_store.list_items(owner, "mail:archive", 10)] == ["m1", "m2"]
+        await restarted.close()
+        sync_store.close()
+        index.close()